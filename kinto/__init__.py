@@ -3,10 +3,14 @@ import logging
 
 import kinto.core
 from pyramid.config import Configurator
+from pyramid.events import NewRequest
 from pyramid.settings import asbool
 from pyramid.security import Authenticated, Everyone
 
 from kinto.authorization import RouteFactory
+from kinto.cascade import CascadeDeletion
+from kinto.views import ParentsCache
+from kinto.views.records import ValidatorsCache
 
 
 # Module version, as defined in PEP-0396.
@@ -36,7 +40,11 @@ DEFAULT_SETTINGS = {
     'bucket_id_generator': 'kinto.views.NameGenerator',
     'collection_id_generator': 'kinto.views.NameGenerator',
     'group_id_generator': 'kinto.views.NameGenerator',
-    'record_id_generator': 'kinto.views.RelaxedUUID'
+    'record_id_generator': 'kinto.views.RelaxedUUID',
+    'cascade_deletion_background': False,
+    'cascade_deletion_chunk_size': 1000,
+    'cascade_deletion_interval_seconds': 5,
+    'cascade_deletion_lease_seconds': 60,
 }
 
 
@@ -64,6 +72,28 @@ def main(global_config, config=None, **settings):
             url="https://kinto.readthedocs.io/en/latest/api/1.x/"
                 "collections.html#collection-json-schema")
 
+    # Parent buckets and collections, shared across requests, when it saves
+    # storage reads.
+    parents_cache_enabled = asbool(settings['storage_timestamps_cache'])
+    config.registry.parents_cache = ParentsCache(enabled=parents_cache_enabled)
+    # Compiled JSON schemas of collections.
+    config.registry.validators_cache = ValidatorsCache()
+    # Deletion of buckets and collections children.
+    cascade_deletion = CascadeDeletion(
+        storage=config.registry.storage,
+        permission=config.registry.permission,
+        statsd=config.registry.statsd,
+        background=asbool(settings['cascade_deletion_background']),
+        chunk_size=int(settings['cascade_deletion_chunk_size']),
+        interval=float(settings['cascade_deletion_interval_seconds']),
+        lease=float(settings['cascade_deletion_lease_seconds']),
+        # Like parents, when it saves storage reads.
+        cache_jobs=parents_cache_enabled)
+    config.registry.cascade_deletion = cascade_deletion
+    # Pending jobs are resumed once the (forked) process serves requests.
+    config.add_subscriber(lambda event: cascade_deletion.ensure_worker(),
+                          NewRequest)
+
     # Scan Kinto views.
     kwargs = {}
 
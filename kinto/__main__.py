@@ -40,7 +40,8 @@ def main(args=None):
                         const=logging.DEBUG, dest='verbosity',
                         help='Show all messages, including debug messages.')
 
-    commands = ('init', 'start', 'migrate', 'delete-collection', 'version')
+    commands = ('init', 'start', 'migrate', 'delete-collection',
+                'purge-tombstones', 'version')
     subparsers = parser.add_subparsers(title='subcommands',
                                        description='Main Kinto CLI commands',
                                        dest='subcommand',
@@ -73,6 +74,13 @@ def main(args=None):
             subparser.add_argument('--collection',
                                    help='The collection to remove.',
                                    required=True)
+        elif command == 'purge-tombstones':
+            subparser.add_argument('--older-than',
+                                   type=int,
+                                   help='Purge the tombstones older than '
+                                        'this number of seconds.',
+                                   dest='older_than',
+                                   required=True)
 
         elif command == 'start':
             subparser.add_argument('--reload',
@@ -141,6 +149,10 @@ def main(args=None):
                                          parsed_args['bucket'],
                                          parsed_args['collection'])
 
+    elif which_command == 'purge-tombstones':
+        env = bootstrap(config_file)
+        return scripts.purge_tombstones(env, parsed_args['older_than'])
+
     elif which_command == 'start':
         pserve_argv = ['pserve', config_file]
         if parsed_args['reload']:
@@ -0,0 +1,293 @@
+import os
+import threading
+from collections import OrderedDict
+
+import transaction
+
+from kinto.core import logger
+from kinto.core.storage import Filter, Sort, exceptions as storage_exceptions
+from kinto.core.utils import COMPARISON, msec_time
+
+
+class CascadeDeletion(object):
+    """Delete the children of deleted buckets and collections.
+
+    Jobs are stored in the storage backend along with the deletion of their
+    parent, and processed by chunks of ``chunk_size`` objects, each in its own
+    transaction. Since the state of a job is the remaining objects, it can be
+    resumed by any process after a restart.
+
+    Each job records the timestamps of the children collections at the time
+    of the deletion, and only deletes the children that were not modified
+    since. If the parent is created again before its job is completed, the
+    children left over remain hidden (see :meth:`is_left_over`).
+
+    When ``background`` is enabled, a thread processes the pending jobs every
+    ``interval`` seconds in each process. A job is claimed for ``lease``
+    seconds, renewed after each chunk, so that processes do not delete the
+    same objects concurrently. Otherwise, children are deleted within the
+    deletion request, and no job is scheduled.
+
+    When ``cache_jobs`` is enabled, the pending jobs looked up by requests
+    (or their absence) are cached, and validated against the timestamp of
+    the jobs collection, like :class:`kinto.views.ParentsCache` entries.
+    """
+    collection_id = 'cascade_deletion'
+
+    children = {
+        'bucket': ('collection', 'group'),
+        'collection': ('record',),
+    }
+    """Resources names of the children, by parent resource name."""
+
+    def __init__(self, storage, permission, statsd=None, background=False,
+                 chunk_size=1000, interval=5, lease=60, cache_jobs=False,
+                 cache_size=1000):
+        self.storage = storage
+        self.permission = permission
+        self.statsd = statsd
+        self.background = background
+        self.chunk_size = chunk_size
+        self.interval = interval
+        self.lease = lease
+        self.cache_jobs = cache_jobs
+        self.cache_size = cache_size
+
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._jobs = OrderedDict()
+        self._jobs_lock = threading.Lock()
+
+    def enqueue(self, resource_name, uri):
+        """Schedule the deletion of the children of the specified bucket
+        or collection, within the current transaction.
+        """
+        children = self.children.get(resource_name)
+        if not children:
+            return
+        timestamps = {}
+        for child in children:
+            timestamps[child] = self.storage.collection_timestamp(
+                collection_id=child, parent_id=uri)
+        job = {'resource_name': resource_name, 'timestamps': timestamps,
+               'claimed_until': 0}
+        self.storage.update(collection_id=self.collection_id, parent_id='',
+                            object_id=uri, record=job)
+
+    def hidden_before(self, uri, resource_name):
+        """Return the timestamp up to which the children of the specified
+        object are left over by its pending job, or ``None``.
+        """
+        if not self.background:
+            return None
+        timestamps = self._pending_timestamps(uri)
+        if timestamps is None:
+            return None
+        return timestamps.get(resource_name)
+
+    def is_left_over(self, obj, parent_uri, resource_name,
+                     modified_field='last_modified'):
+        """Return whether the specified object is a child left over by the
+        pending job of its parent.
+        """
+        hidden_before = self.hidden_before(parent_uri, resource_name)
+        return hidden_before is not None and obj[modified_field] <= hidden_before
+
+    def _pending_timestamps(self, uri):
+        """Return the children timestamps of the pending job of the
+        specified object, or ``None``, from cache when the jobs were not
+        modified since.
+        """
+        if not self.cache_jobs:
+            return self._read_timestamps(uri)
+
+        # Read before the job, so that changes made in between invalidate
+        # the entry.
+        token = self.storage.collection_timestamp(
+            collection_id=self.collection_id, parent_id='')
+
+        with self._jobs_lock:
+            cached = self._jobs.pop(uri, None)
+            if cached is not None and cached[0] == token:
+                # Most recently used entries are kept at the end.
+                self._jobs[uri] = cached
+                return cached[1]
+
+        timestamps = self._read_timestamps(uri)
+
+        with self._jobs_lock:
+            self._jobs[uri] = (token, timestamps)
+            while len(self._jobs) > self.cache_size:
+                self._jobs.popitem(last=False)
+        return timestamps
+
+    def _read_timestamps(self, uri):
+        try:
+            job = self.storage.get(collection_id=self.collection_id,
+                                   parent_id='', object_id=uri)
+        except storage_exceptions.RecordNotFoundError:
+            return None
+        return job['timestamps']
+
+    def advance(self, uri):
+        """Process a chunk of the pending job of the specified object, within
+        the current transaction (e.g. before it is created again). Return the
+        number of deleted objects.
+        """
+        return self._process_chunk(uri)
+
+    def run_pending(self):
+        """Process the pending jobs chunk by chunk, committing each of them,
+        until there are none left to claim. Return the number of deleted
+        objects.
+        """
+        total = 0
+        while True:
+            with transaction.manager:
+                job = self._claim()
+            if job is None:
+                return total
+            while job is not None:
+                with transaction.manager:
+                    deleted = self._process_chunk(job['id'])
+                    total += deleted
+                    # Stop if another process took over the job.
+                    job = self._renew(job) if deleted else None
+
+    def ensure_worker(self):
+        if not self.background:
+            return
+        # Threads do not survive forks: start one per process.
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            self._pid = pid
+            thread = threading.Thread(target=self._work,
+                                      name='kinto-cascade-deletion')
+            thread.daemon = True
+            thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _work(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.run_pending()
+            except Exception as e:
+                logger.error('Cascade deletion failed: %s' % e)
+
+    def _claim(self):
+        """Claim the job whose lease expired first. Return ``None`` if every
+        job is claimed, or if another process claimed it meanwhile.
+        """
+        jobs, _ = self.storage.get_all(collection_id=self.collection_id,
+                                       parent_id='',
+                                       sorting=[Sort('claimed_until', 1)],
+                                       limit=1)
+        if not jobs or jobs[0]['claimed_until'] > msec_time():
+            return None
+        return self._renew(jobs[0])
+
+    def _renew(self, job):
+        """Extend the lease of the job, unless it was modified meanwhile
+        (e.g. claimed, completed or scheduled again).
+        """
+        record = {'resource_name': job['resource_name'],
+                  'timestamps': job['timestamps'],
+                  'claimed_until': msec_time() + int(self.lease * 1000)}
+        try:
+            return self.storage.update(collection_id=self.collection_id,
+                                       parent_id='', object_id=job['id'],
+                                       record=record,
+                                       if_match=job['last_modified'])
+        except (storage_exceptions.ModifiedMeanwhileError,
+                storage_exceptions.RecordNotFoundError):
+            return None
+
+    def _process_chunk(self, uri):
+        """Delete a chunk of children of the job object. Return the number of
+        deleted objects, or zero once the job was completed.
+        """
+        try:
+            job = self.storage.get(collection_id=self.collection_id,
+                                   parent_id='', object_id=uri)
+        except storage_exceptions.RecordNotFoundError:
+            # Completed meanwhile.
+            return 0
+
+        timestamps = job['timestamps']
+        if job['resource_name'] == 'collection':
+            deleted = self._delete_children(uri, 'record',
+                                            timestamps['record'])
+        else:
+            deleted = self._delete_bucket_children(uri, timestamps)
+
+        if deleted:
+            logger.info('Deleted %s objects of %s' % (deleted, uri))
+            if self.statsd:
+                self.statsd.count('cascade_deletion.deleted', count=deleted)
+            return deleted
+
+        # Leave a tombstone to bump the jobs timestamp, which invalidates the
+        # cached job, and purge it right away.
+        self.storage.delete(collection_id=self.collection_id, parent_id='',
+                            object_id=uri)
+        self.storage.purge_deleted(collection_id=self.collection_id,
+                                   parent_id='')
+        if self.statsd:
+            self.statsd.count('cascade_deletion.completed')
+        return 0
+
+    def _delete_bucket_children(self, bucket_uri, timestamps):
+        left_over = Filter('last_modified', timestamps['collection'],
+                           COMPARISON.MAX)
+        collections, _ = self.storage.get_all(collection_id='collection',
+                                              parent_id=bucket_uri,
+                                              filters=[left_over], limit=1)
+        if collections:
+            collection_id = collections[0]['id']
+            collection_uri = '%s/collections/%s' % (bucket_uri, collection_id)
+            # Left over collections are hidden: all their records are old.
+            deleted = self._delete_children(collection_uri, 'record')
+            if not deleted:
+                self.storage.delete(collection_id='collection',
+                                    parent_id=bucket_uri,
+                                    object_id=collection_id,
+                                    with_deleted=False)
+                self.permission.delete_object_permissions_by_ids([collection_uri])
+                deleted = 1
+            return deleted
+
+        # Purge the collections tombstones, then delete the groups.
+        self._delete_children(bucket_uri, 'collection', timestamps['collection'])
+        return self._delete_children(bucket_uri, 'group', timestamps['group'])
+
+    def _delete_children(self, parent_uri, resource_name, timestamp=None):
+        """Delete a chunk of children, modified before ``timestamp`` if
+        specified.
+        """
+        filters = None
+        before = None
+        if timestamp is not None:
+            filters = [Filter('last_modified', timestamp, COMPARISON.MAX)]
+            before = timestamp + 1
+        deleted = self.storage.delete_all(collection_id=resource_name,
+                                          parent_id=parent_uri,
+                                          filters=filters,
+                                          limit=self.chunk_size,
+                                          with_deleted=False)
+        if not deleted:
+            # Remove remaining tombstones too.
+            self.storage.purge_deleted(collection_id=resource_name,
+                                       parent_id=parent_uri,
+                                       before=before)
+            return 0
+        uris = ['%s/%ss/%s' % (parent_uri, resource_name, obj['id'])
+                for obj in deleted]
+        self.permission.delete_object_permissions_by_ids(uris)
+        return len(deleted)
@@ -46,6 +46,7 @@ DEFAULT_SETTINGS = {
         'kinto.core.initialization.setup_storage',
         'kinto.core.initialization.setup_permission',
         'kinto.core.initialization.setup_cache',
+        'kinto.core.initialization.setup_tombstones_retention',
         'kinto.core.initialization.setup_requests_scheme',
         'kinto.core.initialization.setup_version_redirection',
         'kinto.core.initialization.setup_deprecation',
@@ -78,6 +79,12 @@ DEFAULT_SETTINGS = {
     'storage_url': '',
     'storage_max_fetch_size': 10000,
     'storage_pool_size': 25,
+    'storage_timestamps_cache': False,
+    'storage_partitions': None,
+    'tombstones_retention_seconds': None,
+    'tombstones_purge_chunk_size': 1000,
+    'tombstones_purge_interval_seconds': 3600,
+    'tombstones_watermark_refresh_seconds': 60,
     'tm.annotate_user': False,  # Do annotate transactions with the user-id.
     'transaction_per_request': True,
     'userid_hmac_secret': '',
@@ -113,6 +113,7 @@ class RouteFactory(object):
     required_permission = None
     permission_object_id = None
     current_record = None
+    current_resource = None
     shared_ids = None
 
     method_permissions = {
@@ -143,6 +144,8 @@ class RouteFactory(object):
             # Try to fetch the target object. Its existence will affect permissions checking.
             if not self.on_collection and request.method.lower() in ("put", "delete", "patch"):
                 resource = service.resource(request=request, context=self)
+                # Save a reference, to reuse this instance's model in the view.
+                self.current_resource = resource
                 try:
                     # Save a reference, to avoid refetching from storage in resource.
                     self.current_record = resource.model.get_record(resource.record_id)
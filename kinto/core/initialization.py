@@ -31,6 +31,7 @@ from kinto.core import cache
 from kinto.core import storage
 from kinto.core import permission
 from kinto.core.logs import logger
+from kinto.core.tombstones import TombstonesRetention
 from kinto.core.events import ResourceRead, ResourceChanged, ACTIONS
 
 
@@ -243,6 +244,31 @@ def setup_cache(config):
     config.registry.heartbeats['cache'] = heartbeat
 
 
+def setup_tombstones_retention(config):
+    settings = config.get_settings()
+    storage_backend = getattr(config.registry, 'storage', None)
+    if storage_backend is None:
+        config.registry.tombstones_retention = None
+        return
+
+    retention = settings['tombstones_retention_seconds']
+    if retention is not None:
+        retention = float(retention)
+    tombstones_retention = TombstonesRetention(
+        storage=storage_backend,
+        retention=retention,
+        chunk_size=int(settings['tombstones_purge_chunk_size']),
+        interval=float(settings['tombstones_purge_interval_seconds']),
+        refresh=float(settings['tombstones_watermark_refresh_seconds']))
+    config.registry.tombstones_retention = tombstones_retention
+
+    if retention is not None:
+        # Purge periodically once the (forked) process serves requests.
+        def on_new_request(event):
+            tombstones_retention.ensure_worker()
+        config.add_subscriber(on_new_request, NewRequest)
+
+
 def setup_statsd(config):
     settings = config.get_settings()
     config.registry.statsd = None
@@ -164,6 +164,36 @@ class PermissionBase(object):
         """
         raise NotImplementedError
 
+    def delete_object_permissions_by_ids(self, object_ids):
+        """Delete the permissions of the listed objects in bulk.
+
+        Unlike :meth:`delete_object_permissions`, the object ids are matched
+        exactly (no wildcard). By default, the ids are passed to
+        :meth:`delete_object_permissions`, which backends can override with
+        a more efficient deletion.
+
+        :param list object_ids: The objects to remove permissions from.
+        """
+        return self.delete_object_permissions(*object_ids)
+
+    def delete_object_permissions_by_ids_chunked(self, object_ids,
+                                                 chunk_size=1000):
+        """Delete the permissions of the listed objects, by batches of
+        `chunk_size` objects to bound the size of each operation.
+
+        :param object_ids: The objects to remove permissions from. Any
+            iterable is accepted, so that huge lists do not have to be built.
+        :param int chunk_size: The number of objects per batch.
+        """
+        chunk = []
+        for object_id in object_ids:
+            chunk.append(object_id)
+            if len(chunk) == chunk_size:
+                self.delete_object_permissions_by_ids(chunk)
+                chunk = []
+        if chunk:
+            self.delete_object_permissions_by_ids(chunk)
+
 
 def heartbeat(backend):
     def ping(request):
@@ -151,13 +151,24 @@ class Permission(PermissionBase):
 
     @synchronized
     def delete_object_permissions(self, *object_id_list):
+        exact_ids = set([o for o in object_id_list if '*' not in o])
+        regexps = [re.compile('^%s$' % o.replace('*', '.*'))
+                   for o in object_id_list if '*' in o]
         to_delete = []
         for key in self._store.keys():
             object_id = key.split(':')[1]
-            for pattern in object_id_list:
-                regexp = re.compile('^%s$' % pattern.replace('*', '.*'))
-                if regexp.match(object_id):
-                    to_delete.append(key)
+            if object_id in exact_ids or \
+               any([regexp.match(object_id) for regexp in regexps]):
+                to_delete.append(key)
+        for k in to_delete:
+            del self._store[k]
+
+    @synchronized
+    def delete_object_permissions_by_ids(self, object_ids):
+        object_ids = set(object_ids)
+        to_delete = [key for key in self._store.keys()
+                     if key.startswith('permission:') and
+                     key.split(':')[1] in object_ids]
         for k in to_delete:
             del self._store[k]
 
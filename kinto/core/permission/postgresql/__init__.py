@@ -370,22 +370,30 @@ class Permission(PermissionBase):
         if len(object_id_list) == 0:
             return
 
-        object_ids_values = ','.join(["('%s')" % o.replace('*', '%')
-                                      for o in object_id_list])
+        # Only patterns require a LIKE, the index is used for the others.
+        object_ids = [o for o in object_id_list if '*' not in o]
+        patterns = [o.replace('*', '%') for o in object_id_list if '*' in o]
         query = """
-        WITH object_ids AS (
-          VALUES %(object_ids_values)s
-        )
         DELETE FROM access_control_entries
-         USING object_ids
-         WHERE object_id LIKE column1;"""
-        safeholders = {
-            'object_ids_values': object_ids_values
-        }
+         WHERE object_id = ANY(:object_ids)
+            OR object_id LIKE ANY(:patterns);"""
+        placeholders = dict(object_ids=object_ids, patterns=patterns)
+        with self.client.connect() as conn:
+            conn.execute(query, placeholders)
+
+    def delete_object_permissions_by_ids(self, object_ids):
+        object_ids = list(object_ids)
+        if len(object_ids) == 0:
+            return
+
+        query = """
+        DELETE FROM access_control_entries
+         WHERE object_id = ANY(:object_ids);"""
+        placeholders = dict(object_ids=object_ids)
         with self.client.connect() as conn:
-            conn.execute(query % safeholders)
+            conn.execute(query, placeholders)
 
 
-def load_from_config(config):
-    client = create_from_config(config, prefix='permission_')
+def load_from_config(config, url=None):
+    client = create_from_config(config, prefix='permission_', url=url)
     return Permission(client=client)
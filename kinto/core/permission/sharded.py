@@ -0,0 +1,135 @@
+from kinto.core.permission import PermissionBase, postgresql
+from kinto.core.storage.sharded import load_router
+
+
+class Permission(PermissionBase):
+    """Permission backend routing the operations to several permission
+    backends, along the shards of the :mod:`kinto.core.storage.sharded`
+    storage backend.
+
+    Enable in configuration::
+
+        kinto.permission_backend = kinto.core.permission.sharded
+
+    The permissions of an object are stored in the same database as the
+    object, as configured with the ``kinto.storage_shards`` and
+    ``kinto.storage_shard_map`` settings. The principals of users are
+    stored in the first shard.
+    """
+    def __init__(self, shards, router, *args, **kwargs):
+        super(Permission, self).__init__(*args, **kwargs)
+        self.shards = shards
+        self.router = router
+
+    def _route(self, object_id):
+        name = self.router.route_object(object_id)
+        if name is None:
+            raise ValueError('Object %r cannot be routed to a shard' %
+                             object_id)
+        return self.shards[name]
+
+    def _group_bound_permissions(self, bound_permissions):
+        groups = {}
+        object_ids = set([object_id for object_id, _ in bound_permissions])
+        by_object_id = self.router.group_objects(object_ids)
+        for name, object_ids in by_object_id.items():
+            groups[name] = [(object_id, permission)
+                            for object_id, permission in bound_permissions
+                            if object_id in object_ids]
+        return groups
+
+    @property
+    def _default(self):
+        return self.shards[self.router.default]
+
+    def initialize_schema(self, dry_run=False):
+        for name in self.router.names:
+            self.shards[name].initialize_schema(dry_run=dry_run)
+
+    def flush(self):
+        for name in self.router.names:
+            self.shards[name].flush()
+
+    def add_user_principal(self, user_id, principal):
+        self._default.add_user_principal(user_id, principal)
+
+    def remove_user_principal(self, user_id, principal):
+        self._default.remove_user_principal(user_id, principal)
+
+    def remove_principal(self, principal):
+        for name in self.router.names:
+            self.shards[name].remove_principal(principal)
+
+    def get_user_principals(self, user_id):
+        return self._default.get_user_principals(user_id)
+
+    def add_principal_to_ace(self, object_id, permission, principal):
+        shard = self._route(object_id)
+        shard.add_principal_to_ace(object_id, permission, principal)
+
+    def remove_principal_from_ace(self, object_id, permission, principal):
+        shard = self._route(object_id)
+        shard.remove_principal_from_ace(object_id, permission, principal)
+
+    def get_object_permission_principals(self, object_id, permission):
+        shard = self._route(object_id)
+        return shard.get_object_permission_principals(object_id, permission)
+
+    def get_accessible_objects(self, principals, bound_permissions=None,
+                               with_children=True):
+        if bound_permissions is None:
+            groups = dict([(name, None) for name in self.router.names])
+        else:
+            groups = self._group_bound_permissions(bound_permissions)
+        perms_by_object_id = {}
+        for name, bound in groups.items():
+            accessible = self.shards[name].get_accessible_objects(
+                principals, bound, with_children=with_children)
+            for object_id, permissions in accessible.items():
+                perms_by_object_id.setdefault(object_id,
+                                              set()).update(permissions)
+        return perms_by_object_id
+
+    def get_authorized_principals(self, bound_permissions):
+        principals = set()
+        groups = self._group_bound_permissions(bound_permissions)
+        for name, bound in groups.items():
+            principals |= self.shards[name].get_authorized_principals(bound)
+        return principals
+
+    def get_objects_permissions(self, objects_ids, permissions=None):
+        results = [None] * len(objects_ids)
+        positions = {}
+        for i, object_id in enumerate(objects_ids):
+            name = self.router.route_object(object_id)
+            positions.setdefault(name, []).append(i)
+        for name, indices in positions.items():
+            shard = self._route(objects_ids[indices[0]])
+            shard_results = shard.get_objects_permissions(
+                [objects_ids[i] for i in indices], permissions)
+            for i, result in zip(indices, shard_results):
+                results[i] = result
+        return results
+
+    def replace_object_permissions(self, object_id, permissions):
+        shard = self._route(object_id)
+        return shard.replace_object_permissions(object_id, permissions)
+
+    def delete_object_permissions(self, *object_id_list):
+        groups = self.router.group_objects(object_id_list)
+        for name, object_ids in groups.items():
+            self.shards[name].delete_object_permissions(*object_ids)
+
+    def delete_object_permissions_by_ids(self, object_ids):
+        groups = self.router.group_objects(object_ids)
+        for name, object_ids in groups.items():
+            self.shards[name].delete_object_permissions_by_ids(object_ids)
+
+
+def load_from_config(config):
+    settings = config.get_settings()
+    router, urls = load_router(settings)
+    shards = {}
+    for name in router.names:
+        shards[name] = postgresql.load_from_config(config, url=urls[name])
+    return Permission(shards=shards, router=router)
@@ -46,6 +46,7 @@ class PermissionTest(object):
             (self.permission.get_object_permissions, ''),
             (self.permission.replace_object_permissions, '', {'write': []}),
             (self.permission.delete_object_permissions, ''),
+            (self.permission.delete_object_permissions_by_ids, ['']),
             (self.permission.get_accessible_objects, []),
             (self.permission.get_authorized_principals, [('*', 'read')]),
         ]
@@ -478,6 +479,52 @@ class PermissionTest(object):
     def test_delete_object_permissions_supports_empty_list(self):
         self.permission.delete_object_permissions()  # Not failing
 
+    def test_delete_object_permissions_supports_ids_and_patterns(self):
+        self.permission.add_principal_to_ace('/url/b/id/1', 'write', 'user1')
+        self.permission.add_principal_to_ace('/url/a/id/1', 'write', 'user2')
+        self.permission.add_principal_to_ace('/url/c/id/1', 'write', 'user3')
+
+        self.permission.delete_object_permissions('/url/a*', '/url/c/id/1')
+
+        self.assertDictEqual(self.permission.get_object_permissions('/url/a/id/1'), {})
+        self.assertDictEqual(self.permission.get_object_permissions('/url/c/id/1'), {})
+        self.assertDictEqual(
+            self.permission.get_object_permissions('/url/b/id/1'),
+            {'write': {'user1'}})
+
+    def test_delete_object_permissions_by_ids_does_not_match_patterns(self):
+        self.permission.add_principal_to_ace('/url/a/id/1', 'write', 'user1')
+        self.permission.add_principal_to_ace('/url/a/id/%', 'write', 'user2')
+        self.permission.add_principal_to_ace('/url/a/id/2', 'read', 'user3')
+
+        self.permission.delete_object_permissions_by_ids(['/url/a/id/%',
+                                                          '/url/a/id/2'])
+
+        self.assertDictEqual(self.permission.get_object_permissions('/url/a/id/%'), {})
+        self.assertDictEqual(self.permission.get_object_permissions('/url/a/id/2'), {})
+        self.assertDictEqual(
+            self.permission.get_object_permissions('/url/a/id/1'),
+            {'write': {'user1'}})
+
+    def test_delete_object_permissions_by_ids_supports_empty_list(self):
+        self.permission.delete_object_permissions_by_ids([])  # Not failing
+
+    def test_delete_object_permissions_by_ids_chunked_deletes_every_chunk(self):
+        object_ids = ['/url/a/id/%s' % i for i in range(5)]
+        for object_id in object_ids:
+            self.permission.add_principal_to_ace(object_id, 'read', 'user1')
+
+        with mock.patch.object(self.permission,
+                               'delete_object_permissions_by_ids',
+                               wraps=self.permission.delete_object_permissions_by_ids
+                               ) as mocked:
+            self.permission.delete_object_permissions_by_ids_chunked(
+                iter(object_ids), chunk_size=2)
+
+        self.assertEqual(mocked.call_count, 3)
+        permissions = self.permission.get_objects_permissions(object_ids)
+        self.assertEqual(permissions, [{}] * 5)
+
     def test_delete_object_permissions_supports_pattern_matching(self):
         self.permission.add_principal_to_ace('/url/b/id/1', 'write', 'user1')
         self.permission.add_principal_to_ace('/url/a/id/1', 'write', 'user2')
@@ -1,5 +1,7 @@
 import re
 import functools
+import threading
+from collections import OrderedDict
 
 import colander
 import venusian
@@ -26,6 +28,44 @@ from .schema import ResourceSchema
 from .viewset import ViewSet, ShareableViewSet
 
 
+# Regular expressions of querystring parameters, compiled once.
+_FILTER_REGEXP = re.compile(
+    r'^(' + '|'.join([i.name.lower() for i in COMPARISON]) + r')_([\w\.]+)$')
+_SORT_REGEXP = re.compile(r'^([\-+]?)([\w\.]+)$')
+
+
+class _ParsedQueryCache(object):
+    """Small LRU cache of parsed querystrings, shared by every resource.
+
+    Polling clients tend to send identical querystrings, whose filters and
+    sorting do not need to be parsed again.
+    """
+    def __init__(self, max_size=1000):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.pop(key, None)
+            if value is not None:
+                # Most recently used entries are kept at the end.
+                self._entries[key] = value
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+_parsed_queries = _ParsedQueryCache()
+
+# Known fields of resources schemas, computed once by schema and model fields.
+_known_fields = {}
+
+
 def register(depth=1, **kwargs):
     """Ressource class decorator.
 
@@ -149,7 +189,36 @@ class UserResource(object):
     schema = ResourceSchema
     """Schema to validate records."""
 
+    patch_retries = 3
+    """Number of times the changes of a ``PATCH`` without precondition headers
+    are applied again when the record is modified concurrently, before
+    answering ``412 Precondition Failed``."""
+
     def __init__(self, request, context=None):
+        # The route factory may have instantiated this resource already, in
+        # order to fetch the current record (see ``RouteFactory``).
+        prefetched = getattr(context, 'current_resource', None)
+        if type(prefetched) is type(self) and prefetched.request is request:
+            # Reuse its model and collection timestamp instead of rebuilding.
+            self.model = prefetched.model
+            if 'timestamp' in vars(prefetched):
+                self.timestamp = prefetched.timestamp
+        else:
+            self.model = self._build_model(request, context)
+
+        self.request = request
+        self.context = context
+        self.record_id = self.request.matchdict.get('id')
+        self.force_patch_update = False
+
+        content_type = str(self.request.headers.get('Content-Type')).lower()
+        self._is_json_patch = content_type == 'application/json-patch+json'
+
+        # Log resource context. The collection timestamp is bound once
+        # it is actually needed (see ``timestamp``).
+        logger.bind(collection_id=self.model.collection_id)
+
+    def _build_model(self, request, context):
         # Models are isolated by user.
         parent_id = self.get_parent_id(request)
 
@@ -162,33 +231,26 @@ class UserResource(object):
         id_generator = request.registry.id_generators.get(resource_name,
                                                           default_id_generator)
 
-        self.model = self.default_model(
+        return self.default_model(
             storage=request.registry.storage,
             id_generator=id_generator,
             collection_id=classname(self),
             parent_id=parent_id,
             auth=auth)
 
-        self.request = request
-        self.context = context
-        self.record_id = self.request.matchdict.get('id')
-        self.force_patch_update = False
-
-        content_type = str(self.request.headers.get('Content-Type')).lower()
-        self._is_json_patch = content_type == 'application/json-patch+json'
-
-        # Log resource context.
-        logger.bind(collection_id=self.model.collection_id,
-                    collection_timestamp=self.timestamp)
-
     @reify
     def timestamp(self):
         """Return the current collection timestamp.
 
+        It is only obtained from storage when accessed, since most single
+        record operations do not need it.
+
         :rtype: int
         """
         try:
-            return self.model.timestamp()
+            timestamp = self.model.timestamp()
+            logger.bind(collection_timestamp=timestamp)
+            return timestamp
         except storage_exceptions.BackendError as e:
             is_readonly = self.request.registry.settings['readonly']
             if not is_readonly:
@@ -218,10 +280,16 @@ class UserResource(object):
 
     def _get_known_fields(self):
         """Return all the `field` defined in the ressource schema."""
-        known_fields = [c.name for c in self.schema().children] + \
-                       [self.model.id_field,
-                        self.model.modified_field,
-                        self.model.deleted_field]
+        key = (self.schema,
+               self.model.id_field,
+               self.model.modified_field,
+               self.model.deleted_field)
+        known_fields = _known_fields.get(key)
+        if known_fields is None:
+            # Instantiating the schema is costly: do it once.
+            known_fields = frozenset([c.name for c in self.schema().children] +
+                                     list(key[1:]))
+            _known_fields[key] = known_fields
         return known_fields
 
     def is_known_field(self, field):
@@ -273,16 +341,24 @@ class UserResource(object):
 
         filter_fields = [f.field for f in filters]
         include_deleted = self.model.modified_field in filter_fields
+        if include_deleted:
+            self._add_resync_header(self.request.response, filters)
 
         pagination_rules, offset = self._extract_pagination_rules_from_token(
             limit, sorting)
 
+        # Sort fields are needed to build the next page token.
+        projection = None
+        if partial_fields:
+            projection = partial_fields + [s.field for s in sorting]
+
         records, total_records = self.model.get_records(
             filters=filters,
             sorting=sorting,
             limit=limit,
             pagination_rules=pagination_rules,
-            include_deleted=include_deleted)
+            include_deleted=include_deleted,
+            fields=projection)
 
         offset = offset + len(records)
         if limit and len(records) == limit and offset < total_records:
@@ -364,14 +440,11 @@ class UserResource(object):
         sorting = self._extract_sorting(limit)
         pagination_rules, offset = self._extract_pagination_rules_from_token(limit, sorting)
 
-        records, total_records = self.model.get_records(filters=filters,
-                                                        sorting=sorting,
-                                                        limit=limit,
-                                                        pagination_rules=pagination_rules)
-        deleted = self.model.delete_records(filters=filters,
-                                            sorting=sorting,
-                                            limit=limit,
-                                            pagination_rules=pagination_rules)
+        deleted, records, total_records = self.model.delete_records_with_old(
+            filters=filters,
+            sorting=sorting,
+            limit=limit,
+            pagination_rules=pagination_rules)
         if deleted:
             lastrecord = deleted[-1]
             # Get timestamp of the last deleted field
@@ -465,11 +538,21 @@ class UserResource(object):
 
         new_record = self.process_record(post_record, old=existing)
 
-        if existing and not tombstones:
-            record = self.model.update_record(new_record)
-        else:
-            record = self.model.create_record(new_record)
-            self.request.response.status_code = 201
+        # With preconditions, make sure the record was not changed between
+        # their check and the write.
+        conditional = self._has_precondition_headers()
+        try:
+            if existing and not tombstones:
+                condition = {}
+                if conditional:
+                    condition['if_match'] = existing[self.model.modified_field]
+                record = self.model.update_record(new_record, **condition)
+            else:
+                condition = {'if_none_match': True} if conditional else {}
+                record = self.model.create_record(new_record, **condition)
+                self.request.response.status_code = 201
+        except storage_exceptions.ModifiedMeanwhileError as e:
+            self._raise_412_modified_meanwhile(e.existing)
 
         timestamp = record[self.model.modified_field]
         self._add_timestamp_header(self.request.response, timestamp=timestamp)
@@ -519,23 +602,43 @@ class UserResource(object):
                 }
                 raise_invalid(self.request, **error_details)
 
-        updated, applied_changes = self.apply_changes(existing,
-                                                      requested_changes=requested_changes)
+        retries = self.patch_retries
+        while True:
+            updated, applied_changes = self.apply_changes(existing,
+                                                          requested_changes=requested_changes)
 
-        record_id = updated.setdefault(self.model.id_field,
-                                       self.record_id)
-        self._raise_400_if_id_mismatch(record_id, self.record_id)
+            record_id = updated.setdefault(self.model.id_field,
+                                           self.record_id)
+            self._raise_400_if_id_mismatch(record_id, self.record_id)
 
-        new_record = self.process_record(updated, old=existing)
+            new_record = self.process_record(updated, old=existing)
 
-        changed_fields = [k for k in applied_changes.keys()
-                          if existing.get(k) != new_record.get(k)]
+            changed_fields = [k for k in applied_changes.keys()
+                              if existing.get(k) != new_record.get(k)]
 
-        # Save in storage if necessary.
-        if changed_fields or self.force_patch_update:
-            new_record = self.model.update_record(new_record)
+            if not (changed_fields or self.force_patch_update):
+                break
 
-        else:
+            # Save in storage if necessary.
+            try:
+                new_record = self.model.patch_record(new_record, old=existing)
+                break
+            except storage_exceptions.ModifiedMeanwhileError as e:
+                # Modified by another request since it was read.
+                if self._has_precondition_headers() or retries == 0:
+                    self._raise_412_modified_meanwhile(e.existing)
+            except storage_exceptions.RecordNotFoundError:
+                # Deleted by another request since it was read.
+                raise self._404_for_record(self.record_id)
+            # The client did not make any assumption about the current
+            # version: apply the changes again on the new one.
+            retries -= 1
+            if self.context:
+                # Read during authorization, it is outdated now.
+                self.context.current_record = None
+            existing = self._get_record_or_404(self.record_id)
+
+        if not (changed_fields or self.force_patch_update):
             # Behave as if storage would have added `id` and `last_modified`.
             for extra_field in [self.model.modified_field,
                                 self.model.id_field]:
@@ -746,13 +849,15 @@ class UserResource(object):
         try:
             return self.model.get_record(record_id)
         except storage_exceptions.RecordNotFoundError:
-            details = {
-                "id": record_id,
-                "resource_name": self.request.current_resource_name
-            }
-            response = http_error(HTTPNotFound(), errno=ERRORS.INVALID_RESOURCE_ID,
-                                  details=details)
-            raise response
+            raise self._404_for_record(record_id)
+
+    def _404_for_record(self, record_id):
+        details = {
+            "id": record_id,
+            "resource_name": self.request.current_resource_name
+        }
+        return http_error(HTTPNotFound(), errno=ERRORS.INVALID_RESOURCE_ID,
+                          details=details)
 
     def _add_timestamp_header(self, response, timestamp=None):
         """Add current timestamp in response headers, when request comes in.
@@ -792,6 +897,26 @@ class UserResource(object):
             response.cache_control.no_cache = True
             response.cache_control.no_store = True
 
+    def _add_resync_header(self, response, filters):
+        """Add the ``Resync-Required`` header if tombstones may have been
+        purged since the timestamp specified in filters (e.g. ``_since``).
+
+        Its value is the timestamp before which tombstones may have been
+        purged: the client has to fetch the whole list again.
+        """
+        retention = getattr(self.request.registry, 'tombstones_retention', None)
+        if retention is None:
+            return
+        since = [f.value for f in filters
+                 if f.field == self.model.modified_field and
+                 f.operator in (COMPARISON.GT, COMPARISON.MIN) and
+                 isinstance(f.value, six.integer_types)]
+        if not since:
+            return
+        watermark = retention.watermark()
+        if watermark is not None and min(since) < watermark:
+            response.headers['Resync-Required'] = encode_header('%s' % watermark)
+
     def _raise_400_if_invalid_id(self, record_id):
         """Raise 400 if specified record id does not match the format excepted
         by storage backends.
@@ -846,6 +971,10 @@ class UserResource(object):
             self._add_timestamp_header(response, timestamp=current_timestamp)
             raise response
 
+    def _has_precondition_headers(self):
+        return bool(self.request.headers.get('If-Match') or
+                    self.request.headers.get('If-None-Match'))
+
     def _raise_412_if_modified(self, record=None):
         """Raise 412 if current timestamp is superior to the one
         specified in headers.
@@ -892,14 +1021,25 @@ class UserResource(object):
             current_timestamp = self.model.timestamp()
 
         if current_timestamp > modified_since:
-            error_msg = 'Resource was modified meanwhile'
-            details = {'existing': record} if record else {}
-            response = http_error(HTTPPreconditionFailed(),
-                                  errno=ERRORS.MODIFIED_MEANWHILE,
-                                  message=error_msg,
-                                  details=details)
-            self._add_timestamp_header(response, timestamp=current_timestamp)
-            raise response
+            self._raise_412_modified_meanwhile(record, current_timestamp)
+
+    def _raise_412_modified_meanwhile(self, record=None, timestamp=None):
+        """Raise 412 because the record (or collection) was modified.
+
+        :raises:
+            :exc:`~pyramid:pyramid.httpexceptions.HTTPPreconditionFailed`
+        """
+        error_msg = 'Resource was modified meanwhile'
+        details = {'existing': record} if record else {}
+        response = http_error(HTTPPreconditionFailed(),
+                              errno=ERRORS.MODIFIED_MEANWHILE,
+                              message=error_msg,
+                              details=details)
+        if timestamp is None and record:
+            timestamp = record[self.model.modified_field]
+        if timestamp is not None:
+            self._add_timestamp_header(response, timestamp=timestamp)
+        raise response
 
     def _raise_400_if_id_mismatch(self, new_id, record_id):
         """Raise 400 if the `new_id`, within the request body, does not match
@@ -964,9 +1104,54 @@ class UserResource(object):
         if not queryparams:
             queryparams = self.request.GET
 
+        params = tuple(queryparams.items())
+        key = ('filters', self.model.id_field, self.model.modified_field,
+               params)
+        try:
+            parsed = _parsed_queries.get(key)
+        except TypeError:
+            # Unhashable values, cannot be cached.
+            key, parsed = None, None
+        if parsed is None:
+            parsed = self._parse_filters(params)
+            if key is not None:
+                _parsed_queries.set(key, parsed)
+
         filters = []
+        for param, filter_ in parsed:
+            if param == '_to':
+                message = ('_to is now deprecated, '
+                           'you should use _before instead')
+                url = ('https://kinto.readthedocs.io/en/2.4.0/api/'
+                       'resource.html#list-of-available-url-'
+                       'parameters')
+                send_alert(self.request, message, url)
+
+            elif param not in ('_since', '_before') and \
+                    not self.is_known_field(filter_.field):
+                error_msg = "Unknown filter field '{0}'".format(param)
+                error_details = {
+                    'name': param,
+                    'location': 'querystring',
+                    'description': error_msg
+                }
+                raise_invalid(self.request, **error_details)
+
+            filters.append(filter_)
+
+        return filters
 
-        for param, paramvalue in queryparams.items():
+    def _parse_filters(self, params):
+        """Parse the filters of the specified QueryString parameters.
+
+        The validity of fields is not checked here, since the result is
+        shared with other requests (see :meth:`_extract_filters`).
+
+        :returns: a tuple of ``(param, filter)`` pairs.
+        """
+        parsed = []
+
+        for param, paramvalue in params:
             param = param.strip()
 
             error_details = {
@@ -991,32 +1176,19 @@ class UserResource(object):
                 if param == '_since':
                     operator = COMPARISON.GT
                 else:
-                    if param == '_to':
-                        message = ('_to is now deprecated, '
-                                   'you should use _before instead')
-                        url = ('https://kinto.readthedocs.io/en/2.4.0/api/'
-                               'resource.html#list-of-available-url-'
-                               'parameters')
-                        send_alert(self.request, message, url)
                     operator = COMPARISON.LT
-                filters.append(
-                    Filter(self.model.modified_field, value, operator)
+                parsed.append(
+                    (param, Filter(self.model.modified_field, value, operator))
                 )
                 continue
 
-            allKeywords = '|'.join([i.name.lower() for i in COMPARISON])
-            m = re.match(r'^('+allKeywords+')_([\w\.]+)$', param)
+            m = _FILTER_REGEXP.match(param)
             if m:
                 keyword, field = m.groups()
                 operator = getattr(COMPARISON, keyword.upper())
             else:
                 operator, field = COMPARISON.EQ, param
 
-            if not self.is_known_field(field):
-                error_msg = "Unknown filter field '{0}'".format(param)
-                error_details['description'] = error_msg
-                raise_invalid(self.request, **error_details)
-
             value = native_value(paramvalue)
 
             if operator in (COMPARISON.IN, COMPARISON.EXCLUDE):
@@ -1033,31 +1205,37 @@ class UserResource(object):
                 if has_invalid_value:
                     raise_invalid(self.request, **error_details)
 
-            filters.append(Filter(field, value, operator))
+            parsed.append((param, Filter(field, value, operator)))
 
-        return filters
+        return tuple(parsed)
 
     def _extract_sorting(self, limit):
         """Extracts filters from QueryString parameters."""
-        specified = self.request.GET.get('_sort', '').split(',')
-        sorting = []
-        modified_field_used = self.model.modified_field in specified
-        for field in specified:
-            field = field.strip()
-            m = re.match(r'^([\-+]?)([\w\.]+)$', field)
-            if m:
-                order, field = m.groups()
-
-                if not self.is_known_field(field):
-                    error_details = {
-                        'location': 'querystring',
-                        'description': "Unknown sort field '{0}'".format(field)
-                    }
-                    raise_invalid(self.request, **error_details)
+        specified = self.request.GET.get('_sort', '')
+        key = ('sorting', specified)
+        parsed = _parsed_queries.get(key)
+        if parsed is None:
+            parsed = []
+            for field in specified.split(','):
+                m = _SORT_REGEXP.match(field.strip())
+                if m:
+                    order, field = m.groups()
+                    direction = -1 if order == '-' else 1
+                    parsed.append(Sort(field, direction))
+            parsed = tuple(parsed)
+            _parsed_queries.set(key, parsed)
 
-                direction = -1 if order == '-' else 1
-                sorting.append(Sort(field, direction))
+        sorting = []
+        for sort in parsed:
+            if not self.is_known_field(sort.field):
+                error_details = {
+                    'location': 'querystring',
+                    'description': "Unknown sort field '{0}'".format(sort.field)
+                }
+                raise_invalid(self.request, **error_details)
+            sorting.append(sort)
 
+        modified_field_used = self.model.modified_field in specified.split(',')
         if not modified_field_used:
             # Add a sort by the ``modified_field`` in descending order
             # useful for pagination
@@ -1,3 +1,6 @@
+from kinto.core.utils import dict_diff
+
+
 class Model(object):
     """A collection stores and manipulate records in its attached storage.
 
@@ -19,6 +22,13 @@ class Model(object):
     deleted_field = 'deleted'
     """Name of `deleted` field in deleted records"""
 
+    storage_shortcuts = False
+    """Whether :meth:`patch_record` sends only the changed attributes to the
+    storage backend, instead of going through :meth:`update_record`, and
+    :meth:`delete_records_with_old` deletes and reads the records at once,
+    instead of going through :meth:`delete_records`. Disabled by default, so
+    that subclasses overriding those to post-process records keep working."""
+
     def __init__(self, storage, id_generator=None, collection_id='',
                  parent_id='', auth=None):
         """
@@ -49,7 +59,8 @@ class Model(object):
             auth=self.auth)
 
     def get_records(self, filters=None, sorting=None, pagination_rules=None,
-                    limit=None, include_deleted=False, parent_id=None):
+                    limit=None, include_deleted=False, parent_id=None,
+                    fields=None):
         """Fetch the collection records.
 
         Override to post-process records after feching them from storage.
@@ -81,11 +92,16 @@ class Model(object):
 
         :param str parent_id: optional filter for parent id
 
+        :param list fields: Optionnally restrict the attributes of the
+            records (see :meth:`kinto.core.storage.StorageBase.get_all`).
+
         :returns: A tuple with the list of records in the current page,
             the total number of records in the result set.
         :rtype: tuple
         """
         parent_id = parent_id or self.parent_id
+        # Only pass fields when set, for backends that do not accept them.
+        extra = dict(fields=fields) if fields else {}
         records, total_records = self.storage.get_all(
             collection_id=self.collection_id,
             parent_id=parent_id,
@@ -97,7 +113,8 @@ class Model(object):
             id_field=self.id_field,
             modified_field=self.modified_field,
             deleted_field=self.deleted_field,
-            auth=self.auth)
+            auth=self.auth,
+            **extra)
         return records, total_records
 
     def delete_records(self, filters=None, sorting=None, pagination_rules=None,
@@ -144,6 +161,60 @@ class Model(object):
                                        deleted_field=self.deleted_field,
                                        auth=self.auth)
 
+    def delete_records_with_old(self, filters=None, sorting=None,
+                                pagination_rules=None, limit=None,
+                                parent_id=None):
+        """Delete multiple collection records, and return them as they were
+        before their deletion.
+
+        See :meth:`delete_records` for the parameters. If
+        :attr:`storage_shortcuts` is ``False``, it is used instead of deleting
+        and reading the records at once.
+
+        :returns: The list of deleted records from storage, the list of
+            records as they were before deletion and the total number of
+            records matching the filters.
+        :rtype: tuple
+        """
+        if not self.storage_shortcuts:
+            return self._get_and_delete_records(filters, sorting,
+                                                pagination_rules, limit,
+                                                parent_id)
+        return self._delete_records_with_old(filters, sorting,
+                                             pagination_rules, limit,
+                                             parent_id)
+
+    def _delete_records_with_old(self, filters, sorting, pagination_rules,
+                                 limit, parent_id):
+        parent_id = parent_id or self.parent_id
+        return self.storage.delete_all_with_old(
+            collection_id=self.collection_id,
+            parent_id=parent_id,
+            filters=filters,
+            sorting=sorting,
+            pagination_rules=pagination_rules,
+            limit=limit,
+            id_field=self.id_field,
+            modified_field=self.modified_field,
+            deleted_field=self.deleted_field,
+            auth=self.auth)
+
+    def _get_and_delete_records(self, filters, sorting, pagination_rules,
+                                limit, parent_id):
+        records, count = self.get_records(filters=filters,
+                                          sorting=sorting,
+                                          pagination_rules=pagination_rules,
+                                          limit=limit,
+                                          parent_id=parent_id)
+        deleted = self.delete_records(filters=filters,
+                                      sorting=sorting,
+                                      pagination_rules=pagination_rules,
+                                      limit=limit,
+                                      parent_id=parent_id)
+        records_by_id = dict([(r[self.id_field], r) for r in records])
+        old = [records_by_id.get(d[self.id_field]) for d in deleted]
+        return deleted, old, count
+
     def get_record(self, record_id, parent_id=None):
         """Fetch current view related record, and raise 404 if missing.
 
@@ -161,7 +232,7 @@ class Model(object):
                                 modified_field=self.modified_field,
                                 auth=self.auth)
 
-    def create_record(self, record, parent_id=None):
+    def create_record(self, record, parent_id=None, if_none_match=False):
         """Create a record in the collection.
 
         Override to perform actions or post-process records after their
@@ -175,8 +246,13 @@ class Model(object):
                 record['index'] = idx
                 return record
 
+        :raises: :exc:`kinto.core.storage.exceptions.ModifiedMeanwhileError`
+            if `if_none_match` is ``True`` and the record already exists.
+
         :param dict record: record to store
         :param str parent_id: optional filter for parent id
+        :param bool if_none_match: create the record only if it does not
+            exist, atomically.
 
         :returns: the newly created record.
         :rtype: dict
@@ -188,9 +264,10 @@ class Model(object):
                                    id_generator=self.id_generator,
                                    id_field=self.id_field,
                                    modified_field=self.modified_field,
-                                   auth=self.auth)
+                                   auth=self.auth,
+                                   if_none_match=if_none_match)
 
-    def update_record(self, record, parent_id=None):
+    def update_record(self, record, parent_id=None, if_match=None):
         """Update a record in the collection.
 
         Override to perform actions or post-process records after their
@@ -204,8 +281,12 @@ class Model(object):
                 send_email(subject)
                 return record
 
+        :raises: :exc:`kinto.core.storage.exceptions.ModifiedMeanwhileError`
+            if `if_match` differs from the stored record timestamp.
+
         :param dict record: record to store
         :param str parent_id: optional filter for parent id
+        :param int if_match: optional expected timestamp of the stored record
         :returns: the updated record.
         :rtype: dict
         """
@@ -217,7 +298,54 @@ class Model(object):
                                    record=record,
                                    id_field=self.id_field,
                                    modified_field=self.modified_field,
-                                   auth=self.auth)
+                                   auth=self.auth,
+                                   if_match=if_match)
+
+    def patch_record(self, record, old, parent_id=None):
+        """Update a record in the collection from its previous version.
+
+        Only the modified attributes are sent to the storage backend, and
+        the write is rejected if the stored record was modified since `old`
+        was read.
+
+        If :attr:`storage_shortcuts` is ``False``, :meth:`update_record` is
+        used instead.
+
+        :raises: :exc:`kinto.core.storage.exceptions.ModifiedMeanwhileError`
+
+        :param dict record: record to store
+        :param dict old: the current version of the record
+        :param str parent_id: optional filter for parent id
+        :returns: the updated record.
+        :rtype: dict
+        """
+        if not self.storage_shortcuts:
+            return self.update_record(record, parent_id)
+        return self._patch_record(record, old, parent_id)
+
+    def _patch_record(self, record, old, parent_id=None):
+        parent_id = parent_id or self.parent_id
+        record_id = record[self.id_field]
+
+        internal_fields = (self.id_field, self.modified_field,
+                           getattr(self, 'permissions_field', None))
+        changes, removals = dict_diff(
+            dict([(k, v) for k, v in old.items() if k not in internal_fields]),
+            dict([(k, v) for k, v in record.items() if k not in internal_fields]))
+
+        timestamp = self.storage.patch(collection_id=self.collection_id,
+                                       parent_id=parent_id,
+                                       object_id=record_id,
+                                       changes=changes,
+                                       removals=removals,
+                                       last_modified=record.get(self.modified_field),
+                                       if_match=old[self.modified_field],
+                                       id_field=self.id_field,
+                                       modified_field=self.modified_field,
+                                       auth=self.auth)
+        updated = record.copy()
+        updated[self.modified_field] = timestamp
+        return updated
 
     def delete_record(self, record, parent_id=None, last_modified=None):
         """Delete a record in the collection.
@@ -266,15 +394,9 @@ class ShareableModel(Model):
         self.current_principal = None
         self.prefixed_principals = None
 
-    def _allow_write(self, perm_object_id):
-        """Helper to give the ``write`` permission to the current user.
-        """
-        self.permission.add_principal_to_ace(perm_object_id,
-                                             'write',
-                                             self.current_principal)
-
-    def _annotate(self, record, perm_object_id):
-        permissions = self.permission.get_object_permissions(perm_object_id)
+    def _annotate(self, record, perm_object_id, permissions=None):
+        if permissions is None:
+            permissions = self.permission.get_object_permissions(perm_object_id)
         # Permissions are not returned if user only has read permission.
         writers = permissions.get('write', [])
         principals = self.prefixed_principals + [self.current_principal]
@@ -294,38 +416,86 @@ class ShareableModel(Model):
                                                              pagination_rules,
                                                              limit,
                                                              parent_id)
-        # Take a huge shortcut in case we want to delete everything.
-        if not filters:
-            perm_ids = [self.get_permission_object_id(object_id='*')]
+        # Take a huge shortcut in case we deleted everything.
+        deleted_all = (not filters and not pagination_rules and
+                       (limit is None or len(deleted) < limit))
+        if deleted_all:
+            perm_id = self.get_permission_object_id(object_id='*')
+            self.permission.delete_object_permissions(perm_id)
         else:
-            perm_ids = [self.get_permission_object_id(object_id=r[self.id_field])
-                        for r in deleted]
-        self.permission.delete_object_permissions(*perm_ids)
+            self._delete_records_permissions(deleted)
         return deleted
 
+    def delete_records_with_old(self, filters=None, sorting=None,
+                                pagination_rules=None, limit=None,
+                                parent_id=None):
+        """Delete permissions of the records deleted in bulk.
+
+        Permissions are deleted by the ids of the deleted records, so that
+        the ones of records created meanwhile are kept.
+        """
+        if not self.storage_shortcuts:
+            return self._get_and_delete_records(filters, sorting,
+                                                pagination_rules, limit,
+                                                parent_id)
+        result = self._delete_records_with_old(filters, sorting,
+                                               pagination_rules, limit,
+                                               parent_id)
+        deleted = result[0]
+        if deleted:
+            self._delete_records_permissions(deleted)
+        return result
+
+    def _delete_records_permissions(self, records):
+        perm_ids = [self.get_permission_object_id(object_id=r[self.id_field])
+                    for r in records]
+        self.permission.delete_object_permissions_by_ids(perm_ids)
+
     def get_record(self, record_id, parent_id=None):
         """Fetch current permissions and add them to returned record.
+
+        The record and its permissions are obtained together from the storage
+        backend, in order to save a round trip when possible.
         """
-        record = super(ShareableModel, self).get_record(record_id, parent_id)
+        parent_id = parent_id or self.parent_id
         perm_object_id = self.get_permission_object_id(record_id)
+        record, permissions = self.storage.get_with_permissions(
+            collection_id=self.collection_id,
+            parent_id=parent_id,
+            object_id=record_id,
+            permission_backend=self.permission,
+            permission_object_id=perm_object_id,
+            id_field=self.id_field,
+            modified_field=self.modified_field,
+            auth=self.auth)
 
-        return self._annotate(record, perm_object_id)
+        return self._annotate(record, perm_object_id, permissions)
 
-    def create_record(self, record, parent_id=None):
+    def create_record(self, record, parent_id=None, if_none_match=False):
         """Create record and set specified permissions.
 
         The current principal is added to the owner (``write`` permission).
         """
+        parent_id = parent_id or self.parent_id
         permissions = record.pop(self.permissions_field, {})
-        record = super(ShareableModel, self).create_record(record, parent_id)
-        record_id = record[self.id_field]
-        perm_object_id = self.get_permission_object_id(record_id)
-        self.permission.replace_object_permissions(perm_object_id, permissions)
-        self._allow_write(perm_object_id)
+        record, permissions = self.storage.create_with_permissions(
+            collection_id=self.collection_id,
+            parent_id=parent_id,
+            record=record,
+            permission_backend=self.permission,
+            get_permission_object_id=self.get_permission_object_id,
+            permissions=permissions,
+            owner=self.current_principal,
+            id_generator=self.id_generator,
+            id_field=self.id_field,
+            modified_field=self.modified_field,
+            auth=self.auth,
+            if_none_match=if_none_match)
+        perm_object_id = self.get_permission_object_id(record[self.id_field])
 
-        return self._annotate(record, perm_object_id)
+        return self._annotate(record, perm_object_id, permissions)
 
-    def update_record(self, record, parent_id=None):
+    def update_record(self, record, parent_id=None, if_match=None):
         """Update record and the specified permissions.
 
         If no permissions is specified, the current permissions are not
@@ -333,14 +503,45 @@ class ShareableModel(Model):
 
         The current principal is added to the owner (``write`` permission).
         """
+        parent_id = parent_id or self.parent_id
         permissions = record.pop(self.permissions_field, {})
-        record = super(ShareableModel, self).update_record(record, parent_id)
         record_id = record[self.id_field]
         perm_object_id = self.get_permission_object_id(record_id)
-        self.permission.replace_object_permissions(perm_object_id, permissions)
-        self._allow_write(perm_object_id)
+        record, permissions = self.storage.update_with_permissions(
+            collection_id=self.collection_id,
+            parent_id=parent_id,
+            object_id=record_id,
+            record=record,
+            permission_backend=self.permission,
+            permission_object_id=perm_object_id,
+            permissions=permissions,
+            owner=self.current_principal,
+            id_field=self.id_field,
+            modified_field=self.modified_field,
+            auth=self.auth,
+            if_match=if_match)
+
+        return self._annotate(record, perm_object_id, permissions)
 
-        return self._annotate(record, perm_object_id)
+    def patch_record(self, record, old, parent_id=None):
+        """Update record from its previous version.
+
+        Permissions are written along the record if they are specified, or
+        if the current principal is not among the writers yet.
+        """
+        permissions = old.get(self.permissions_field, {})
+        owner = self.current_principal
+        is_writer = owner is None or owner in permissions.get('write', [])
+        keeps_permissions = self.permissions_field not in record and is_writer
+        if not self.storage_shortcuts:
+            return self.update_record(record, parent_id)
+        if not keeps_permissions:
+            return self.update_record(record, parent_id,
+                                      if_match=old[self.modified_field])
+
+        updated = self._patch_record(record, old, parent_id)
+        perm_object_id = self.get_permission_object_id(record[self.id_field])
+        return self._annotate(updated, perm_object_id, permissions)
 
     def delete_record(self, record_id, parent_id=None, last_modified=None):
         """Delete record and its associated permissions.
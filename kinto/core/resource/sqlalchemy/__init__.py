@@ -1,15 +1,17 @@
 import datetime
+import operator
 
 import colander
 from colanderalchemy import SQLAlchemySchemaNode
 from pyramid_sqlalchemy import BaseObject, metadata
-from sqlalchemy import Column, event
+from sqlalchemy import Column, Index, event
 from sqlalchemy import String, Boolean, Integer, BigInteger
-from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.ext.declarative import declarative_base, declared_attr
 from sqlalchemy.orm import mapper
 
 from .. import logger
 from ...resource import ShareableResource, ResourceSchema
+from ...storage.sqlalchemy.generators import IntegerId
 
 key = SQLAlchemySchemaNode.sqla_info_key
 
@@ -27,10 +29,20 @@ class SQLABaseObject(object):
 
     _track_timestamp = True
 
-    id = Column(Integer(), primary_key=True, info={key: {'repr': True}})
-    parent_id = Column(String(), nullable=False, index=True, info={key: {'exclude': True}})
+    id_generator = IntegerId()
+    """Generator of the ids of new objects, reserved by blocks."""
+
+    id = Column(Integer(), id_generator.sequence, primary_key=True, info={key: {'repr': True}})
+    parent_id = Column(String(), nullable=False, info={key: {'exclude': True}})
     last_modified = Column(BigInteger(), nullable=False, default=lambda: datetime.datetime.utcnow())
-    deleted = Column(Boolean(), default=False, index=True, info={key: {'exclude': True}})
+    deleted = Column(Boolean(), default=False, info={key: {'exclude': True}})
+
+    @declared_attr
+    def __table_args__(cls):
+        # Listings are filtered by parent and deleted status, and sorted by
+        # timestamp (see ``kinto.core.storage.sqlalchemy.Storage.get_all()``).
+        name = 'idx_{}_parent_id_deleted_last_modified'.format(cls.__tablename__)
+        return (Index(name, 'parent_id', 'deleted', 'last_modified'),)
 
     @property
     def is_timestamp_trackeable(self):
@@ -56,6 +68,13 @@ class SQLABaseObject(object):
         except AttributeError:
             raise NoSchemaException(cls)
 
+    def to_record(self):
+        """Return the record of this object, without going through the schema."""
+        try:
+            return self.__converter__.from_object(self)
+        except AttributeError:
+            raise NoSchemaException(self.__class__)
+
     def __repr__(self):
         return '{class_name}{attributes}'.format(class_name=self.__class__.__name__,
                                                  attributes=self.__repr_attributes())
@@ -73,6 +92,28 @@ class SQLABaseObject(object):
         return True
 
 
+class RowConverter(object):
+    """Convert the objects of a model, or the rows of its schema columns, to records.
+
+    It is built once per model, so that reads do not go through colander.
+    """
+
+    def __init__(self, klass):
+        self.fields = tuple([child.name for child in klass.__schema__.children])
+        self.columns = tuple([getattr(klass, name) for name in self.fields])
+        getter = operator.attrgetter(*self.fields)
+        if len(self.fields) == 1:
+            self._getter = lambda obj: (getter(obj),)
+        else:
+            self._getter = getter
+
+    def from_row(self, row):
+        return dict(zip(self.fields, row))
+
+    def from_object(self, obj):
+        return dict(zip(self.fields, self._getter(obj)))
+
+
 class SQLASchemaResource(SQLAlchemySchemaNode, ResourceSchema):
 
     def __init__(self, class_):
@@ -86,17 +127,20 @@ class SQLAUserResource(ShareableResource):
         self.model.storage.collection = self.appmodel
         if not hasattr(self.model.storage.collection, '__schema__'):
             setattr(self.model.storage.collection, '__schema__', SQLASchemaResource(self.appmodel))
+        if not hasattr(self.model.storage.collection, '__converter__'):
+            setattr(self.model.storage.collection, '__converter__', RowConverter(self.appmodel))
         self.mapping = self.model.storage.collection.__schema__
 
 
 def schema_setup(mapper, klass):
     """
     Evaluate if klass has a __schema__ attribute already attached. In case it does not, create it and later
-    evaluate preparers and validators
+    evaluate preparers and validators, and build its row converter
     """
     if not hasattr(klass, '__schema__'):
         klass.__schema__ = SQLASchemaResource(klass)
         MethodAppender(klass).append_methods()
+        klass.__converter__ = RowConverter(klass)
 
 
 class MethodAppender(object):
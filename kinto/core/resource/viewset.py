@@ -78,7 +78,7 @@ class ViewSet(object):
     default_collection_arguments = {}
     collection_get_arguments = {
         'cors_headers': ('Next-Page', 'Total-Records', 'Last-Modified', 'ETag',
-                         'Cache-Control', 'Expires', 'Pragma')
+                         'Cache-Control', 'Expires', 'Pragma', 'Resync-Required')
     }
 
     default_record_arguments = {}
@@ -75,13 +75,29 @@ def delete_collection(env, bucket_id, collection_id):
               '/collections/{collection_id}'
               '/records/{record_id}')
 
-    registry.permission.delete_object_permissions(
-        collection,
-        *[record.format(bucket_id=bucket_id,
-                        collection_id=collection_id,
-                        record_id=r['id']) for r in deleted])
+    registry.permission.delete_object_permissions_by_ids([collection])
+    registry.permission.delete_object_permissions_by_ids_chunked(
+        record.format(bucket_id=bucket_id,
+                      collection_id=collection_id,
+                      record_id=r['id']) for r in deleted)
     logger.info('Related permissions were deleted.')
 
     current_transaction.commit()
 
     return 0
+
+
+def purge_tombstones(env, older_than):
+    registry = env['registry']
+    settings = registry.settings
+    readonly_mode = asbool(settings.get('readonly', False))
+
+    if readonly_mode:
+        message = ('Cannot purge the tombstones while in readonly mode.')
+        logger.error(message)
+        return 31
+
+    purged = registry.tombstones_retention.purge(older_than)
+    logger.info('%d tombstone(s) were purged.' % purged)
+
+    return 0
@@ -1,9 +1,10 @@
+import copy
 import random
 from collections import namedtuple
 from pyramid.settings import asbool
 
 from kinto.core.logs import logger
-from . import generators
+from . import exceptions, generators
 
 
 Filter = namedtuple('Filter', ['field', 'value', 'operator'])
@@ -72,7 +73,7 @@ class StorageBase(object):
     def create(self, collection_id, parent_id, record, id_generator=None,
                id_field=DEFAULT_ID_FIELD,
                modified_field=DEFAULT_MODIFIED_FIELD,
-               auth=None):
+               auth=None, if_none_match=False):
         """Create the specified `object` in this `collection_id` for this `parent_id`.
         Assign the id to the object, using the attribute
         :attr:`kinto.core.resource.model.Model.id_field`.
@@ -82,10 +83,15 @@ class StorageBase(object):
             This will update the collection timestamp.
 
         :raises: :exc:`kinto.core.storage.exceptions.UnicityError`
+        :raises: :exc:`kinto.core.storage.exceptions.ModifiedMeanwhileError`
+            instead, if `if_none_match` is ``True`` and an object with the
+            same id exists.
 
         :param str collection_id: the collection id.
         :param str parent_id: the collection parent.
         :param dict record: the object to create.
+        :param bool if_none_match: make sure the existence check and the
+            creation are atomic.
 
         :returns: the newly created object.
         :rtype: dict
@@ -111,29 +117,195 @@ class StorageBase(object):
         """
         raise NotImplementedError
 
+    def get_with_permissions(self, collection_id, parent_id, object_id,
+                             permission_backend, permission_object_id,
+                             id_field=DEFAULT_ID_FIELD,
+                             modified_field=DEFAULT_MODIFIED_FIELD,
+                             auth=None):
+        """Retrieve the object with specified `object_id` along with the
+        permissions of `permission_object_id`, or raise error if not found.
+
+        Backends can override this to fetch both with a single query when
+        they share their database with the permission backend.
+
+        :raises: :exc:`kinto.core.storage.exceptions.RecordNotFoundError`
+
+        :param str collection_id: the collection id.
+        :param str parent_id: the collection parent.
+        :param str object_id: unique identifier of the object
+        :param permission_backend: the permission backend instance.
+        :param str permission_object_id: the object id in permission backend.
+
+        :returns: the object and its permissions.
+        :rtype: tuple
+        """
+        record = self.get(collection_id, parent_id, object_id,
+                          id_field=id_field,
+                          modified_field=modified_field,
+                          auth=auth)
+        permissions = permission_backend.get_object_permissions(
+            permission_object_id)
+        return record, permissions
+
+    def create_with_permissions(self, collection_id, parent_id, record,
+                                permission_backend, get_permission_object_id,
+                                permissions, owner, id_generator=None,
+                                id_field=DEFAULT_ID_FIELD,
+                                modified_field=DEFAULT_MODIFIED_FIELD,
+                                auth=None, if_none_match=False):
+        """Create the specified `object`, replace the specified `permissions`
+        of the created object and give the ``write`` permission to `owner`.
+
+        :param permission_backend: the permission backend instance.
+        :param get_permission_object_id: a callable returning the object id
+            in permission backend for the created object id.
+        :param dict permissions: the permissions to replace.
+        :param str owner: the principal to add to the ``write`` ACE.
+        :param bool if_none_match: see :meth:`create`.
+
+        :returns: the newly created object and its resulting permissions.
+        :rtype: tuple
+        """
+        record = self.create(collection_id, parent_id, record,
+                             id_generator=id_generator,
+                             id_field=id_field,
+                             modified_field=modified_field,
+                             auth=auth,
+                             if_none_match=if_none_match)
+        perm_object_id = get_permission_object_id(record[id_field])
+        permissions = self._replace_permissions(permission_backend,
+                                                perm_object_id,
+                                                permissions,
+                                                owner)
+        return record, permissions
+
+    def update_with_permissions(self, collection_id, parent_id, object_id,
+                                record, permission_backend,
+                                permission_object_id, permissions, owner,
+                                id_field=DEFAULT_ID_FIELD,
+                                modified_field=DEFAULT_MODIFIED_FIELD,
+                                auth=None, if_match=None):
+        """Overwrite the `object` with the specified `object_id`, replace
+        the specified `permissions` and give the ``write`` permission to
+        `owner`.
+
+        :param permission_backend: the permission backend instance.
+        :param str permission_object_id: the object id in permission backend.
+        :param dict permissions: the permissions to replace.
+        :param str owner: the principal to add to the ``write`` ACE.
+        :param int if_match: see :meth:`update`.
+
+        :returns: the updated object and its resulting permissions.
+        :rtype: tuple
+        """
+        record = self.update(collection_id, parent_id, object_id, record,
+                             id_field=id_field,
+                             modified_field=modified_field,
+                             auth=auth,
+                             if_match=if_match)
+        permissions = self._replace_permissions(permission_backend,
+                                                permission_object_id,
+                                                permissions,
+                                                owner)
+        return record, permissions
+
+    def _replace_permissions(self, permission_backend, perm_object_id,
+                             permissions, owner):
+        permission_backend.replace_object_permissions(perm_object_id,
+                                                      permissions)
+        permission_backend.add_principal_to_ace(perm_object_id, 'write', owner)
+        return permission_backend.get_object_permissions(perm_object_id)
+
     def update(self, collection_id, parent_id, object_id, record,
                id_field=DEFAULT_ID_FIELD,
                modified_field=DEFAULT_MODIFIED_FIELD,
-               auth=None):
+               auth=None, if_match=None):
         """Overwrite the `object` with the specified `object_id`.
 
         If the specified id is not found, the object is created with the
-        specified id.
+        specified id, unless `if_match` is provided.
 
         .. note::
 
             This will update the collection timestamp.
 
+        :raises: :exc:`kinto.core.storage.exceptions.RecordNotFoundError`
+            if `if_match` is provided and the object does not exist.
+        :raises: :exc:`kinto.core.storage.exceptions.ModifiedMeanwhileError`
+            if `if_match` is provided and differs from the object timestamp.
+
         :param str collection_id: the collection id.
         :param str parent_id: the collection parent.
         :param str object_id: unique identifier of the object
         :param dict record: the object to update or create.
+        :param int if_match: optional expected timestamp of the object, to
+            compare and overwrite it atomically.
 
         :returns: the updated object.
         :rtype: dict
         """
         raise NotImplementedError
 
+    def patch(self, collection_id, parent_id, object_id, changes,
+              removals=None, last_modified=None, if_match=None,
+              id_field=DEFAULT_ID_FIELD,
+              modified_field=DEFAULT_MODIFIED_FIELD,
+              auth=None):
+        """Modify some attributes of the `object` with the specified
+        `object_id`, without sending it entirely.
+
+        The default implementation fetches the object, applies the changes
+        and overwrites it. Backends can apply them in place instead.
+
+        .. note::
+
+            This will update the collection timestamp.
+
+        :raises: :exc:`kinto.core.storage.exceptions.RecordNotFoundError`
+        :raises: :exc:`kinto.core.storage.exceptions.ModifiedMeanwhileError`
+            if `if_match` is provided and differs from the object timestamp.
+
+        :param str collection_id: the collection id.
+        :param str parent_id: the collection parent.
+        :param str object_id: unique identifier of the object
+        :param list changes: list of ``(path, value)`` to set, where paths are
+            tuples of keys (see :func:`kinto.core.utils.dict_diff`).
+        :param list removals: list of paths to remove.
+        :param int last_modified: optional timestamp for the object.
+        :param int if_match: optional expected timestamp of the object.
+
+        :returns: the new timestamp of the object.
+        :rtype: int
+        """
+        existing = self.get(collection_id, parent_id, object_id,
+                            id_field=id_field,
+                            modified_field=modified_field,
+                            auth=auth)
+        if if_match is not None and existing[modified_field] != if_match:
+            raise exceptions.ModifiedMeanwhileError(existing)
+
+        record = copy.deepcopy(existing)
+        del record[modified_field]
+        for path, value in changes:
+            parent = record
+            for key in path[:-1]:
+                parent = parent[key]
+            parent[path[-1]] = value
+        for path in removals or []:
+            parent = record
+            for key in path[:-1]:
+                parent = parent[key]
+            parent.pop(path[-1], None)
+        if last_modified is not None:
+            record[modified_field] = last_modified
+
+        updated = self.update(collection_id, parent_id, object_id, record,
+                              id_field=id_field,
+                              modified_field=modified_field,
+                              auth=auth,
+                              if_match=if_match)
+        return updated[modified_field]
+
     def delete(self, collection_id, parent_id, object_id,
                id_field=DEFAULT_ID_FIELD, with_deleted=True,
                modified_field=DEFAULT_MODIFIED_FIELD,
@@ -199,7 +371,49 @@ class StorageBase(object):
         """
         raise NotImplementedError
 
+    def delete_all_with_old(self, collection_id, parent_id, filters=None,
+                            sorting=None, pagination_rules=None, limit=None,
+                            id_field=DEFAULT_ID_FIELD, with_deleted=True,
+                            modified_field=DEFAULT_MODIFIED_FIELD,
+                            deleted_field=DEFAULT_DELETED_FIELD,
+                            auth=None):
+        """Delete objects like :meth:`delete_all`, and also return them as
+        they were before their deletion, along with the total number of
+        objects matching the `filters`.
+
+        The default implementation reads the objects with :meth:`get_all`
+        before deleting them. Backends can do both at once instead.
+
+        :returns: the list of deleted objects with minimal set of attributes,
+            the list of objects as they were before deletion (in the same
+            order), and the total number of objects matching the filters.
+        :rtype: tuple
+        """
+        records, count = self.get_all(collection_id, parent_id,
+                                      filters=filters,
+                                      sorting=sorting,
+                                      pagination_rules=pagination_rules,
+                                      limit=limit,
+                                      id_field=id_field,
+                                      modified_field=modified_field,
+                                      deleted_field=deleted_field,
+                                      auth=auth)
+        deleted = self.delete_all(collection_id, parent_id,
+                                  filters=filters,
+                                  sorting=sorting,
+                                  pagination_rules=pagination_rules,
+                                  limit=limit,
+                                  id_field=id_field,
+                                  with_deleted=with_deleted,
+                                  modified_field=modified_field,
+                                  deleted_field=deleted_field,
+                                  auth=auth)
+        records_by_id = dict([(r[id_field], r) for r in records])
+        old = [records_by_id.get(d[id_field]) for d in deleted]
+        return deleted, old, count
+
     def purge_deleted(self, collection_id, parent_id, before=None,
+                      limit=None,
                       id_field=DEFAULT_ID_FIELD,
                       modified_field=DEFAULT_MODIFIED_FIELD,
                       auth=None):
@@ -210,6 +424,8 @@ class StorageBase(object):
         :param str parent_id: the collection parent.
 
         :param int before: Optionnal timestamp to limit deletion (exclusive)
+        :param int limit: Optionnal maximum number of tombstones to delete,
+            in order to purge them by chunks.
 
         :returns: The number of deleted objects.
         :rtype: int
@@ -219,7 +435,7 @@ class StorageBase(object):
 
     def get_all(self, collection_id, parent_id, filters=None, sorting=None,
                 pagination_rules=None, limit=None, include_deleted=False,
-                id_field=DEFAULT_ID_FIELD,
+                fields=None, id_field=DEFAULT_ID_FIELD,
                 modified_field=DEFAULT_MODIFIED_FIELD,
                 deleted_field=DEFAULT_DELETED_FIELD,
                 auth=None):
@@ -253,6 +469,11 @@ class StorageBase(object):
         :param bool include_deleted: Optionnally include the deleted objects
             that match the filters.
 
+        :param list fields: Optionnally restrict the attributes of the
+            returned objects. Subfields (e.g. ``author.name``) select their
+            root attribute. The id, modified and deleted fields are always
+            returned.
+
         :returns: the limited list of objects, and the total number of
             matching objects in the collection (deleted ones excluded).
         :rtype: tuple
@@ -23,6 +23,17 @@ class RecordNotFoundError(Exception):
     pass
 
 
+class ModifiedMeanwhileError(Exception):
+    """An exception raised when a conditional write is rejected, because
+    the record was modified meanwhile.
+
+    :param dict existing: the current version of the record, if known.
+    """
+    def __init__(self, existing=None, *args, **kwargs):
+        self.existing = existing
+        super(ModifiedMeanwhileError, self).__init__(*args, **kwargs)
+
+
 class IntegrityError(Exception):
     pass
 
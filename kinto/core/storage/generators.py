@@ -1,5 +1,8 @@
+import random
 import re
-from uuid import uuid4
+import threading
+import time
+from uuid import UUID, uuid4
 
 import six
 
@@ -58,3 +61,47 @@ Universally_unique_identifier#Random_UUID_probability_of_duplicates>`_).
 
     def __call__(self):
         return six.text_type(uuid4())
+
+
+class UUID7(UUID4):
+    """Time-ordered record id generator (UUID version 7).
+
+    Ids start with the current timestamp in milliseconds, followed by a counter
+    and 62 random bits. They are sorted in order of creation, even within the
+    same millisecond in a given process, so that new records are inserted at
+    the end of the ids indexes instead of at random places.
+    (example: ``'01580b2a-d7ea-7c41-9d4f-65b0e3ac8d3c'``)
+
+    Ids of records created by the same process roughly follow the order of
+    their ``last_modified`` timestamps.
+    """
+    _random = random.SystemRandom()
+
+    def __init__(self, config=None):
+        self._lock = threading.Lock()
+        self._last_timestamp = 0
+        self._counter = 0
+        super(UUID7, self).__init__(config)
+
+    def __call__(self):
+        timestamp = int(time.time() * 1000)
+        with self._lock:
+            if timestamp <= self._last_timestamp:
+                timestamp = self._last_timestamp
+                self._counter += 1
+                if self._counter > 0xfff:
+                    # Counter overflow: borrow the next millisecond.
+                    timestamp += 1
+                    self._counter = 0
+            else:
+                # Leave room for increments within the same millisecond.
+                self._counter = self._random.getrandbits(11)
+            self._last_timestamp = timestamp
+            counter = self._counter
+
+        value = ((timestamp & 0xffffffffffff) << 80 |
+                 0x7 << 76 |
+                 counter << 64 |
+                 0x2 << 62 |
+                 self._random.getrandbits(62))
+        return six.text_type(UUID(int=value))
@@ -1,6 +1,11 @@
+import bisect
 import re
 import operator
 from collections import defaultdict
+from itertools import islice
+
+import six
+from six.moves import range
 
 from kinto.core import utils
 from kinto.core.storage import (
@@ -9,8 +14,78 @@ from kinto.core.storage import (
 from kinto.core.utils import COMPARISON, synchronized
 
 
-def tree():
-    return defaultdict(tree)
+class IndexedCollection(object):
+    """Objects of a collection, by id, and sorted by timestamp.
+
+    Objects are listed in order of timestamp, within optional bounds, without
+    sorting them.
+    """
+    def __init__(self, modified_field=DEFAULT_MODIFIED_FIELD):
+        self.modified_field = modified_field
+        self._objects = {}
+        self._keys_by_id = {}
+        # Sorted ``(timestamp, id)`` keys, and their timestamps alone for bisection.
+        self._keys = []
+        self._timestamps = []
+
+    def __len__(self):
+        return len(self._objects)
+
+    def __contains__(self, object_id):
+        return object_id in self._objects
+
+    def get(self, object_id, default=None):
+        return self._objects.get(object_id, default)
+
+    def values(self):
+        return self._objects.values()
+
+    def put(self, object_id, record):
+        self.pop(object_id)
+        key = (record[self.modified_field], object_id)
+        i = bisect.bisect_right(self._keys, key)
+        self._keys.insert(i, key)
+        self._timestamps.insert(i, key[0])
+        self._keys_by_id[object_id] = key
+        self._objects[object_id] = record
+
+    def pop(self, object_id, default=None):
+        if object_id not in self._objects:
+            return default
+        key = self._keys_by_id.pop(object_id)
+        i = bisect.bisect_left(self._keys, key)
+        del self._keys[i]
+        del self._timestamps[i]
+        return self._objects.pop(object_id)
+
+    def count(self, lower=None, upper=None):
+        """Return the number of objects whose timestamp is within the bounds."""
+        start, stop = self._range(lower, upper)
+        return stop - start
+
+    def sorted_items(self, reverse=False, lower=None, upper=None):
+        """Iterate on the ``(key, record)`` of the objects whose timestamp is
+        within the bounds, in order of timestamp.
+
+        Bounds are ``(timestamp, inclusive)`` tuples.
+        """
+        start, stop = self._range(lower, upper)
+        positions = range(stop - 1, start - 1, -1) if reverse else range(start, stop)
+        for i in positions:
+            key = self._keys[i]
+            yield key, self._objects[key[1]]
+
+    def _range(self, lower, upper):
+        start, stop = 0, len(self._keys)
+        if lower is not None:
+            value, inclusive = lower
+            bisection = bisect.bisect_left if inclusive else bisect.bisect_right
+            start = bisection(self._timestamps, value)
+        if upper is not None:
+            value, inclusive = upper
+            bisection = bisect.bisect_right if inclusive else bisect.bisect_left
+            stop = bisection(self._timestamps, value)
+        return start, max(start, stop)
 
 
 class MemoryBasedStorage(StorageBase):
@@ -77,9 +152,63 @@ class Storage(MemoryBasedStorage):
         self.flush()
 
     def flush(self, auth=None):
-        self._store = tree()
-        self._cemetery = tree()
+        # {parent_id: {collection_id: IndexedCollection}}
+        self._store = {}
+        self._cemetery = {}
         self._timestamps = defaultdict(dict)
+        # Sorted parent ids, to look up wildcard parents by prefix.
+        self._parents = []
+
+    def _collection(self, store, parent_id, collection_id, create=False,
+                    modified_field=DEFAULT_MODIFIED_FIELD):
+        collections = store.get(parent_id)
+        if collections is None:
+            if not create:
+                return None
+            collections = store[parent_id] = {}
+            if parent_id is not None:
+                i = bisect.bisect_left(self._parents, parent_id)
+                if i == len(self._parents) or self._parents[i] != parent_id:
+                    self._parents.insert(i, parent_id)
+        collection = collections.get(collection_id)
+        if collection is None and create:
+            collection = collections[collection_id] = IndexedCollection(modified_field)
+        return collection
+
+    def _match_parents(self, store, parent_id):
+        """Return the parent ids of the store matching the specified one,
+        which may contain wildcards.
+        """
+        if parent_id is None or '*' not in parent_id:
+            return [parent_id] if parent_id in store else []
+        prefix = parent_id.split('*', 1)[0]
+        parent_id_match = re.compile("^%s$" % parent_id.replace('*', '.*'))
+        matching = []
+        i = bisect.bisect_left(self._parents, prefix)
+        while i < len(self._parents) and self._parents[i].startswith(prefix):
+            pid = self._parents[i]
+            if pid in store and parent_id_match.match(pid):
+                matching.append(pid)
+            i += 1
+        return matching
+
+    def _get_objects_by_parent_id(self, store, parent_id, collection_id,
+                                  with_meta=False):
+        objects = []
+        for pid in self._match_parents(store, parent_id):
+            collections = store[pid]
+            if collection_id is not None:
+                collections = {collection_id: collections.get(collection_id)}
+            for collection, colobjects in collections.items():
+                if colobjects is None:
+                    continue
+                for r in colobjects.values():
+                    if with_meta:
+                        objects.append(dict(__collection_id__=collection,
+                                            __parent_id__=pid, **r))
+                    else:
+                        objects.append(r)
+        return objects
 
     @synchronized
     def collection_timestamp(self, collection_id, parent_id, auth=None):
@@ -131,13 +260,16 @@ class Storage(MemoryBasedStorage):
     @synchronized
     def create(self, collection_id, parent_id, record, id_generator=None,
                id_field=DEFAULT_ID_FIELD,
-               modified_field=DEFAULT_MODIFIED_FIELD, auth=None):
+               modified_field=DEFAULT_MODIFIED_FIELD, auth=None,
+               if_none_match=False):
         id_generator = id_generator or self.id_generator
         record = record.copy()
         if id_field in record:
             # Raise unicity error if record with same id already exists.
             try:
                 existing = self.get(collection_id, parent_id, record[id_field])
+                if if_none_match:
+                    raise exceptions.ModifiedMeanwhileError(existing)
                 raise exceptions.UnicityError(id_field, existing)
             except exceptions.RecordNotFoundError:
                 pass
@@ -147,32 +279,43 @@ class Storage(MemoryBasedStorage):
         self.set_record_timestamp(collection_id, parent_id, record,
                                   modified_field=modified_field)
         _id = record[id_field]
-        self._store[parent_id][collection_id][_id] = record
-        self._cemetery[parent_id][collection_id].pop(_id, None)
+        self._put(collection_id, parent_id, _id, record, modified_field)
         return record
 
+    def _put(self, collection_id, parent_id, object_id, record, modified_field):
+        collection = self._collection(self._store, parent_id, collection_id,
+                                      create=True, modified_field=modified_field)
+        collection.put(object_id, record)
+        deleted = self._collection(self._cemetery, parent_id, collection_id)
+        if deleted is not None:
+            deleted.pop(object_id)
+
     @synchronized
     def get(self, collection_id, parent_id, object_id,
             id_field=DEFAULT_ID_FIELD,
             modified_field=DEFAULT_MODIFIED_FIELD,
             auth=None):
-        collection = self._store[parent_id][collection_id]
-        if object_id not in collection:
+        collection = self._collection(self._store, parent_id, collection_id)
+        if collection is None or object_id not in collection:
             raise exceptions.RecordNotFoundError(object_id)
-        return collection[object_id].copy()
+        return collection.get(object_id).copy()
 
     @synchronized
     def update(self, collection_id, parent_id, object_id, record,
                id_field=DEFAULT_ID_FIELD,
                modified_field=DEFAULT_MODIFIED_FIELD,
-               auth=None):
+               auth=None, if_match=None):
+        if if_match is not None:
+            existing = self.get(collection_id, parent_id, object_id)
+            if existing[modified_field] != if_match:
+                raise exceptions.ModifiedMeanwhileError(existing)
+
         record = record.copy()
         record[id_field] = object_id
 
         self.set_record_timestamp(collection_id, parent_id, record,
                                   modified_field=modified_field)
-        self._store[parent_id][collection_id][object_id] = record
-        self._cemetery[parent_id][collection_id].pop(object_id, None)
+        self._put(collection_id, parent_id, object_id, record, modified_field)
         return record
 
     @synchronized
@@ -195,50 +338,109 @@ class Storage(MemoryBasedStorage):
         # Add to deleted items, remove from store.
         if with_deleted:
             deleted = existing.copy()
-            self._cemetery[parent_id][collection_id][object_id] = deleted
-        self._store[parent_id][collection_id].pop(object_id)
+            cemetery = self._collection(self._cemetery, parent_id, collection_id,
+                                        create=True, modified_field=modified_field)
+            cemetery.put(object_id, deleted)
+        self._collection(self._store, parent_id, collection_id).pop(object_id)
         return existing
 
     @synchronized
     def purge_deleted(self, collection_id, parent_id, before=None,
+                      limit=None,
                       id_field=DEFAULT_ID_FIELD,
                       modified_field=DEFAULT_MODIFIED_FIELD,
                       auth=None):
-        parent_id_match = re.compile(parent_id.replace('*', '.*'))
-        by_parent_id = {pid: collections
-                        for pid, collections in self._cemetery.items()
-                        if parent_id_match.match(pid)}
+        upper = (before, False) if before is not None else None
         num_deleted = 0
-        for pid, collections in by_parent_id.items():
+        for pid in self._match_parents(self._cemetery, parent_id):
+            collections = self._cemetery[pid]
             if collection_id is not None:
-                collections = {collection_id: collections[collection_id]}
+                collections = {collection_id: collections.get(collection_id)}
             for collection, colrecords in collections.items():
-                if before is None:
-                    kept = {}
-                else:
-                    kept = {key: value for key, value in
-                            colrecords.items()
-                            if value[modified_field] >= before}
-                self._cemetery[pid][collection] = kept
-                num_deleted += (len(colrecords) - len(kept))
+                if colrecords is None:
+                    continue
+                # Oldest tombstones first.
+                purged = colrecords.sorted_items(upper=upper)
+                if limit is not None:
+                    purged = islice(purged, limit - num_deleted)
+                purged = [object_id for (_, object_id), _ in purged]
+                for key in purged:
+                    colrecords.pop(key)
+                num_deleted += len(purged)
         return num_deleted
 
     @synchronized
     def get_all(self, collection_id, parent_id, filters=None, sorting=None,
                 pagination_rules=None, limit=None, include_deleted=False,
-                id_field=DEFAULT_ID_FIELD,
+                fields=None, id_field=DEFAULT_ID_FIELD,
                 modified_field=DEFAULT_MODIFIED_FIELD,
                 deleted_field=DEFAULT_DELETED_FIELD,
                 auth=None):
 
-        records = _get_objects_by_parent_id(self._store, parent_id, collection_id)
+        by_timestamp = (parent_id is not None and '*' not in parent_id and
+                        collection_id is not None and
+                        len(sorting or []) == 1 and sorting[0].field == modified_field and
+                        len(pagination_rules or []) <= 1)
+        if by_timestamp:
+            # Use the timestamps index of the collection, instead of sorting.
+            records, count = self._get_all_by_timestamp(
+                collection_id, parent_id, filters=filters or [],
+                direction=sorting[0].direction,
+                pagination_rule=(pagination_rules or [[]])[0],
+                limit=limit, include_deleted=include_deleted,
+                modified_field=modified_field)
+        else:
+            records, count = self._get_all_sorted(
+                collection_id, parent_id, filters=filters, sorting=sorting,
+                pagination_rules=pagination_rules, limit=limit,
+                include_deleted=include_deleted, id_field=id_field,
+                deleted_field=deleted_field)
+
+        if fields:
+            extract = fields_extractor(fields, id_field=id_field,
+                                       modified_field=modified_field,
+                                       deleted_field=deleted_field)
+            records = [extract(r) for r in records]
+        return records, count
+
+    def _get_all_by_timestamp(self, collection_id, parent_id, filters, direction,
+                              pagination_rule, limit, include_deleted,
+                              modified_field):
+        lower, upper, others = _timestamp_bounds(filters, modified_field)
+        page_lower, page_upper, page_others = _timestamp_bounds(pagination_rule,
+                                                                modified_field)
+
+        records = self._collection(self._store, parent_id, collection_id)
+        if records is None:
+            records = IndexedCollection(modified_field)
+        if others:
+            matching = (record for _, record in records.sorted_items(lower=lower, upper=upper))
+            count = len(list(apply_filters(matching, others)))
+        else:
+            count = records.count(lower=lower, upper=upper)
+
+        lower = _tighter_bound(lower, page_lower, upper=False)
+        upper = _tighter_bound(upper, page_upper, upper=True)
+        reverse = direction < 0
+        sources = [records.sorted_items(reverse, lower, upper)]
+        deleted = self._collection(self._cemetery, parent_id, collection_id)
+        if include_deleted and deleted is not None:
+            sources.append(deleted.sorted_items(reverse, lower, upper))
+        ordered = (record for _, record in _merge_sorted(sources, reverse))
+        matching = apply_filters(ordered, others + page_others)
+        return list(islice(matching, limit or None)), count
+
+    def _get_all_sorted(self, collection_id, parent_id, filters, sorting,
+                        pagination_rules, limit, include_deleted, id_field,
+                        deleted_field):
+        records = self._get_objects_by_parent_id(self._store, parent_id, collection_id)
 
         records, count = self.extract_record_set(records=records,
                                                  filters=filters, sorting=None,
                                                  id_field=id_field, deleted_field=deleted_field)
         deleted = []
         if include_deleted:
-            deleted = _get_objects_by_parent_id(self._cemetery, parent_id, collection_id)
+            deleted = self._get_objects_by_parent_id(self._cemetery, parent_id, collection_id)
 
         records, count = self.extract_record_set(records=records + deleted,
                                                  filters=filters, sorting=sorting,
@@ -253,7 +455,8 @@ class Storage(MemoryBasedStorage):
                    modified_field=DEFAULT_MODIFIED_FIELD,
                    deleted_field=DEFAULT_DELETED_FIELD,
                    auth=None):
-        records = _get_objects_by_parent_id(self._store, parent_id, collection_id, with_meta=True)
+        records = self._get_objects_by_parent_id(self._store, parent_id, collection_id,
+                                                 with_meta=True)
         records, count = self.extract_record_set(records=records,
                                                  filters=filters,
                                                  sorting=sorting,
@@ -270,6 +473,36 @@ class Storage(MemoryBasedStorage):
                    for r in records]
         return deleted
 
+    @synchronized
+    def delete_all_with_old(self, collection_id, parent_id, filters=None,
+                            sorting=None, pagination_rules=None, limit=None,
+                            id_field=DEFAULT_ID_FIELD, with_deleted=True,
+                            modified_field=DEFAULT_MODIFIED_FIELD,
+                            deleted_field=DEFAULT_DELETED_FIELD,
+                            auth=None):
+        records = self._get_objects_by_parent_id(self._store, parent_id, collection_id,
+                                                 with_meta=True)
+        records, count = self.extract_record_set(records=records,
+                                                 filters=filters,
+                                                 sorting=sorting,
+                                                 pagination_rules=pagination_rules, limit=limit,
+                                                 id_field=id_field,
+                                                 deleted_field=deleted_field)
+        deleted = []
+        old = []
+        for r in records:
+            r = r.copy()
+            record_collection_id = r.pop('__collection_id__')
+            record_parent_id = r.pop('__parent_id__')
+            old.append(r)
+            deleted.append(self.delete(record_collection_id,
+                                       record_parent_id,
+                                       r[id_field],
+                                       id_field=id_field, with_deleted=with_deleted,
+                                       modified_field=modified_field,
+                                       deleted_field=deleted_field))
+        return deleted, old, count
+
 
 def extract_record_set(records, filters, sorting,
                        pagination_rules=None, limit=None,
@@ -287,7 +520,7 @@ def extract_record_set(records, filters, sorting,
         values = list(apply_filters(filtered, rule))
         paginated.update(dict(((x[id_field], x) for x in values)))
 
-    if paginated:
+    if pagination_rules:
         paginated = paginated.values()
     else:
         paginated = filtered
@@ -303,6 +536,20 @@ def extract_record_set(records, filters, sorting,
     return sorted_, total_records - filtered_deleted
 
 
+def fields_extractor(fields, id_field=DEFAULT_ID_FIELD,
+                     modified_field=DEFAULT_MODIFIED_FIELD,
+                     deleted_field=DEFAULT_DELETED_FIELD):
+    """Return a function that restricts records to the root attributes of
+    the specified `fields`.
+    """
+    roots = set([f.split('.', 1)[0] for f in fields])
+    roots.update([id_field, modified_field, deleted_field])
+
+    def extract(record):
+        return dict([(k, v) for k, v in record.items() if k in roots])
+    return extract
+
+
 def apply_filters(records, filters):
     """Filter the specified records, using basic iteration.
     """
@@ -378,27 +625,57 @@ def apply_sorting(records, sorting):
     return result
 
 
-def _get_objects_by_parent_id(store, parent_id, collection_id, with_meta=False):
-    if parent_id is not None:
-        parent_id_match = re.compile("^%s$" % parent_id.replace('*', '.*'))
-        by_parent_id = {pid: collections
-                        for pid, collections in store.items()
-                        if parent_id_match.match(pid)}
-    else:
-        by_parent_id = store[parent_id]
-
-    objects = []
-    for pid, collections in by_parent_id.items():
-        if collection_id is not None:
-            collections = {collection_id: collections[collection_id]}
-        for collection, colobjects in collections.items():
-            for r in colobjects.values():
-                if with_meta:
-                    objects.append(dict(__collection_id__=collection,
-                                        __parent_id__=pid, **r))
-                else:
-                    objects.append(r)
-    return objects
+_LOWER_BOUNDS = {COMPARISON.GT: False, COMPARISON.MIN: True, COMPARISON.EQ: True}
+_UPPER_BOUNDS = {COMPARISON.LT: False, COMPARISON.MAX: True, COMPARISON.EQ: True}
+
+
+def _timestamp_bounds(filters, modified_field):
+    """Split the filters between the bounds of timestamps they define, as
+    ``(timestamp, inclusive)`` tuples, and the other filters.
+    """
+    lower = upper = None
+    others = []
+    for f in filters:
+        is_number = (isinstance(f.value, six.integer_types + (float,)) and
+                     not isinstance(f.value, bool))
+        is_bound = f.operator in _LOWER_BOUNDS or f.operator in _UPPER_BOUNDS
+        if f.field != modified_field or not is_number or not is_bound:
+            others.append(f)
+            continue
+        if f.operator in _LOWER_BOUNDS:
+            lower = _tighter_bound(lower, (f.value, _LOWER_BOUNDS[f.operator]), upper=False)
+        if f.operator in _UPPER_BOUNDS:
+            upper = _tighter_bound(upper, (f.value, _UPPER_BOUNDS[f.operator]), upper=True)
+    return lower, upper, others
+
+
+def _tighter_bound(a, b, upper):
+    if a is None or b is None:
+        return a if b is None else b
+    if a[0] == b[0]:
+        # Exclusive bounds are tighter.
+        return a if not a[1] else b
+    if upper:
+        return a if a[0] < b[0] else b
+    return a if a[0] > b[0] else b
+
+
+def _merge_sorted(sources, reverse):
+    """Merge iterators of ``(key, record)`` sorted by key."""
+    heads = []
+    for source in sources:
+        head = next(source, None)
+        if head is not None:
+            heads.append([head, source])
+    while heads:
+        pick = max if reverse else min
+        current = pick(heads, key=lambda h: h[0][0])
+        yield current[0]
+        head = next(current[1], None)
+        if head is None:
+            heads.remove(current)
+        else:
+            current[0] = head
 
 
 def load_from_config(config):
@@ -3,13 +3,15 @@ import warnings
 from collections import defaultdict
 
 import six
+from pyramid.settings import asbool
 
 from kinto.core import logger
 from kinto.core.storage import (
     StorageBase, exceptions,
     DEFAULT_ID_FIELD, DEFAULT_MODIFIED_FIELD, DEFAULT_DELETED_FIELD)
 from kinto.core.storage.postgresql.client import create_from_config
-from kinto.core.utils import COMPARISON, json
+from kinto.core.storage.postgresql.timestamps import TimestampsCache
+from kinto.core.utils import COMPARISON, json, sqlalchemy
 
 
 class Storage(StorageBase):
@@ -59,6 +61,32 @@ class Storage(StorageBase):
     <http://docs.sqlalchemy.org/en/rel_1_0/core/engines.html>`_
     for default values and behaviour.
 
+    Collection timestamps can be cached in memory, and invalidated through
+    PostgreSQL notifications when they are bumped from any process::
+
+        kinto.storage_timestamps_cache = true
+
+    This requires a dedicated connection per process, kept open to listen
+    to notifications.
+
+    Tombstones are kept in the ``records`` table, flagged with the
+    ``deleted`` column, so that listings with or without tombstones are
+    scans of a single index. The migration to schema version 17 copies the
+    tombstones without locking the previous ``deleted`` table, and the
+    partial index of live records is then built concurrently, without
+    blocking writes. Previous versions cannot run alongside schema version
+    17 though, since they would list the copied tombstones as records.
+
+    The records table can be partitioned by hash of ``parent_id``
+    (*requires PostgreSQL 13 or higher*), so that vacuum, indices and the
+    deletion of the objects of a parent are confined to one partition::
+
+        kinto.storage_partitions = 16
+
+    The existing table is converted when running ``kinto migrate``, as well
+    as when the number of partitions is changed. Rows are copied with their
+    timestamps, and writes are blocked during the copy.
+
     .. note::
 
         Using a `dedicated connection pool <http://pgpool.net>`_ is still
@@ -67,12 +95,15 @@ class Storage(StorageBase):
 
     """  # NOQA
 
-    schema_version = 14
+    schema_version = 17
 
-    def __init__(self, client, max_fetch_size, *args, **kwargs):
+    def __init__(self, client, max_fetch_size, timestamps_cache=None,
+                 partitions=None, *args, **kwargs):
         super(Storage, self).__init__(*args, **kwargs)
         self.client = client
         self._max_fetch_size = max_fetch_size
+        self._timestamps_cache = timestamps_cache
+        self._partitions = partitions
 
     def _execute_sql_file(self, filepath):
         schema = open(filepath).read()
@@ -82,6 +113,7 @@ class Storage(StorageBase):
 
     def initialize_schema(self, dry_run=False):
         """Create PostgreSQL tables, and run necessary schema migrations.
+        Partition the records table if configured.
 
         .. note::
 
@@ -102,7 +134,15 @@ class Storage(StorageBase):
                 self._execute_sql_file(filepath)
                 logger.info('Created PostgreSQL storage schema '
                             '(version %s).' % self.schema_version)
-            return
+        else:
+            self._migrate_schema(version, dry_run)
+            self._create_live_records_index(dry_run)
+
+        if self._partitions:
+            self._partition_records(self._partitions, dry_run)
+
+    def _migrate_schema(self, version, dry_run):
+        here = os.path.abspath(os.path.dirname(__file__))
 
         logger.info('Detected PostgreSQL storage schema version %s.' % version)
         migrations = [(v, v + 1) for v in range(version, self.schema_version)]
@@ -129,6 +169,111 @@ class Storage(StorageBase):
         logger.info("PostgreSQL storage schema migration " +
                     ("simulated." if dry_run else "done."))
 
+    def _create_live_records_index(self, dry_run):
+        """Build the partial index of live records if it is missing (e.g.
+        after the migration to schema version 17), without blocking writes.
+        """
+        name = 'idx_records_live_parent_id_collection_id_last_modified'
+        with self.client.connect(readonly=True) as conn:
+            query = """
+            SELECT i.indisvalid
+              FROM pg_index AS i
+              JOIN pg_class AS c ON c.oid = i.indexrelid
+             WHERE c.relname = :name;
+            """
+            result = conn.execute(query, dict(name=name))
+            existing = result.fetchone()
+        if existing is not None and existing[0]:
+            return
+
+        logger.info('Create PostgreSQL index %s concurrently.' % name)
+        if dry_run:
+            return
+        statements = []
+        if existing is not None:
+            # Left invalid by an interrupted build.
+            statements.append('DROP INDEX CONCURRENTLY %s;' % name)
+        statements.append("""
+        CREATE INDEX CONCURRENTLY %s
+            ON records(parent_id, collection_id, last_modified DESC)
+            WHERE deleted IS NOT TRUE;
+        """ % name)
+        # Concurrent builds cannot run within a transaction.
+        with self.client.engine.connect() as conn:
+            conn = conn.execution_options(isolation_level='AUTOCOMMIT')
+            for statement in statements:
+                conn.execute(statement)
+
+    def _partition_records(self, partitions, dry_run):
+        """Convert the records table into a table partitioned by hash of
+        ``parent_id``, unless it already has this number of partitions.
+        """
+        with self.client.connect() as conn:
+            query = "SELECT current_setting('server_version_num')::INT;"
+            result = conn.execute(query)
+            if result.fetchone()[0] < 130000:
+                raise AssertionError('Partitioning of records requires '
+                                     'PostgreSQL 13 or higher')
+            query = """
+            SELECT COUNT(*)
+              FROM pg_inherits
+             WHERE inhparent = to_regclass('records');
+            """
+            result = conn.execute(query)
+            current = result.fetchone()[0]
+
+        if current == partitions:
+            logger.info('PostgreSQL records table has %s partitions.' %
+                        partitions)
+            return
+
+        logger.info('Partition PostgreSQL records table from %s to %s '
+                    'partitions.' % (current, partitions))
+        if dry_run:
+            return
+
+        # Partitions are named after their number, so that the previous ones
+        # can be dropped along with their table once the rows were copied.
+        create_partitions = ''.join([
+            """
+            CREATE TABLE records_%(modulus)s_%(remainder)s
+                PARTITION OF records_partitioned
+                FOR VALUES WITH (MODULUS %(modulus)s, REMAINDER %(remainder)s);
+            """ % dict(modulus=partitions, remainder=i)
+            for i in range(partitions)])
+
+        query = """
+        -- Reads are still served from the previous table during the copy.
+        LOCK TABLE records IN SHARE MODE;
+
+        CREATE TABLE records_partitioned (
+            LIKE records INCLUDING DEFAULTS
+        ) PARTITION BY HASH (parent_id);
+        %(create_partitions)s
+
+        -- The trigger does not exist yet: timestamps are kept.
+        INSERT INTO records_partitioned SELECT * FROM records;
+
+        DROP TABLE records;
+        ALTER TABLE records_partitioned RENAME TO records;
+
+        ALTER TABLE records ADD PRIMARY KEY (id, parent_id, collection_id);
+        CREATE UNIQUE INDEX idx_records_parent_id_collection_id_last_modified
+            ON records(parent_id, collection_id, last_modified DESC);
+        CREATE INDEX idx_records_last_modified_epoch
+            ON records(as_epoch(last_modified));
+        CREATE INDEX idx_records_live_parent_id_collection_id_last_modified
+            ON records(parent_id, collection_id, last_modified DESC)
+            WHERE deleted IS NOT TRUE;
+
+        CREATE TRIGGER tgr_records_last_modified
+        BEFORE INSERT OR UPDATE OF data ON records
+        FOR EACH ROW EXECUTE PROCEDURE bump_timestamp();
+        """ % dict(create_partitions=create_partitions)
+        with self.client.connect(force_commit=True) as conn:
+            conn.execute(query)
+        logger.info('Partitioned PostgreSQL records table.')
+
     def _check_database_timezone(self):
         # Make sure database has UTC timezone.
         query = "SELECT current_setting('TIMEZONE') AS timezone;"
@@ -194,30 +339,58 @@ class Storage(StorageBase):
         in tests suites.
         """
         query = """
-        DELETE FROM deleted;
         DELETE FROM records;
         DELETE FROM timestamps;
         DELETE FROM metadata;
         """
         with self.client.connect(force_commit=True) as conn:
             conn.execute(query)
+        if self._timestamps_cache is not None:
+            self._timestamps_cache.clear()
         logger.debug('Flushed PostgreSQL storage tables')
 
     def collection_timestamp(self, collection_id, parent_id, auth=None):
+        cache = self._timestamps_cache
+        if cache is not None:
+            cached = cache.get(collection_id, parent_id)
+            if cached is not None:
+                return cached
+            generation = cache.generation()
+
+        placeholders = dict(parent_id=parent_id, collection_id=collection_id)
+
+        # Most of the time, the timestamp was already written: read it
+        # without opening a write transaction.
+        query = """
+        SELECT as_epoch(collection_timestamp_readonly(:parent_id, :collection_id))
+            AS last_modified;
+        """
+        with self.client.connect(readonly=True) as conn:
+            result = conn.execute(query, placeholders)
+            record = result.fetchone()
+        if record['last_modified'] is not None:
+            if cache is not None:
+                cache.set(collection_id, parent_id, record['last_modified'],
+                          generation)
+            return record['last_modified']
+
+        # Collection was never hit: initialize its timestamp.
         query = """
         SELECT as_epoch(collection_timestamp(:parent_id, :collection_id))
             AS last_modified;
         """
-        placeholders = dict(parent_id=parent_id, collection_id=collection_id)
         with self.client.connect(readonly=False) as conn:
             result = conn.execute(query, placeholders)
             record = result.fetchone()
         return record['last_modified']
 
-    def create(self, collection_id, parent_id, record, id_generator=None,
-               id_field=DEFAULT_ID_FIELD,
-               modified_field=DEFAULT_MODIFIED_FIELD,
-               auth=None):
+    def _prepare_record_id(self, collection_id, parent_id, record,
+                           id_generator, id_field):
+        """Return a copy of `record` with its id, generated if missing.
+
+        :raises: :exc:`kinto.core.storage.exceptions.UnicityError` if
+            a record with the same id already exists.
+        """
         id_generator = id_generator or self.id_generator
         record = record.copy()
         if id_field in record:
@@ -229,6 +402,31 @@ class Storage(StorageBase):
                 pass
         else:
             record[id_field] = id_generator()
+        return record
+
+    def _timestamp_bumped(self, collection_id, parent_id):
+        if self._timestamps_cache is not None:
+            self._timestamps_cache.written(collection_id, parent_id)
+
+    def _shares_client(self, permission_backend):
+        """Return ``True`` if the permission backend uses the same database
+        client, allowing records and ACLs to be read and written together.
+        """
+        client = getattr(permission_backend, 'client', None)
+        return client is not None and client is self.client
+
+    def create(self, collection_id, parent_id, record, id_generator=None,
+               id_field=DEFAULT_ID_FIELD,
+               modified_field=DEFAULT_MODIFIED_FIELD,
+               auth=None, if_none_match=False):
+        if if_none_match:
+            # The existence check is done by the insertion itself.
+            record = record.copy()
+            if id_field not in record:
+                record[id_field] = (id_generator or self.id_generator)()
+        else:
+            record = self._prepare_record_id(collection_id, parent_id, record,
+                                             id_generator, id_field)
 
         # Remove redundancy in data field
         query_record = record.copy()
@@ -236,26 +434,48 @@ class Storage(StorageBase):
         query_record.pop(modified_field, None)
 
         query = """
-        WITH delete_potential_tombstone AS (
-            DELETE FROM deleted
-             WHERE id = :object_id
-               AND parent_id = :parent_id
-               AND collection_id = :collection_id
-        )
-        INSERT INTO records (id, parent_id, collection_id, data, last_modified)
-        VALUES (:object_id, :parent_id,
-                :collection_id, (:data)::JSONB,
-                from_epoch(:last_modified))
-        RETURNING id, as_epoch(last_modified) AS last_modified;
-        """
+        WITH %(write)s
+        SELECT id, as_epoch(last_modified) AS last_modified
+          FROM revived
+         UNION ALL
+        SELECT id, as_epoch(last_modified) AS last_modified
+          FROM inserted;
+        """ % dict(write=_CREATE_OVER_TOMBSTONE)
         placeholders = dict(object_id=record[id_field],
                             parent_id=parent_id,
                             collection_id=collection_id,
                             last_modified=record.get(modified_field),
                             data=json.dumps(query_record))
         with self.client.connect() as conn:
-            result = conn.execute(query, placeholders)
-            inserted = result.fetchone()
+            # A record created concurrently is only seen through the primary
+            # key: catch its violation within a savepoint, so that the
+            # transaction can go on.
+            savepoint = conn.begin_nested() if if_none_match else None
+            violation = None
+            try:
+                result = conn.execute(query, placeholders)
+                inserted = result.fetchone()
+            except sqlalchemy.exc.IntegrityError as e:
+                if savepoint is None:
+                    raise
+                savepoint.rollback()
+                inserted = None
+                violation = e
+            else:
+                if savepoint is not None:
+                    savepoint.commit()
+        if inserted is None:
+            try:
+                existing = self.get(collection_id, parent_id, record[id_field])
+            except exceptions.RecordNotFoundError:
+                if violation is None:
+                    raise
+                # Another constraint was violated.
+                raise exceptions.BackendError(original=violation)
+            if if_none_match:
+                raise exceptions.ModifiedMeanwhileError(existing)
+            raise exceptions.UnicityError(id_field, existing)
+        self._timestamp_bumped(collection_id, parent_id)
 
         record[modified_field] = inserted['last_modified']
         return record
@@ -269,7 +489,8 @@ class Storage(StorageBase):
           FROM records
          WHERE id = :object_id
            AND parent_id = :parent_id
-           AND collection_id = :collection_id;
+           AND collection_id = :collection_id
+           AND deleted IS NOT TRUE;
         """
         placeholders = dict(object_id=object_id,
                             parent_id=parent_id,
@@ -286,23 +507,58 @@ class Storage(StorageBase):
         record[modified_field] = existing['last_modified']
         return record
 
+    def get_with_permissions(self, collection_id, parent_id, object_id,
+                             permission_backend, permission_object_id,
+                             id_field=DEFAULT_ID_FIELD,
+                             modified_field=DEFAULT_MODIFIED_FIELD,
+                             auth=None):
+        if not self._shares_client(permission_backend):
+            return super(Storage, self).get_with_permissions(
+                collection_id, parent_id, object_id,
+                permission_backend, permission_object_id,
+                id_field=id_field, modified_field=modified_field, auth=auth)
+
+        query = """
+        SELECT as_epoch(last_modified) AS last_modified, data,
+               %(aces)s AS aces
+          FROM records
+         WHERE id = :object_id
+           AND parent_id = :parent_id
+           AND collection_id = :collection_id
+           AND deleted IS NOT TRUE;
+        """ % dict(aces=_OBJECT_ACES_SUBQUERY)
+        placeholders = dict(object_id=object_id,
+                            parent_id=parent_id,
+                            collection_id=collection_id,
+                            perm_object_id=permission_object_id)
+        with self.client.connect(readonly=True) as conn:
+            result = conn.execute(query, placeholders)
+            if result.rowcount == 0:
+                raise exceptions.RecordNotFoundError(object_id)
+            else:
+                existing = result.fetchone()
+
+        record = existing['data']
+        record[id_field] = object_id
+        record[modified_field] = existing['last_modified']
+        return record, _aces_to_permissions(existing['aces'])
+
     def update(self, collection_id, parent_id, object_id, record,
                id_field=DEFAULT_ID_FIELD,
                modified_field=DEFAULT_MODIFIED_FIELD,
-               auth=None):
+               auth=None, if_match=None):
 
         # Remove redundancy in data field
         query_record = record.copy()
         query_record.pop(id_field, None)
         query_record.pop(modified_field, None)
 
+        if if_match is not None:
+            return self._update_if_match(collection_id, parent_id, object_id,
+                                         record, query_record, if_match,
+                                         id_field, modified_field)
+
         query_create = """
-        WITH delete_potential_tombstone AS (
-            DELETE FROM deleted
-             WHERE id = :object_id
-               AND parent_id = :parent_id
-               AND collection_id = :collection_id
-        )
         INSERT INTO records (id, parent_id, collection_id, data, last_modified)
         VALUES (:object_id, :parent_id,
                 :collection_id, (:data)::JSONB,
@@ -310,9 +566,11 @@ class Storage(StorageBase):
         RETURNING as_epoch(last_modified) AS last_modified;
         """
 
+        # Overwrite the tombstone if any.
         query_update = """
         UPDATE records SET data=(:data)::JSONB,
-                           last_modified=from_epoch(:last_modified)
+                           last_modified=from_epoch(:last_modified),
+                           deleted=FALSE
         WHERE id = :object_id
            AND parent_id = :parent_id
            AND collection_id = :collection_id
@@ -340,29 +598,279 @@ class Storage(StorageBase):
 
             result = conn.execute(query, placeholders)
             updated = result.fetchone()
+        self._timestamp_bumped(collection_id, parent_id)
+
+        record[modified_field] = updated['last_modified']
+        return record
+
+    def _update_if_match(self, collection_id, parent_id, object_id, record,
+                         query_record, if_match, id_field, modified_field):
+        """Overwrite the record only if its timestamp is still `if_match`,
+        with a single statement.
+        """
+        query = """
+        UPDATE records SET data=(:data)::JSONB,
+                           last_modified=from_epoch(:last_modified)
+        WHERE id = :object_id
+           AND parent_id = :parent_id
+           AND collection_id = :collection_id
+           AND deleted IS NOT TRUE
+           AND as_epoch(last_modified) = :if_match
+        RETURNING as_epoch(last_modified) AS last_modified;
+        """
+        placeholders = dict(object_id=object_id,
+                            parent_id=parent_id,
+                            collection_id=collection_id,
+                            last_modified=record.get(modified_field),
+                            data=json.dumps(query_record),
+                            if_match=if_match)
+        with self.client.connect() as conn:
+            result = conn.execute(query, placeholders)
+            updated = result.fetchone()
+        if updated is None:
+            # Raises if the record does not exist.
+            existing = self.get(collection_id, parent_id, object_id)
+            raise exceptions.ModifiedMeanwhileError(existing)
+        self._timestamp_bumped(collection_id, parent_id)
 
+        record = record.copy()
+        record[id_field] = object_id
         record[modified_field] = updated['last_modified']
         return record
 
+    def patch(self, collection_id, parent_id, object_id, changes,
+              removals=None, last_modified=None, if_match=None,
+              id_field=DEFAULT_ID_FIELD,
+              modified_field=DEFAULT_MODIFIED_FIELD,
+              auth=None):
+        """Apply the changes on the stored document, so that only the
+        modified attributes are sent to the database.
+        """
+        query = """
+        UPDATE records
+           SET data = %(data)s,
+               last_modified = from_epoch(:last_modified)
+         WHERE id = :object_id
+           AND parent_id = :parent_id
+           AND collection_id = :collection_id
+           AND deleted IS NOT TRUE
+           %(if_match_filter)s
+        RETURNING as_epoch(last_modified) AS last_modified;
+        """
+        placeholders = dict(object_id=object_id,
+                            parent_id=parent_id,
+                            collection_id=collection_id,
+                            last_modified=last_modified)
+        safeholders = defaultdict(six.text_type)
+
+        # Top level attributes are merged at once, nested ones are set
+        # individually, and removed ones are dropped.
+        data = 'data'
+        merged = {}
+        for i, (path, value) in enumerate(changes):
+            if len(path) == 1:
+                merged[path[0]] = value
+                continue
+            data = 'jsonb_set(%s, (:path_%s)::TEXT[], (:value_%s)::JSONB)' % (
+                data, i, i)
+            placeholders['path_%s' % i] = list(path)
+            placeholders['value_%s' % i] = json.dumps(value)
+        if merged:
+            data = '(%s || (:merged)::JSONB)' % data
+            placeholders['merged'] = json.dumps(merged)
+        for i, path in enumerate(removals or []):
+            data = '(%s #- (:removed_%s)::TEXT[])' % (data, i)
+            placeholders['removed_%s' % i] = list(path)
+        safeholders['data'] = data
+
+        if if_match is not None:
+            safeholders['if_match_filter'] = \
+                'AND as_epoch(last_modified) = :if_match'
+            placeholders['if_match'] = if_match
+
+        with self.client.connect() as conn:
+            result = conn.execute(query % safeholders, placeholders)
+            updated = result.fetchone()
+
+        if updated is None:
+            # Either the record is missing, or it was modified meanwhile.
+            existing = self.get(collection_id, parent_id, object_id,
+                                id_field=id_field,
+                                modified_field=modified_field,
+                                auth=auth)
+            raise exceptions.ModifiedMeanwhileError(existing)
+        self._timestamp_bumped(collection_id, parent_id)
+
+        return updated['last_modified']
+
+    def create_with_permissions(self, collection_id, parent_id, record,
+                                permission_backend, get_permission_object_id,
+                                permissions, owner, id_generator=None,
+                                id_field=DEFAULT_ID_FIELD,
+                                modified_field=DEFAULT_MODIFIED_FIELD,
+                                auth=None, if_none_match=False):
+        # Conditional writes must fail before the permissions are touched.
+        if if_none_match or not self._shares_client(permission_backend):
+            return super(Storage, self).create_with_permissions(
+                collection_id, parent_id, record,
+                permission_backend, get_permission_object_id,
+                permissions, owner, id_generator=id_generator,
+                id_field=id_field, modified_field=modified_field, auth=auth,
+                if_none_match=if_none_match)
+
+        record = self._prepare_record_id(collection_id, parent_id, record,
+                                         id_generator, id_field)
+        query_record = record.copy()
+        query_record.pop(id_field, None)
+        query_record.pop(modified_field, None)
+
+        query_write = """
+        WITH %(write)s
+        SELECT id FROM revived;
+        """ % dict(write=_CREATE_OVER_TOMBSTONE)
+        placeholders = dict(object_id=record[id_field],
+                            parent_id=parent_id,
+                            collection_id=collection_id,
+                            last_modified=record.get(modified_field),
+                            data=json.dumps(query_record))
+
+        perm_object_id = get_permission_object_id(record[id_field])
+        written = self._write_with_permissions(query_write, placeholders,
+                                               perm_object_id, permissions,
+                                               owner)
+        record[modified_field] = written['last_modified']
+        return record, _aces_to_permissions(written['aces'])
+
+    def update_with_permissions(self, collection_id, parent_id, object_id,
+                                record, permission_backend,
+                                permission_object_id, permissions, owner,
+                                id_field=DEFAULT_ID_FIELD,
+                                modified_field=DEFAULT_MODIFIED_FIELD,
+                                auth=None, if_match=None):
+        # Conditional writes must fail before the permissions are touched.
+        if if_match is not None or not self._shares_client(permission_backend):
+            return super(Storage, self).update_with_permissions(
+                collection_id, parent_id, object_id, record,
+                permission_backend, permission_object_id,
+                permissions, owner,
+                id_field=id_field, modified_field=modified_field, auth=auth,
+                if_match=if_match)
+
+        query_record = record.copy()
+        query_record.pop(id_field, None)
+        query_record.pop(modified_field, None)
+
+        # Update the record or its tombstone, or create it if it does not exist.
+        query_write = """
+        WITH updated AS (
+            UPDATE records SET data=(:data)::JSONB,
+                               last_modified=from_epoch(:last_modified),
+                               deleted=FALSE
+             WHERE id = :object_id
+               AND parent_id = :parent_id
+               AND collection_id = :collection_id
+            RETURNING id
+        )
+        INSERT INTO records (id, parent_id, collection_id, data, last_modified)
+        SELECT :object_id, :parent_id,
+               :collection_id, (:data)::JSONB,
+               from_epoch(:last_modified)
+         WHERE NOT EXISTS (SELECT id FROM updated);
+        """
+        placeholders = dict(object_id=object_id,
+                            parent_id=parent_id,
+                            collection_id=collection_id,
+                            last_modified=record.get(modified_field),
+                            data=json.dumps(query_record))
+
+        written = self._write_with_permissions(query_write, placeholders,
+                                               permission_object_id,
+                                               permissions, owner)
+        record = record.copy()
+        record[id_field] = object_id
+        record[modified_field] = written['last_modified']
+        return record, _aces_to_permissions(written['aces'])
+
+    def _write_with_permissions(self, query_write, placeholders,
+                                perm_object_id, permissions, owner):
+        """Send the record write, the replacement of its ACEs and the
+        read of the resulting record timestamp and ACEs as a single batch of
+        statements (i.e. one round trip to the database).
+        """
+        placeholders = placeholders.copy()
+        placeholders['perm_object_id'] = perm_object_id
+        placeholders['owner'] = owner
+
+        new_aces = ["('write', :owner)"]
+        specified_perms = []
+        for i, (perm, principals) in enumerate(permissions.items()):
+            placeholders['perm_%s' % i] = perm
+            specified_perms.append(':perm_%s' % i)
+            for principal in set(principals):
+                j = len(new_aces)
+                placeholders['principal_%s' % j] = principal
+                new_aces.append('(:perm_%s, :principal_%s)' % (i, j))
+
+        query_delete_aces = ''
+        if specified_perms:
+            query_delete_aces = """
+            DELETE FROM access_control_entries
+             WHERE object_id = :perm_object_id
+               AND permission IN (%s);
+            """ % ','.join(specified_perms)
+
+        query_insert_aces = """
+        WITH new_aces AS (
+          SELECT DISTINCT column1 AS permission, column2 AS principal
+            FROM (VALUES %(new_aces)s) AS specified
+        )
+        INSERT INTO access_control_entries (object_id, permission, principal)
+        SELECT :perm_object_id, permission, principal
+          FROM new_aces
+         WHERE NOT EXISTS (
+            SELECT principal
+              FROM access_control_entries AS existing
+             WHERE existing.object_id = :perm_object_id
+               AND existing.permission = new_aces.permission
+               AND existing.principal = new_aces.principal
+        );
+        """ % dict(new_aces=','.join(new_aces))
+
+        query_read = """
+        SELECT as_epoch(last_modified) AS last_modified,
+               %(aces)s AS aces
+          FROM records
+         WHERE id = :object_id
+           AND parent_id = :parent_id
+           AND collection_id = :collection_id;
+        """ % dict(aces=_OBJECT_ACES_SUBQUERY)
+
+        query = ''.join([query_write, query_delete_aces,
+                         query_insert_aces, query_read])
+        with self.client.connect() as conn:
+            result = conn.execute(query, placeholders)
+            written = result.fetchone()
+        self._timestamp_bumped(placeholders['collection_id'],
+                               placeholders['parent_id'])
+        return written
+
     def delete(self, collection_id, parent_id, object_id,
                id_field=DEFAULT_ID_FIELD, with_deleted=True,
                modified_field=DEFAULT_MODIFIED_FIELD,
                deleted_field=DEFAULT_DELETED_FIELD,
                auth=None, last_modified=None):
         if with_deleted:
+            # Turn the record into a tombstone.
             query = """
-            WITH deleted_record AS (
-                DELETE
-                FROM records
+                UPDATE records
+                   SET deleted = TRUE,
+                       data = (:tombstone)::JSONB,
+                       last_modified = from_epoch(:last_modified)
                 WHERE id = :object_id
                   AND parent_id = :parent_id
                   AND collection_id = :collection_id
-                RETURNING id
-            )
-            INSERT INTO deleted (id, parent_id, collection_id, last_modified)
-            SELECT id, :parent_id, :collection_id, from_epoch(:last_modified)
-              FROM deleted_record
-            RETURNING as_epoch(last_modified) AS last_modified;
+                  AND deleted IS NOT TRUE
+                RETURNING as_epoch(last_modified) AS last_modified;
             """
         else:
             query = """
@@ -371,18 +879,21 @@ class Storage(StorageBase):
                 WHERE id = :object_id
                   AND parent_id = :parent_id
                   AND collection_id = :collection_id
+                  AND deleted IS NOT TRUE
                 RETURNING as_epoch(last_modified) AS last_modified;
             """
         placeholders = dict(object_id=object_id,
                             parent_id=parent_id,
                             collection_id=collection_id,
-                            last_modified=last_modified)
+                            last_modified=last_modified,
+                            tombstone=json.dumps({deleted_field: True}))
 
         with self.client.connect() as conn:
             result = conn.execute(query, placeholders)
             if result.rowcount == 0:
                 raise exceptions.RecordNotFoundError(object_id)
             inserted = result.fetchone()
+        self._timestamp_bumped(collection_id, parent_id)
 
         record = {}
         record[modified_field] = inserted['last_modified']
@@ -397,43 +908,167 @@ class Storage(StorageBase):
                    modified_field=DEFAULT_MODIFIED_FIELD,
                    deleted_field=DEFAULT_DELETED_FIELD,
                    auth=None):
+        # The parent filter is repeated on the outer statement, so that
+        # partitions of the records table can be pruned.
         if with_deleted:
+            # Turn the records into tombstones.
             query = """
-            WITH deleted_records AS (
-                DELETE
-                FROM records
-                WHERE id IN (SELECT id
-                             FROM records
-                             WHERE %(parent_id_filter)s
-                                   %(collection_id_filter)s
-                                   %(conditions_filter)s
-                                   %(pagination_rules)s
-                             %(sorting)s
-                             %(pagination_limit)s)
-                RETURNING id, parent_id, collection_id
-            )
-            INSERT INTO deleted (id, parent_id, collection_id)
-            SELECT id, parent_id, collection_id
-              FROM deleted_records
+            UPDATE records
+               SET deleted = TRUE,
+                   data = (:tombstone)::JSONB,
+                   last_modified = NULL
+            WHERE %(parent_id_filter)s
+              AND (id, parent_id, collection_id) IN (
+                SELECT id, parent_id, collection_id
+                  FROM records
+                 WHERE %(parent_id_filter)s
+                       %(collection_id_filter)s
+                       AND deleted IS NOT TRUE
+                       %(conditions_filter)s
+                       %(pagination_rules)s
+                 %(sorting)s
+                 %(pagination_limit)s)
             RETURNING id, as_epoch(last_modified) AS last_modified;
             """
         else:
             query = """
             DELETE
             FROM records
-            WHERE id IN (SELECT id
-                         FROM records
-                         WHERE %(parent_id_filter)s
-                               %(collection_id_filter)s
-                               %(conditions_filter)s
-                               %(pagination_rules)s
-                         %(sorting)s
-                         %(pagination_limit)s)
+            WHERE %(parent_id_filter)s
+              AND (id, parent_id, collection_id) IN (
+                SELECT id, parent_id, collection_id
+                  FROM records
+                 WHERE %(parent_id_filter)s
+                       %(collection_id_filter)s
+                       AND deleted IS NOT TRUE
+                       %(conditions_filter)s
+                       %(pagination_rules)s
+                 %(sorting)s
+                 %(pagination_limit)s)
             RETURNING id, as_epoch(last_modified) AS last_modified;
             """
 
         id_field = id_field or self.id_field
         modified_field = modified_field or self.modified_field
+        safeholders, placeholders = self._format_selection(
+            collection_id, parent_id, filters, sorting, pagination_rules,
+            limit, id_field, modified_field)
+        placeholders['tombstone'] = json.dumps({deleted_field: True})
+
+        with self.client.connect() as conn:
+            result = conn.execute(query % safeholders, placeholders)
+            deleted = result.fetchmany(self._max_fetch_size)
+        if deleted:
+            self._timestamp_bumped(collection_id, parent_id)
+
+        records = []
+        for result in deleted:
+            record = {}
+            record[id_field] = result['id']
+            record[modified_field] = result['last_modified']
+            record[deleted_field] = True
+            records.append(record)
+
+        return records
+
+    def delete_all_with_old(self, collection_id, parent_id, filters=None,
+                            sorting=None, pagination_rules=None, limit=None,
+                            id_field=DEFAULT_ID_FIELD, with_deleted=True,
+                            modified_field=DEFAULT_MODIFIED_FIELD,
+                            deleted_field=DEFAULT_DELETED_FIELD,
+                            auth=None):
+        """Count, select and delete the records, and turn them into
+        tombstones with a single statement, returning the deleted rows.
+        """
+        query = """
+        WITH total_filtered AS (
+            SELECT COUNT(id) AS count
+              FROM records
+             WHERE %(parent_id_filter)s
+                   %(collection_id_filter)s
+                   AND deleted IS NOT TRUE
+                   %(conditions_filter)s
+        ),
+        to_delete AS (
+            SELECT id, parent_id, collection_id, data, last_modified,
+                   ROW_NUMBER() OVER (%(sorting)s) AS rank
+              FROM records
+             WHERE %(parent_id_filter)s
+                   %(collection_id_filter)s
+                   AND deleted IS NOT TRUE
+                   %(conditions_filter)s
+                   %(pagination_rules)s
+             %(sorting)s
+             %(pagination_limit)s
+        ),
+        deleted_records AS (
+            %(delete)s
+             WHERE records.%(parent_id_filter)s
+               AND records.id = to_delete.id
+               AND records.parent_id = to_delete.parent_id
+               AND records.collection_id = to_delete.collection_id
+            RETURNING records.id, to_delete.data,
+                      to_delete.last_modified AS old_last_modified,
+                      records.last_modified, to_delete.rank
+        )
+        SELECT total_filtered.count AS count_total,
+               d.id, d.data,
+               as_epoch(d.old_last_modified) AS old_last_modified,
+               as_epoch(d.last_modified) AS last_modified
+          FROM total_filtered
+          LEFT JOIN deleted_records AS d ON TRUE
+         ORDER BY d.rank;
+        """
+        id_field = id_field or self.id_field
+        modified_field = modified_field or self.modified_field
+        safeholders, placeholders = self._format_selection(
+            collection_id, parent_id, filters, sorting, pagination_rules,
+            limit, id_field, modified_field)
+
+        if with_deleted:
+            safeholders['delete'] = """UPDATE records
+               SET deleted = TRUE,
+                   data = (:tombstone)::JSONB,
+                   last_modified = NULL
+              FROM to_delete"""
+            placeholders['tombstone'] = json.dumps({deleted_field: True})
+        else:
+            safeholders['delete'] = """DELETE
+              FROM records
+             USING to_delete"""
+
+        with self.client.connect() as conn:
+            result = conn.execute(query % safeholders, placeholders)
+            rows = result.fetchmany(self._max_fetch_size)
+
+        count_total = rows[0]['count_total'] if rows else 0
+        deleted = []
+        old = []
+        for row in rows:
+            if row['id'] is None:
+                continue
+            record = row['data']
+            record[id_field] = row['id']
+            record[modified_field] = row['old_last_modified']
+            old.append(record)
+            tombstone = {}
+            tombstone[id_field] = row['id']
+            tombstone[modified_field] = row['last_modified']
+            tombstone[deleted_field] = True
+            deleted.append(tombstone)
+        if deleted:
+            self._timestamp_bumped(collection_id, parent_id)
+
+        return deleted, old, count_total
+
+    def _format_selection(self, collection_id, parent_id, filters, sorting,
+                          pagination_rules, limit, id_field, modified_field):
+        """Format the parts of the query that select records to delete.
+
+        :returns: A dict of safe SQL strings, and a dict mapping
+            placeholders to actual values.
+        :rtype: tuple
+        """
         placeholders = dict(parent_id=parent_id,
                             collection_id=collection_id)
         # Safe strings
@@ -473,31 +1108,36 @@ class Storage(StorageBase):
             # We validate the limit value in the resource class as integer.
             safeholders['pagination_limit'] = 'LIMIT %s' % limit
 
-        with self.client.connect() as conn:
-            result = conn.execute(query % safeholders, placeholders)
-            deleted = result.fetchmany(self._max_fetch_size)
-
-        records = []
-        for result in deleted:
-            record = {}
-            record[id_field] = result['id']
-            record[modified_field] = result['last_modified']
-            record[deleted_field] = True
-            records.append(record)
-
-        return records
+        return safeholders, placeholders
 
     def purge_deleted(self, collection_id, parent_id, before=None,
+                      limit=None,
                       id_field=DEFAULT_ID_FIELD,
                       modified_field=DEFAULT_MODIFIED_FIELD,
                       auth=None):
-        query = """
-        DELETE
-        FROM deleted
-        WHERE %(parent_id_filter)s
-              %(collection_id_filter)s
-              %(conditions_filter)s;
-        """
+        if limit is None:
+            query = """
+            DELETE
+            FROM records
+            WHERE deleted
+              AND %(parent_id_filter)s
+                  %(collection_id_filter)s
+                  %(conditions_filter)s;
+            """
+        else:
+            query = """
+            DELETE
+            FROM records
+            WHERE %(parent_id_filter)s
+              AND (id, parent_id, collection_id) IN (
+                SELECT id, parent_id, collection_id
+                  FROM records
+                 WHERE deleted
+                   AND %(parent_id_filter)s
+                       %(collection_id_filter)s
+                       %(conditions_filter)s
+                 LIMIT :limit);
+            """
         id_field = id_field or self.id_field
         modified_field = modified_field or self.modified_field
         placeholders = dict(parent_id=parent_id,
@@ -521,6 +1161,9 @@ class Storage(StorageBase):
                 'AND as_epoch(last_modified) < :before')
             placeholders['before'] = before
 
+        if limit is not None:
+            placeholders['limit'] = limit
+
         with self.client.connect() as conn:
             result = conn.execute(query % safeholders, placeholders)
 
@@ -528,7 +1171,7 @@ class Storage(StorageBase):
 
     def get_all(self, collection_id, parent_id, filters=None, sorting=None,
                 pagination_rules=None, limit=None, include_deleted=False,
-                id_field=DEFAULT_ID_FIELD,
+                fields=None, id_field=DEFAULT_ID_FIELD,
                 modified_field=DEFAULT_MODIFIED_FIELD,
                 deleted_field=DEFAULT_DELETED_FIELD,
                 auth=None):
@@ -538,54 +1181,33 @@ class Storage(StorageBase):
               FROM records
              WHERE %(parent_id_filter)s
                AND collection_id = :collection_id
+               AND deleted IS NOT TRUE
                %(conditions_filter)s
         ),
-        collection_filtered AS (
+        paginated_records AS (
             SELECT id, last_modified, data
               FROM records
              WHERE %(parent_id_filter)s
                AND collection_id = :collection_id
+               %(deleted_filter)s
                %(conditions_filter)s
-             LIMIT %(max_fetch_size)s
-        ),
-        fake_deleted AS (
-            SELECT (:deleted_field)::JSONB AS data
-        ),
-        filtered_deleted AS (
-            SELECT id, last_modified, fake_deleted.data AS data
-              FROM deleted, fake_deleted
-             WHERE %(parent_id_filter)s
-               AND collection_id = :collection_id
-               %(conditions_filter)s
-               %(deleted_limit)s
-        ),
-        all_records AS (
-            SELECT * FROM filtered_deleted
-             UNION ALL
-            SELECT * FROM collection_filtered
-        ),
-        paginated_records AS (
-            SELECT DISTINCT id
-              FROM all_records
-              %(pagination_rules)s
+               %(pagination_rules)s
+             %(sorting)s
+             LIMIT %(pagination_limit)s
         )
         SELECT total_filtered.count AS count_total,
-               a.id, as_epoch(a.last_modified) AS last_modified, a.data
-          FROM paginated_records AS p JOIN all_records AS a ON (a.id = p.id),
-               total_filtered
-          %(sorting)s
-          %(pagination_limit)s;
+               a.id, as_epoch(a.last_modified) AS last_modified,
+               %(data)s AS data
+          FROM paginated_records AS a, total_filtered
+          %(sorting)s;
         """
-        deleted_field = json.dumps(dict([(deleted_field, True)]))
-
         # Unsafe strings escaped by PostgreSQL
         placeholders = dict(parent_id=parent_id,
-                            collection_id=collection_id,
-                            deleted_field=deleted_field)
+                            collection_id=collection_id)
 
         # Safe strings
         safeholders = defaultdict(six.text_type)
-        safeholders['max_fetch_size'] = self._max_fetch_size
+        safeholders['pagination_limit'] = limit or self._max_fetch_size
 
         # Handle parent_id as a regex only if it contains *
         if '*' in parent_id:
@@ -602,7 +1224,8 @@ class Storage(StorageBase):
             placeholders.update(**holders)
 
         if not include_deleted:
-            safeholders['deleted_limit'] = 'LIMIT 0'
+            # Tombstones are left out of the partial index of live records.
+            safeholders['deleted_filter'] = 'AND deleted IS NOT TRUE'
 
         if sorting:
             sql, holders = self._format_sorting(sorting, id_field,
@@ -613,12 +1236,22 @@ class Storage(StorageBase):
         if pagination_rules:
             sql, holders = self._format_pagination(pagination_rules, id_field,
                                                    modified_field)
-            safeholders['pagination_rules'] = 'WHERE %s' % sql
+            safeholders['pagination_rules'] = 'AND (%s)' % sql
             placeholders.update(**holders)
 
-        if limit:
-            # We validate the limit value in the resource class as integer.
-            safeholders['pagination_limit'] = 'LIMIT %s' % limit
+        if fields:
+            # Only the projected root attributes leave the database.
+            # Missing attributes are omitted, unlike with jsonb_build_object().
+            safeholders['data'] = """
+            COALESCE((SELECT jsonb_object_agg(key, value)
+                        FROM jsonb_each(a.data)
+                       WHERE key = ANY(:projected_fields)),
+                     '{}'::JSONB)"""
+            roots = set([f.split('.', 1)[0] for f in fields])
+            roots.add(deleted_field)
+            placeholders['projected_fields'] = sorted(roots)
+        else:
+            safeholders['data'] = 'a.data'
 
         with self.client.connect(readonly=True) as conn:
             result = conn.execute(query % safeholders, placeholders)
@@ -786,8 +1419,62 @@ class Storage(StorageBase):
         return safe_sql, holders
 
 
-def load_from_config(config):
+_CREATE_OVER_TOMBSTONE = """
+revived AS (
+    UPDATE records SET data=(:data)::JSONB,
+                       last_modified=from_epoch(:last_modified),
+                       deleted=FALSE
+     WHERE id = :object_id
+       AND parent_id = :parent_id
+       AND collection_id = :collection_id
+       AND deleted
+    RETURNING id, last_modified
+),
+inserted AS (
+    INSERT INTO records (id, parent_id, collection_id, data, last_modified)
+    SELECT :object_id, :parent_id,
+           :collection_id, (:data)::JSONB,
+           from_epoch(:last_modified)
+     WHERE NOT EXISTS (
+        SELECT id
+          FROM records
+         WHERE id = :object_id
+           AND parent_id = :parent_id
+           AND collection_id = :collection_id
+    )
+    RETURNING id, last_modified
+)
+"""
+"""Common table expressions creating the record, unless it exists. Its
+tombstone, if any, is overwritten."""
+
+
+_OBJECT_ACES_SUBQUERY = """
+(SELECT COALESCE(json_agg(json_build_array(permission, principal)), '[]')
+   FROM access_control_entries
+  WHERE object_id = :perm_object_id)
+"""
+"""Subquery aggregating the ACEs of the ``perm_object_id`` placeholder."""
+
+
+def _aces_to_permissions(aces):
+    """Convert the ``(permission, principal)`` list obtained with
+    ``_OBJECT_ACES_SUBQUERY`` to a mapping of principals sets by permission.
+    """
+    permissions = {}
+    for permission, principal in aces:
+        permissions.setdefault(permission, set()).add(principal)
+    return permissions
+
+
+def load_from_config(config, url=None):
     settings = config.get_settings()
     max_fetch_size = int(settings['storage_max_fetch_size'])
-    client = create_from_config(config, prefix='storage_')
-    return Storage(client=client, max_fetch_size=max_fetch_size)
+    client = create_from_config(config, prefix='storage_', url=url)
+    timestamps_cache = None
+    if asbool(settings.get('storage_timestamps_cache')):
+        timestamps_cache = TimestampsCache(client)
+    partitions = settings.get('storage_partitions')
+    partitions = int(partitions) if partitions else None
+    return Storage(client=client, max_fetch_size=max_fetch_size,
+                   timestamps_cache=timestamps_cache, partitions=partitions)
@@ -9,8 +9,10 @@ import transaction as zope_transaction
 
 
 class PostgreSQLClient(object):
-    def __init__(self, session_factory, commit_manually=True, invalidate=None):
+    def __init__(self, session_factory, commit_manually=True, invalidate=None,
+                 engine=None):
         self.session_factory = session_factory
+        self.engine = engine
         self.commit_manually = commit_manually
         self.invalidate = invalidate or (lambda session: None)
 
@@ -62,8 +64,9 @@ class PostgreSQLClient(object):
 _CLIENTS = defaultdict(dict)
 
 
-def create_from_config(config, prefix=''):
+def create_from_config(config, prefix='', url=None):
     """Create a PostgreSQLClient client using settings in the provided config.
+    If specified, `url` overrides the one from settings.
     """
     if sqlalchemy is None:
         message = ("PostgreSQL SQLAlchemy dependency missing. "
@@ -78,9 +81,13 @@ def create_from_config(config, prefix=''):
     settings.pop(prefix + 'backend', None)
     settings.pop(prefix + 'max_fetch_size', None)
     settings.pop(prefix + 'prefix', None)
+    settings.pop(prefix + 'timestamps_cache', None)
+    settings.pop(prefix + 'partitions', None)
+    settings.pop(prefix + 'shards', None)
+    settings.pop(prefix + 'shard_map', None)
     transaction_per_request = settings.pop('transaction_per_request', False)
 
-    url = settings[prefix + 'url']
+    url = url or settings[prefix + 'url']
     existing_client = _CLIENTS[transaction_per_request].get(url)
     if existing_client:
         msg = ("Reuse existing PostgreSQL connection. "
@@ -104,6 +111,7 @@ def create_from_config(config, prefix=''):
 
     # Store one client per URI.
     commit_manually = (not transaction_per_request)
-    client = PostgreSQLClient(session_factory, commit_manually, invalidate)
+    client = PostgreSQLClient(session_factory, commit_manually, invalidate,
+                              engine=engine)
     _CLIENTS[transaction_per_request][url] = client
     return client
@@ -0,0 +1,24 @@
+--
+-- Read-only variant, that returns NULL if the collection timestamp was never
+-- written (i.e. collection was never hit).
+--
+CREATE OR REPLACE FUNCTION collection_timestamp_readonly(uid VARCHAR, resource VARCHAR)
+RETURNS TIMESTAMP AS $$
+DECLARE
+    ts TIMESTAMP;
+BEGIN
+    ts := NULL;
+
+    SELECT last_modified INTO ts
+      FROM timestamps
+     WHERE parent_id = uid
+       AND collection_id = resource;
+
+    RETURN ts;
+END;
+$$ LANGUAGE plpgsql
+STABLE;
+
+
+-- Bump storage schema version.
+INSERT INTO metadata (name, value) VALUES ('storage_schema_version', '15');
@@ -0,0 +1,167 @@
+--
+-- Tombstones are now stored in the records table, flagged as deleted.
+--
+-- Adding a nullable column without default does not rewrite the table. The
+-- partial index of live records is built concurrently after this migration
+-- (it cannot be built within a transaction).
+--
+-- The deleted table is neither locked nor dropped, so that the migration does
+-- not block writes. Tombstones written there by previous versions are copied
+-- to the records table by the trigger. The table will be dropped by a later
+-- version, once the remaining tombstones were copied.
+--
+-- This migration is NOT compatible with previous versions running side by
+-- side: they read the records table without filtering the deleted column,
+-- and would serve the copied tombstones as live records. Processes running
+-- a previous version must be stopped before migrating, or restarted right
+-- after it.
+--
+DO $$
+BEGIN
+
+  IF NOT EXISTS (
+    SELECT 1 FROM information_schema.columns
+       WHERE table_name = 'records'
+       AND column_name = 'deleted'
+  ) THEN
+
+  ALTER TABLE records ADD COLUMN deleted BOOLEAN;
+  ALTER TABLE records ALTER COLUMN deleted SET DEFAULT FALSE;
+
+  END IF;
+END$$;
+
+CREATE OR REPLACE FUNCTION bump_timestamp()
+RETURNS trigger AS $$
+DECLARE
+    previous TIMESTAMP;
+    current TIMESTAMP;
+
+BEGIN
+    --
+    -- Tombstones written in the deleted table by versions prior to 17 are
+    -- copied to the records table, where they get their timestamp.
+    --
+    IF TG_TABLE_NAME = 'deleted' THEN
+        INSERT INTO records (id, parent_id, collection_id, data, deleted)
+        SELECT NEW.id, NEW.parent_id, NEW.collection_id,
+               '{"deleted": true}'::JSONB, TRUE
+         WHERE NOT EXISTS (
+           SELECT 1
+             FROM records
+            WHERE id = NEW.id
+              AND parent_id = NEW.parent_id
+              AND collection_id = NEW.collection_id
+         )
+        RETURNING last_modified INTO current;
+        NEW.last_modified := COALESCE(current, clock_timestamp());
+        RETURN NEW;
+    END IF;
+
+    --
+    -- Tombstones inserted with their timestamp (i.e. copied by a migration)
+    -- keep it, and leave the collection timestamp untouched.
+    --
+    IF TG_OP = 'INSERT' AND NEW.deleted AND NEW.last_modified IS NOT NULL THEN
+        RETURN NEW;
+    END IF;
+
+    previous := NULL;
+    SELECT last_modified INTO previous
+      FROM timestamps
+     WHERE parent_id = NEW.parent_id
+       AND collection_id = NEW.collection_id;
+
+    --
+    -- This bumps the current timestamp to 1 msec in the future if the previous
+    -- timestamp is equal to the current one (or higher if was bumped already).
+    -- They are compared in milliseconds, as exposed in the HTTP API.
+    --
+    -- If a bunch of requests from the same user on the same collection
+    -- arrive in the same millisecond, the unicity constraint can raise
+    -- an error (operation is cancelled).
+    -- See https://github.com/mozilla-services/cliquet/issues/25
+    --
+    current := clock_timestamp();
+    IF previous IS NOT NULL AND as_epoch(previous) >= as_epoch(current) THEN
+        current := previous + INTERVAL '1 milliseconds';
+    END IF;
+
+    IF NEW.last_modified IS NULL OR
+       (previous IS NOT NULL AND as_epoch(NEW.last_modified) = as_epoch(previous)) THEN
+        -- If record does not carry last-modified, or if the one specified
+        -- is equal to previous, assign it to current (i.e. bump it).
+        NEW.last_modified := current;
+    ELSE
+        -- Use record last-modified as collection timestamp.
+        IF previous IS NULL OR NEW.last_modified > previous THEN
+            current := NEW.last_modified;
+        END IF;
+    END IF;
+
+    --
+    -- Upsert current collection timestamp.
+    --
+    WITH upsert AS (
+        UPDATE timestamps SET last_modified = current
+         WHERE parent_id = NEW.parent_id AND collection_id = NEW.collection_id
+        RETURNING *
+    )
+    INSERT INTO timestamps (parent_id, collection_id, last_modified)
+    SELECT NEW.parent_id, NEW.collection_id, current
+    WHERE NOT EXISTS (SELECT * FROM upsert);
+
+    --
+    -- Notify listeners that cache collection timestamps (delivered on commit,
+    -- and only once per transaction for the same collection).
+    --
+    PERFORM pg_notify('kinto_timestamps',
+                      json_build_array(NEW.parent_id, NEW.collection_id)::TEXT);
+
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+
+--
+-- Copy the tombstones along with their timestamps. Those which collide with
+-- the timestamp of a record (in milliseconds, i.e. rounded by as_epoch())
+-- get a new one from the trigger.
+--
+DO $$
+BEGIN
+
+  IF EXISTS (
+    SELECT 1 FROM pg_tables
+       WHERE tablename = 'deleted'
+  ) THEN
+
+  INSERT INTO records (id, parent_id, collection_id, last_modified,
+                       data, deleted)
+  SELECT d.id, d.parent_id, d.collection_id,
+         CASE WHEN EXISTS (
+           SELECT 1
+             FROM records AS r
+            WHERE r.parent_id = d.parent_id
+              AND r.collection_id = d.collection_id
+              AND r.last_modified >= from_epoch(as_epoch(d.last_modified))
+                                     - INTERVAL '0.5 milliseconds'
+              AND r.last_modified < from_epoch(as_epoch(d.last_modified))
+                                    + INTERVAL '0.5 milliseconds'
+         ) THEN NULL ELSE d.last_modified END,
+         '{"deleted": true}'::JSONB, TRUE
+    FROM deleted AS d
+   WHERE NOT EXISTS (
+     SELECT 1
+       FROM records AS r
+      WHERE r.id = d.id
+        AND r.parent_id = d.parent_id
+        AND r.collection_id = d.collection_id
+   );
+
+  END IF;
+END$$;
+
+
+-- Bump storage schema version.
+INSERT INTO metadata (name, value) VALUES ('storage_schema_version', '17');
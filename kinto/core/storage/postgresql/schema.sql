@@ -35,6 +35,10 @@ CREATE TABLE IF NOT EXISTS records (
     -- JSONB, 2x faster than JSON.
     data JSONB NOT NULL DEFAULT '{}'::JSONB,
 
+    -- Tombstones are flagged, and only keep the deleted field in data.
+    -- Nullable to match the migrated schemas: use IS NOT TRUE for live rows.
+    deleted BOOLEAN DEFAULT FALSE,
+
     PRIMARY KEY (id, parent_id, collection_id)
 );
 --
@@ -86,43 +90,20 @@ BEGIN
 END$$;
 
 --
--- Deleted records, without data.
+-- Live records only, for listings without tombstones.
 --
-CREATE TABLE IF NOT EXISTS deleted (
-    id TEXT NOT NULL,
-    parent_id TEXT NOT NULL,
-    collection_id TEXT NOT NULL,
-    last_modified TIMESTAMP NOT NULL,
-
-    PRIMARY KEY (id, parent_id, collection_id)
-);
-
-DO $$
-BEGIN
-
-  IF NOT EXISTS (
-    SELECT 1 FROM pg_indexes
-       WHERE indexname = 'idx_deleted_parent_id_collection_id_last_modified'
-       AND tablename = 'deleted'
-  ) THEN
-
-  CREATE UNIQUE INDEX idx_deleted_parent_id_collection_id_last_modified
-    ON deleted(parent_id, collection_id, last_modified DESC);
-
-  END IF;
-END$$;
-
 DO $$
 BEGIN
 
   IF NOT EXISTS (
     SELECT 1 FROM pg_indexes
-       WHERE indexname = 'idx_deleted_last_modified_epoch'
-       AND tablename = 'deleted'
+       WHERE indexname = 'idx_records_live_parent_id_collection_id_last_modified'
+       AND tablename = 'records'
   ) THEN
 
-  CREATE INDEX idx_deleted_last_modified_epoch
-    ON deleted(as_epoch(last_modified));
+  CREATE INDEX idx_records_live_parent_id_collection_id_last_modified
+    ON records(parent_id, collection_id, last_modified DESC)
+    WHERE deleted IS NOT TRUE;
 
   END IF;
 END$$;
@@ -161,11 +142,31 @@ BEGIN
 END;
 $$ LANGUAGE plpgsql;
 
+--
+-- Read-only variant, that returns NULL if the collection timestamp was never
+-- written (i.e. collection was never hit).
+--
+CREATE OR REPLACE FUNCTION collection_timestamp_readonly(uid VARCHAR, resource VARCHAR)
+RETURNS TIMESTAMP AS $$
+DECLARE
+    ts TIMESTAMP;
+BEGIN
+    ts := NULL;
+
+    SELECT last_modified INTO ts
+      FROM timestamps
+     WHERE parent_id = uid
+       AND collection_id = resource;
+
+    RETURN ts;
+END;
+$$ LANGUAGE plpgsql
+STABLE;
+
 --
 -- Triggers to set last_modified on INSERT/UPDATE
 --
 DROP TRIGGER IF EXISTS tgr_records_last_modified ON records;
-DROP TRIGGER IF EXISTS tgr_deleted_last_modified ON deleted;
 
 CREATE OR REPLACE FUNCTION bump_timestamp()
 RETURNS trigger AS $$
@@ -174,6 +175,34 @@ DECLARE
     current TIMESTAMP;
 
 BEGIN
+    --
+    -- Tombstones written in the deleted table by versions prior to 17 are
+    -- copied to the records table, where they get their timestamp.
+    --
+    IF TG_TABLE_NAME = 'deleted' THEN
+        INSERT INTO records (id, parent_id, collection_id, data, deleted)
+        SELECT NEW.id, NEW.parent_id, NEW.collection_id,
+               '{"deleted": true}'::JSONB, TRUE
+         WHERE NOT EXISTS (
+           SELECT 1
+             FROM records
+            WHERE id = NEW.id
+              AND parent_id = NEW.parent_id
+              AND collection_id = NEW.collection_id
+         )
+        RETURNING last_modified INTO current;
+        NEW.last_modified := COALESCE(current, clock_timestamp());
+        RETURN NEW;
+    END IF;
+
+    --
+    -- Tombstones inserted with their timestamp (i.e. copied by a migration)
+    -- keep it, and leave the collection timestamp untouched.
+    --
+    IF TG_OP = 'INSERT' AND NEW.deleted AND NEW.last_modified IS NOT NULL THEN
+        RETURN NEW;
+    END IF;
+
     previous := NULL;
     SELECT last_modified INTO previous
       FROM timestamps
@@ -183,6 +212,7 @@ BEGIN
     --
     -- This bumps the current timestamp to 1 msec in the future if the previous
     -- timestamp is equal to the current one (or higher if was bumped already).
+    -- They are compared in milliseconds, as exposed in the HTTP API.
     --
     -- If a bunch of requests from the same user on the same collection
     -- arrive in the same millisecond, the unicity constraint can raise
@@ -190,7 +220,7 @@ BEGIN
     -- See https://github.com/mozilla-services/cliquet/issues/25
     --
     current := clock_timestamp();
-    IF previous IS NOT NULL AND previous >= current THEN
+    IF previous IS NOT NULL AND as_epoch(previous) >= as_epoch(current) THEN
         current := previous + INTERVAL '1 milliseconds';
     END IF;
 
@@ -218,6 +248,13 @@ BEGIN
     SELECT NEW.parent_id, NEW.collection_id, current
     WHERE NOT EXISTS (SELECT * FROM upsert);
 
+    --
+    -- Notify listeners that cache collection timestamps (delivered on commit,
+    -- and only once per transaction for the same collection).
+    --
+    PERFORM pg_notify('kinto_timestamps',
+                      json_build_array(NEW.parent_id, NEW.collection_id)::TEXT);
+
     RETURN NEW;
 END;
 $$ LANGUAGE plpgsql;
@@ -226,10 +263,6 @@ CREATE TRIGGER tgr_records_last_modified
 BEFORE INSERT OR UPDATE OF data ON records
 FOR EACH ROW EXECUTE PROCEDURE bump_timestamp();
 
-CREATE TRIGGER tgr_deleted_last_modified
-BEFORE INSERT ON deleted
-FOR EACH ROW EXECUTE PROCEDURE bump_timestamp();
-
 --
 -- Metadata table
 --
@@ -242,4 +275,4 @@ INSERT INTO metadata (name, value) VALUES ('created_at', NOW()::TEXT);
 
 -- Set storage schema version.
 -- Should match ``kinto.core.storage.postgresql.PostgreSQL.schema_version``
-INSERT INTO metadata (name, value) VALUES ('storage_schema_version', '14');
+INSERT INTO metadata (name, value) VALUES ('storage_schema_version', '17');
@@ -0,0 +1,172 @@
+import json
+import os
+import select
+import threading
+import time
+
+from kinto.core import logger
+
+import transaction as zope_transaction
+
+
+class TimestampsCache(object):
+    """In-process cache of collection timestamps.
+
+    Entries are invalidated from the notifications sent by the
+    ``bump_timestamp()`` trigger on the ``kinto_timestamps`` channel, which
+    are received by a dedicated connection in a background thread. This allows
+    several processes (or web heads) to share the same database and still
+    answer polling requests from memory.
+
+    When the listening connection is lost, the cache is cleared and bypassed
+    until it is established again.
+    """
+    channel = 'kinto_timestamps'
+
+    def __init__(self, client, max_size=10000, poll_timeout=5,
+                 connect_timeout=5, reconnect_delay=1):
+        self.client = client
+        self.max_size = max_size
+        self.poll_timeout = poll_timeout
+        self.connect_timeout = connect_timeout
+        self.reconnect_delay = reconnect_delay
+
+        self._entries = {}
+        # Incremented on every invalidation, to prevent storing values that
+        # were read before it happened.
+        self._generation = 0
+        self._lock = threading.Lock()
+        # Keys written in the current thread transaction.
+        self._pending = threading.local()
+
+        self._pid = None
+        self._listening = threading.Event()
+        self._stopped = threading.Event()
+
+    @property
+    def enabled(self):
+        self._ensure_listener()
+        return self._listening.is_set()
+
+    def get(self, collection_id, parent_id):
+        """Return the cached timestamp, or ``None`` if unknown."""
+        key = (parent_id, collection_id)
+        if not self.enabled or key in self._pending_keys():
+            return None
+        return self._entries.get(key)
+
+    def generation(self):
+        return self._generation
+
+    def set(self, collection_id, parent_id, timestamp, generation):
+        """Store the timestamp that was read from the database, unless an
+        invalidation occured since the specified ``generation``.
+        """
+        key = (parent_id, collection_id)
+        if not self.enabled or key in self._pending_keys():
+            return
+        with self._lock:
+            if generation != self._generation:
+                return
+            if len(self._entries) >= self.max_size:
+                self._entries.clear()
+            self._entries[key] = timestamp
+
+    def invalidate(self, collection_id, parent_id):
+        """Evict an entry (or every entry if the key contains wildcards)."""
+        with self._lock:
+            self._generation += 1
+            if collection_id is None or '*' in parent_id or '*' in collection_id:
+                self._entries.clear()
+            else:
+                self._entries.pop((parent_id, collection_id), None)
+
+    def written(self, collection_id, parent_id):
+        """Invalidate an entry after a write from the current thread.
+
+        When the transaction is managed per request, the new timestamp is not
+        visible to other processes before commit. Until then, the entry is
+        bypassed for the current transaction.
+        """
+        self.invalidate(collection_id, parent_id)
+        if self.client.commit_manually:
+            return
+        current = zope_transaction.get()
+        if getattr(self._pending, 'transaction', None) is not current:
+            self._pending.transaction = current
+            self._pending.keys = set()
+        self._pending.keys.add((parent_id, collection_id))
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _pending_keys(self):
+        if self.client.commit_manually:
+            return ()
+        current = zope_transaction.get()
+        if getattr(self._pending, 'transaction', None) is not current:
+            return ()
+        return self._pending.keys
+
+    def _ensure_listener(self):
+        # Threads do not survive forks: start one per process.
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            self._pid = pid
+            self._listening.clear()
+            thread = threading.Thread(target=self._listen,
+                                      name='kinto-timestamps-listener')
+            thread.daemon = True
+            thread.start()
+        # Give a chance to the first requests to be served from cache.
+        self._listening.wait(self.connect_timeout)
+
+    def _listen(self):
+        while not self._stopped.is_set():
+            connection = None
+            try:
+                connection = self._connect()
+                self._receive(connection)
+            except Exception as e:
+                logger.error('Timestamps notifications unavailable: %s' % e)
+                self._listening.clear()
+                self.clear()
+                time.sleep(self.reconnect_delay)
+            finally:
+                if connection is not None:
+                    connection.close()
+
+    def _connect(self):
+        # Open a connection outside the pool, since it is held forever.
+        engine = self.client.engine
+        cargs, cparams = engine.dialect.create_connect_args(engine.url)
+        connection = engine.dialect.connect(*cargs, **cparams)
+        connection.autocommit = True
+        cursor = connection.cursor()
+        cursor.execute('LISTEN %s;' % self.channel)
+        cursor.close()
+        return connection
+
+    def _receive(self, connection):
+        # Notifications received while not listening were missed.
+        self.clear()
+        self._listening.set()
+        while not self._stopped.is_set():
+            ready, _, _ = select.select([connection], [], [], self.poll_timeout)
+            if not ready:
+                continue
+            connection.poll()
+            while connection.notifies:
+                notify = connection.notifies.pop(0)
+                parent_id, collection_id = json.loads(notify.payload)
+                self.invalidate(collection_id, parent_id)
+        self._listening.clear()
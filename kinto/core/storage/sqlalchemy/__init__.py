@@ -3,18 +3,19 @@ import datetime
 from pyramid_sqlalchemy import BaseObject, Session, metadata
 from sqlalchemy import Column
 from sqlalchemy import DateTime, String, Integer
-from sqlalchemy import select, func, event
+from sqlalchemy import select, func, event, bindparam, tuple_
+from sqlalchemy.util import LRUCache
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import load_only
-from sqlalchemy.sql import label, and_
+from sqlalchemy.sql import label, and_, or_
 
-import transaction
+from zope.sqlalchemy import mark_changed
 
 from ... import logger
 from ...utils import classname, COMPARISON
-from ...storage import StorageBase
+from ...storage import StorageBase, Filter, Sort
 from ...storage import DEFAULT_ID_FIELD, DEFAULT_MODIFIED_FIELD, DEFAULT_DELETED_FIELD
-from ...storage.exceptions import RecordNotFoundError
+from ...storage.exceptions import RecordNotFoundError, ModifiedMeanwhileError
+from ...storage.memory import fields_extractor
 from ...storage.sqlalchemy.client import create_from_config
 from ...storage.sqlalchemy.generators import IntegerId
 from ...storage.sqlalchemy.exceptions import process_unicity_error
@@ -35,28 +36,88 @@ class Timestamps(BaseObject):
     last_modified = Column(DateTime, nullable=False)
 
 
+# Bump the timestamps of several collections at once, like the PostgreSQL
+# backend trigger: timestamps always increase, even within the same transaction.
+BUMP_TIMESTAMPS = """
+WITH keys (parent_id, collection_id) AS (
+    VALUES {values}
+), bumped AS (
+    UPDATE timestamps
+       SET last_modified = GREATEST(now() AT TIME ZONE 'UTC',
+                                    timestamps.last_modified + INTERVAL '1 millisecond')
+      FROM keys
+     WHERE timestamps.parent_id = keys.parent_id
+       AND timestamps.collection_id = keys.collection_id
+    RETURNING timestamps.parent_id, timestamps.collection_id
+)
+INSERT INTO timestamps (parent_id, collection_id, last_modified)
+SELECT keys.parent_id, keys.collection_id, now() AT TIME ZONE 'UTC'
+  FROM keys
+ WHERE NOT EXISTS (SELECT 1 FROM bumped
+                    WHERE bumped.parent_id = keys.parent_id
+                      AND bumped.collection_id = keys.collection_id)
+"""
+
+INIT_TIMESTAMP = """
+INSERT INTO timestamps (parent_id, collection_id, last_modified)
+SELECT :parent_id, :collection_id, now() AT TIME ZONE 'UTC'
+ WHERE NOT EXISTS (SELECT 1 FROM timestamps
+                    WHERE parent_id = :parent_id
+                      AND collection_id = :collection_id)
+"""
+
+
+def bump_timestamps(session, keys):
+    """Bump the timestamps of the specified ``(parent_id, collection_id)``."""
+    values = []
+    params = {}
+    for i, (parent_id, collection) in enumerate(sorted(keys)):
+        values.append('(:parent_id_{i}, :collection_id_{i})'.format(i=i))
+        params['parent_id_{}'.format(i)] = parent_id
+        params['collection_id_{}'.format(i)] = collection
+    if values:
+        session.execute(BUMP_TIMESTAMPS.format(values=', '.join(values)), params)
+
+
 @event.listens_for(Session, 'before_flush')
 def populate_timestamps_table(session, flush_context, instances):
-    for parent_id, collection in filter_instances(session.new):
-        timestamp = session.query(Timestamps).get([parent_id, collection])
-        if timestamp:
-            timestamp.last_modified = datetime.datetime.utcnow()
-        else:
-            timestamp = Timestamps(parent_id=parent_id, collection_id=collection,
-                                   last_modified=datetime.datetime.utcnow())
-        session.merge(timestamp)
+    changed = list(session.new) + list(session.dirty) + list(session.deleted)
+    bump_timestamps(session, filter_instances(changed))
 
 
 def filter_instances(instances):
     return set([(i.parent_id, classname(i)) for i in instances if getattr(i, 'is_timestamp_trackeable', False)])
 
 
+STATEMENTS_CACHE_SIZE = 500
+
+
 class Storage(StorageBase):
 
     id_generator = IntegerId()
 
+    max_fetch_size = None
+
+    purge_chunk_size = 1000
+
     def __init__(self, *args, **kwargs):
         self.__dict__.update(kwargs)
+        # Statements are built once per model and shape of query, with bound
+        # parameters for values, and compiled once per statement.
+        self._statements = LRUCache(STATEMENTS_CACHE_SIZE)
+        self._compiled_cache = LRUCache(STATEMENTS_CACHE_SIZE)
+
+    def _statement(self, key, build):
+        statement = self._statements.get(key)
+        if statement is None:
+            statement = self._statements[key] = build()
+        return statement
+
+    def _execute(self, statement, params):
+        # Like ORM queries, see the objects that are pending in the session.
+        Session.flush()
+        connection = Session.connection().execution_options(compiled_cache=self._compiled_cache)
+        return connection.execute(statement, params)
 
     def initialize_schema(self, dry_run=False):
         """Create every necessary objects (like tables or indices) in the
@@ -93,16 +154,16 @@ class Storage(StorageBase):
                                                                                    tb.c.collection_id == collection_id))
         last_modified,  = Session.execute(qry).fetchone()
         if last_modified is None:
-            last_modified = datetime.datetime.utcnow()
-            with transaction.manager:
-                Session.add(Timestamps(parent_id=parent_id, collection_id=collection_id,
-                                       last_modified=last_modified))
+            # Initialize the timestamp within the current transaction.
+            Session.execute(INIT_TIMESTAMP, dict(parent_id=parent_id, collection_id=collection_id))
+            mark_changed(Session())
+            last_modified,  = Session.execute(qry).fetchone()
         return last_modified.replace(tzinfo=datetime.timezone.utc).timestamp()
 
     def create(self, collection_id, parent_id, record, id_generator=None,
                unique_fields=None, id_field=DEFAULT_ID_FIELD,
                modified_field=DEFAULT_MODIFIED_FIELD,
-               auth=None):
+               auth=None, if_none_match=False):
         """Create the specified `object` in this `collection_id` for this `parent_id`.
         Assign the id to the object, using the attribute
         :attr:`cliquet.resource.Model.id_field`.
@@ -112,26 +173,41 @@ class Storage(StorageBase):
             This will update the collection timestamp.
 
         :raises: :exc:`cliquet.storage.exceptions.UnicityError`
+        :raises: :exc:`kinto.core.storage.exceptions.ModifiedMeanwhileError`
+            if `if_none_match` is ``True`` and the object already exists.
 
         :param str collection_id: the collection id.
         :param str parent_id: the collection parent.
 
         :param dict record: the object to create.
+        :param bool if_none_match: fail if the object already exists.
 
         :returns: the newly created object.
         :rtype: dict
         """
-        obj = self.collection.serialize(record)
+        if if_none_match and id_field in record:
+            existing = Session.query(self.collection).get(record[id_field])
+            if existing is not None and not existing.deleted:
+                raise ModifiedMeanwhileError(existing.to_record())
+        # Records are validated by the model schema on writes only.
+        obj = self.collection.deserialize(record)
         obj.parent_id = parent_id
+        generated = getattr(obj, id_field, None) is None
+        if generated:
+            # Ids are reserved by blocks: no need to flush to know it.
+            setattr(obj, id_field, int(self.collection.id_generator()))
         setattr(obj, modified_field, datetime.datetime.utcnow())
-        try:
-            Session.add(obj)
-            Session.flush()
-        except IntegrityError as e:
-            logger.exception('Object %s for collection %s raised %s', record, self.collection, e)
-            process_unicity_error(e, Session, self.collection, record)
+        Session.add(obj)
+        if unique_fields or not generated:
+            # Unicity errors, like an id given twice, are raised by the
+            # database when flushing.
+            try:
+                Session.flush()
+            except IntegrityError as e:
+                logger.exception('Object %s for collection %s raised %s' % (record, self.collection, e))
+                process_unicity_error(e, Session, self.collection, record)
         # TODO: store new timestamps date
-        return self.collection.deserialize(obj)
+        return obj.to_record()
 
     def get(self, collection_id, parent_id, object_id,
             id_field=DEFAULT_ID_FIELD,
@@ -150,20 +226,29 @@ class Storage(StorageBase):
         :returns: the object object.
         :rtype: dict
         """
-        obj = Session.query(self.collection).get(object_id)
+        model = self.collection
+        converter = model.__converter__
+
+        def build():
+            deleted = getattr(model, DEFAULT_DELETED_FIELD)
+            return select([deleted] + list(converter.columns))\
+                .where(getattr(model, id_field) == bindparam('object_id'))
+
+        statement = self._statement(('get', model, id_field), build)
+        row = self._execute(statement, dict(object_id=object_id)).fetchone()
         # TODO: verify permissions
-        if obj is None or obj.deleted:
+        if row is None or row[0]:
             raise RecordNotFoundError()
-        return obj.deserialize()
+        return converter.from_row(row[1:])
 
     def update(self, collection_id, parent_id, object_id, object,
                unique_fields=None, id_field=DEFAULT_ID_FIELD,
                modified_field=DEFAULT_MODIFIED_FIELD,
-               auth=None):
+               auth=None, if_match=None):
         """Overwrite the `object` with the specified `object_id`.
 
         If the specified id is not found, the object is created with the
-        specified id.
+        specified id, unless `if_match` is provided.
 
         .. note::
 
@@ -176,21 +261,31 @@ class Storage(StorageBase):
 
         :param str object_id: unique identifier of the object
         :param dict object: the object to update or create.
+        :param int if_match: optional expected timestamp of the object.
 
         :returns: the updated object.
         :rtype: dict
         """
-        obj = Session.query(self.collection).get(object_id)
+        query = Session.query(self.collection)
+        if if_match is not None:
+            # Lock the row until the end of the transaction.
+            query = query.with_for_update()
+        obj = query.get(object_id)
         # TODO: verify permissions
+        if if_match is not None:
+            if obj is None or obj.deleted:
+                raise RecordNotFoundError()
+            existing = obj.to_record()
+            if existing[modified_field] != if_match:
+                raise ModifiedMeanwhileError(existing)
         if obj is None:
-            obj = self.create(collection_id=collection_id, parent_id=parent_id,
-                              record=object, unique_fields=unique_fields,
-                              id_field=id_field, modified_field=modified_field,
-                              auth=None)
-        else:
-            for k, v in object.items():
-                setattr(obj, k, v)
-        return obj.deserialize()
+            return self.create(collection_id=collection_id, parent_id=parent_id,
+                               record=object, unique_fields=unique_fields,
+                               id_field=id_field, modified_field=modified_field,
+                               auth=None)
+        for k, v in object.items():
+            setattr(obj, k, v)
+        return obj.to_record()
 
     def delete(self, collection_id, parent_id, object_id,
                with_deleted=True, id_field=DEFAULT_ID_FIELD,
@@ -219,16 +314,24 @@ class Storage(StorageBase):
         :returns: the deleted object, with minimal set of attributes.
         :rtype: dict
         """
-        obj = Session.query(self.collection).get(object_id)
+        model = self.collection
+        tb = model.__table__
+
+        def build():
+            conditions = [tb.c[id_field] == bindparam('object_id')]
+            return self._build_delete(conditions, with_deleted=with_deleted, id_field=id_field,
+                                      modified_field=modified_field, deleted_field=deleted_field)
+
+        key = ('delete', model, with_deleted, id_field, modified_field, deleted_field)
+        statement = self._statement(key, build)
+        params = dict(object_id=object_id, parent=parent_id,
+                      collection=collection_id, now=datetime.datetime.utcnow())
+        row = self._execute(statement, params).fetchone()
         # TODO: verify permissions
-        if obj is None or getattr(obj, deleted_field):
+        if row is None:
             raise RecordNotFoundError()
-        setattr(obj, deleted_field, True)
-        setattr(obj, modified_field, datetime.datetime.utcnow())
-        Session.add(Deleted(id=object_id, parent_id=parent_id,
-                            collection_id=collection_id,
-                            last_modified=getattr(obj, modified_field)))
-        return obj.deserialize()
+        self._deleted(parent_id)
+        return {id_field: row[0], modified_field: params['now'], deleted_field: True}
 
     def delete_all(self, collection_id, parent_id, filters=None,
                    with_deleted=True, id_field=DEFAULT_ID_FIELD,
@@ -247,22 +350,52 @@ class Storage(StorageBase):
         :returns: the list of deleted objects, with minimal set of attributes.
         :rtype: list of dict
         """
-        qry = Session.query(self.collection).options(load_only('id'))\
-                     .filter(and_(self.collection.parent_id == parent_id,
-                                  getattr(self.collection, deleted_field) == False))
-        for every in filters:
-            qry = qry.filter(SQLAFilter(self.collection, every)())
-        rows = [{"id": every.id, "parent_id": parent_id, "collection_id": collection_id,
-                 modified_field: datetime.datetime.utcnow()} for every in qry.all()]
-        Session.bulk_update_mappings(self.collection,
-                                     [{"id": every['id'], deleted_field: True,
-                                       modified_field: every[modified_field]} for every in rows])
-        if with_deleted:
-            Session.bulk_insert_mappings(Deleted, rows)
-        return rows
+        model = self.collection
+        tb = model.__table__
+        params = dict(parent=parent_id, collection=collection_id,
+                      now=datetime.datetime.utcnow())
+        filters_shape = _bind_filters('filter', filters, params)
+
+        def build():
+            conditions = [tb.c.parent_id == bindparam('parent')]
+            conditions += [SQLAFilter(model, every)() for every in _bound_filters(filters_shape)]
+            return self._build_delete(conditions, with_deleted=with_deleted, id_field=id_field,
+                                      modified_field=modified_field, deleted_field=deleted_field)
+
+        key = ('delete_all', model, filters_shape, with_deleted, id_field, modified_field, deleted_field)
+        statement = self._statement(key, build)
+        # A single timestamp for the whole deletion.
+        deleted = [{id_field: object_id, modified_field: params['now'], deleted_field: True}
+                   for object_id, in self._execute(statement, params).fetchall()]
+        if deleted:
+            self._deleted(parent_id)
+        return deleted
+
+    def _build_delete(self, conditions, with_deleted, id_field, modified_field, deleted_field):
+        tb = self.collection.__table__
+        conditions = conditions + [tb.c[deleted_field] == False]  # noqa
+        update = tb.update().where(and_(*conditions))\
+                   .values({deleted_field: True, modified_field: bindparam('now')})\
+                   .returning(tb.c[id_field])
+        if not with_deleted:
+            return update
+        # Flag the objects and insert their tombstones with one statement.
+        deleted_rows = update.cte('deleted_rows')
+        dt = Deleted.__table__
+        return dt.insert().from_select(
+            ['id', 'parent_id', 'collection_id', 'last_modified'],
+            select([deleted_rows.c[id_field], bindparam('parent'),
+                    bindparam('collection'), bindparam('now')])).returning(dt.c.id)
+
+    def _deleted(self, parent_id):
+        # Core statements do not go through the flush listener, nor update
+        # the objects loaded in the session.
+        bump_timestamps(Session, [(parent_id, self.collection.__name__.lower())])
+        Session.expire_all()
+        mark_changed(Session())
 
     def purge_deleted(self, collection_id, parent_id, before=None,
-                      id_field=DEFAULT_ID_FIELD,
+                      limit=None, id_field=DEFAULT_ID_FIELD,
                       modified_field=DEFAULT_MODIFIED_FIELD,
                       auth=None):
         """Delete all deleted object tombstones in this `collection_id`
@@ -272,18 +405,45 @@ class Storage(StorageBase):
         :param str parent_id: the collection parent.
 
         :param int before: Optionnal timestamp to limit deletion (exclusive)
+        :param int limit: Optionnal maximum number of tombstones to delete.
 
         :returns: The number of deleted objects.
         :rtype: int
 
         """
         tb = Deleted.__table__
-        rst = Session.execute(tb.delete().where(and_(tb.c.parent_id == parent_id, tb.c.collection_id == collection_id)))
-        return rst
+        conditions = []
+        if collection_id is not None:
+            conditions.append(tb.c.collection_id == collection_id)
+        if '*' in parent_id:
+            conditions.append(tb.c.parent_id.like(parent_id.replace('*', '%')))
+        else:
+            conditions.append(tb.c.parent_id == parent_id)
+        if before is not None:
+            before = datetime.datetime.utcfromtimestamp(before / 1000.0)
+            conditions.append(tb.c.last_modified < before)
+
+        # Delete by chunks, to keep statements short on large collections.
+        total = 0
+        while limit is None or total < limit:
+            size = self.purge_chunk_size
+            if limit is not None:
+                size = min(size, limit - total)
+            chunk = select([tb.c.id, tb.c.parent_id, tb.c.collection_id])\
+                .where(and_(*conditions)).limit(size)
+            statement = tb.delete().where(
+                tuple_(tb.c.id, tb.c.parent_id, tb.c.collection_id).in_(chunk))
+            deleted = Session.execute(statement).rowcount
+            total += deleted
+            if deleted < size:
+                break
+        if total:
+            mark_changed(Session())
+        return total
 
     def get_all(self, collection_id, parent_id, filters=None, sorting=None,
                 pagination_rules=None, limit=None, include_deleted=False,
-                id_field=DEFAULT_ID_FIELD,
+                fields=None, id_field=DEFAULT_ID_FIELD,
                 modified_field=DEFAULT_MODIFIED_FIELD,
                 deleted_field=DEFAULT_DELETED_FIELD,
                 auth=None):
@@ -316,34 +476,92 @@ class Storage(StorageBase):
         :param bool include_deleted: Optionnally include the deleted objects
             that match the filters.
 
+        :param list fields: Optionnally restrict the attributes of the
+            returned objects. Only the columns of the requested attributes
+            are selected, along with the id and the timestamp.
+
         :returns: the limited list of objects, and the total number of
             matching objects in the collection (deleted ones excluded).
         :rtype: tuple (list, integer)
         """
-        self.qry = Session.query(self.collection)  #.filter(self.collection.parent_id == parent_id)
-        # TODO: verify permissions
-        total_records = self.qry.count()
-        if not include_deleted:
-            self.qry = self.qry.filter(getattr(self.collection, deleted_field) == False)
-        self._apply_filters(filters)
-        self._apply_orderby(sorting)
-        if limit:
-            self.qry = self.qry.limit(limit=limit)
-        return [every.deserialize() for every in self.qry.all()], total_records
-
-    def _apply_filters(self, filters):
-        filter_clause = []
-        for every in filters:
-            filter_clause.append(SQLAFilter(self.collection, every)())
-        if filter_clause:
-            self.qry = self.qry.filter(*filter_clause)
-
-    def _apply_orderby(self, sorting):
-        order_by_clause = []
-        for every in sorting:
-            order_by_clause.append(SQLSort(self.collection, every)())
-        if order_by_clause:
-            self.qry = self.qry.order_by(*order_by_clause)
+        model = self.collection
+        converter = model.__converter__
+        limit = limit or self.max_fetch_size
+        params = dict(parent=parent_id, limit=limit)
+        filters_shape = _bind_filters('filter', filters, params)
+        rules_shape = tuple([_bind_filters('rule_{}'.format(i), rule, params)
+                             for i, rule in enumerate(pagination_rules or [])])
+        sorting_shape = tuple([(every.field, every.direction) for every in sorting or []])
+        names = converter.fields
+        if fields:
+            # Subfields are extracted from the column of their root attribute.
+            selected = set([field.split('.')[0] for field in fields] + [id_field, modified_field])
+            names = tuple([name for name in converter.fields if name in selected])
+
+        def build():
+            deleted = getattr(model, deleted_field)
+            conditions = [model.parent_id == bindparam('parent')]
+            conditions += [SQLAFilter(model, every)() for every in _bound_filters(filters_shape)]
+            live = conditions + [deleted == False]  # noqa
+            if not include_deleted:
+                conditions = list(live)
+            if rules_shape:
+                conditions.append(or_(*[and_(*[SQLAFilter(model, every)() for every in _bound_filters(rule)])
+                                        for rule in rules_shape]))
+            columns = [getattr(model, name) for name in names]
+            query = select([deleted] + columns).where(and_(*conditions))
+            query = query.order_by(*[SQLSort(model, Sort(*every))() for every in sorting_shape])
+            if limit:
+                query = query.limit(bindparam('limit'))
+            count = select([func.count()]).select_from(model.__table__).where(and_(*live))
+            return query, count
+
+        key = ('get_all', model, deleted_field, filters_shape, rules_shape, sorting_shape,
+               include_deleted, bool(limit), names)
+        query, count = self._statement(key, build)
+        rows = self._execute(query, params).fetchall()
+
+        records = []
+        for row in rows:
+            record = dict(zip(names, row[1:]))
+            if row[0]:
+                record = {id_field: record[id_field],
+                          modified_field: record[modified_field],
+                          deleted_field: True}
+            records.append(record)
+
+        if rules_shape or (limit and len(rows) >= limit):
+            total_records = self._execute(count, params).scalar()
+        else:
+            # The whole filtered set was fetched: no need to count it.
+            total_records = len([row for row in rows if not row[0]])
+
+        if fields:
+            extract = fields_extractor(fields, id_field=id_field,
+                                       modified_field=modified_field,
+                                       deleted_field=deleted_field)
+            records = [extract(r) for r in records]
+        return records, total_records
+
+
+def _bind_filters(prefix, filters, params):
+    """Add the values of the specified filters to the statement parameters,
+    and return the shape of the filters, to build and cache statements.
+    """
+    shape = []
+    for i, every in enumerate(filters or []):
+        name = '{}_{}'.format(prefix, i)
+        params[name] = every.value
+        shape.append((every.field, name, every.operator))
+    return tuple(shape)
+
+
+def _bound_filters(shape):
+    filters = []
+    for field, name, operator in shape:
+        expanding = operator in SQLAFilter.iterables
+        filters.append(Filter(field, bindparam(name, expanding=expanding), operator))
+    return filters
 
 
 class SQLAFilter(object):
@@ -25,8 +25,8 @@ class DBError(object):
                 raise
             except Exception as e:
                 # probably engine not yet binded: log error and return standard parent class
-                logger.exception('Error while fetching Error subclass: %s. Parameters were: %s, %s, %s',
-                                 e, session, error, collection)
+                logger.exception('Error while fetching Error subclass: %s. Parameters were: %s, %s, %s' %
+                                 (e, session, error, collection))
         return cls(error, collection, record).process_error()
 
     @classmethod
@@ -38,7 +38,7 @@ class DBError(object):
         return {'engine': kwargs['session'].bind.engine.name}
 
     def process_error(self):
-        logger.info('Generic error returned. Submitted data was %s, %s', self.error, self.collection)
+        logger.info('Generic error returned. Submitted data was %s, %s' % (self.error, self.collection))
         raise BackendError(original=self.collection, message='Validation error while creating object. Please report '
                                                              'this to support')
 
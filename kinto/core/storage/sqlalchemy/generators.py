@@ -1,10 +1,68 @@
+import threading
+
+from pyramid_sqlalchemy import Session, metadata
+from sqlalchemy import Sequence, select, text
+
 from ...storage.generators import Generator
 
 
+ID_BLOCK_SIZE = 100
+"""Increment of the ids sequence when it is created, i.e. the size of the
+blocks of ids reserved by each process."""
+
+objects_id_seq = Sequence('objects_id_seq', start=1, increment=ID_BLOCK_SIZE,
+                          metadata=metadata)
+"""Sequence of the ids of every ``SQLABaseObject`` model."""
+
+
+# The sequence may have been created, or altered, with another increment than
+# the one declared here: blocks are as large as the database says.
+SEQUENCE_INCREMENT = text("""
+SELECT increment::BIGINT
+  FROM information_schema.sequences
+ WHERE sequence_name = :name
+   AND sequence_schema = COALESCE(:schema, current_schema())
+""")
+
+
 class IntegerId(Generator):
+    """Integer ids, reserved by blocks from a database sequence (hi/lo).
+
+    Each ``nextval()`` of the sequence reserves as many consecutive ids as
+    the sequence increment for this process. Objects thus get their id before
+    being flushed, and bulk inserts do not need a round trip per object to
+    learn their ids.
+
+    Ids are unique across processes, but are not ordered by creation.
+    """
 
     regexp = r'^[0-9]+$'
     """Pattern for positive integers only"""
 
+    def __init__(self, config=None, sequence=objects_id_seq):
+        # Ids come from the database: do not generate one to check the pattern.
+        self.config = config
+        self._regexp = None
+        self.sequence = sequence
+        self._lock = threading.Lock()
+        self._next = self._end = 0
+
+    def reserve(self):
+        """Reserve a new block of ids in the database.
+
+        :returns: the first id of the block, and the size of the block.
+        :rtype: tuple
+        """
+        first = Session.execute(select([self.sequence.next_value()])).scalar()
+        params = dict(name=self.sequence.name, schema=self.sequence.schema)
+        size = Session.execute(SEQUENCE_INCREMENT, params).scalar()
+        return first, size
+
     def __call__(self):
-        return '1'
+        with self._lock:
+            if self._next >= self._end:
+                self._next, size = self.reserve()
+                self._end = self._next + size
+            value = self._next
+            self._next += 1
+        return str(value)
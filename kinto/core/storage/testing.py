@@ -240,6 +240,120 @@ class BaseTestStorage(object):
         self.assertGreater(retrieved[self.modified_field],
                            stored[self.modified_field])
 
+    def test_create_raises_modified_meanwhile_if_none_match_and_exists(self):
+        record = self.record.copy()
+        record[self.id_field] = RECORD_ID
+        self.create_record(record=record)
+        with self.assertRaises(exceptions.ModifiedMeanwhileError) as cm:
+            self.create_record(record={'id': RECORD_ID, 'foo': 'baz'},
+                               if_none_match=True)
+        self.assertEqual(cm.exception.existing['foo'], 'bar')
+
+    def test_create_if_none_match_replaces_tombstones(self):
+        record = self.record.copy()
+        record[self.id_field] = RECORD_ID
+        self.create_record(record=record)
+        self.storage.delete(object_id=RECORD_ID, **self.storage_kw)
+        created = self.create_record(record=record, if_none_match=True)
+        retrieved = self.storage.get(object_id=RECORD_ID, **self.storage_kw)
+        self.assertEqual(retrieved, created)
+
+    def test_update_succeeds_if_timestamp_matches(self):
+        stored = self.create_record()
+        updated = self.storage.update(object_id=stored['id'],
+                                      record={'foo': 'baz'},
+                                      if_match=stored[self.modified_field],
+                                      **self.storage_kw)
+        retrieved = self.storage.get(object_id=stored['id'],
+                                     **self.storage_kw)
+        self.assertEqual(retrieved, updated)
+        self.assertGreater(updated[self.modified_field],
+                           stored[self.modified_field])
+
+    def test_update_raises_if_record_was_modified_meanwhile(self):
+        stored = self.create_record()
+        self.storage.update(object_id=stored['id'], record={'foo': 'qux'},
+                            **self.storage_kw)
+        with self.assertRaises(exceptions.ModifiedMeanwhileError) as cm:
+            self.storage.update(object_id=stored['id'],
+                                record={'foo': 'baz'},
+                                if_match=stored[self.modified_field],
+                                **self.storage_kw)
+        self.assertEqual(cm.exception.existing['foo'], 'qux')
+        retrieved = self.storage.get(object_id=stored['id'],
+                                     **self.storage_kw)
+        self.assertEqual(retrieved['foo'], 'qux')
+
+    def test_update_does_not_create_record_if_match_is_provided(self):
+        self.assertRaises(exceptions.RecordNotFoundError,
+                          self.storage.update,
+                          object_id=RECORD_ID,
+                          record=self.record,
+                          if_match=1234,
+                          **self.storage_kw)
+        self.assertRaises(exceptions.RecordNotFoundError,
+                          self.storage.get,
+                          object_id=RECORD_ID,
+                          **self.storage_kw)
+
+    def test_patch_sets_nested_and_removes_attributes(self):
+        stored = self.create_record({'title': 'a', 'author': {'name': 'b',
+                                                              'age': 3},
+                                     'body': 'c'})
+        changes = [(('title',), 'd'), (('author', 'name'), 'e'),
+                   (('tags',), ['f'])]
+        removals = [('body',), ('author', 'age')]
+        self.storage.patch(object_id=stored['id'], changes=changes,
+                           removals=removals, **self.storage_kw)
+        retrieved = self.storage.get(object_id=stored['id'],
+                                     **self.storage_kw)
+        retrieved.pop(self.modified_field)
+        self.assertEqual(retrieved, {'id': stored['id'], 'title': 'd',
+                                     'author': {'name': 'e'}, 'tags': ['f']})
+
+    def test_patch_bumps_the_record_timestamp(self):
+        stored = self.create_record()
+        timestamp = self.storage.patch(object_id=stored['id'],
+                                       changes=[(('foo',), 'baz')],
+                                       **self.storage_kw)
+        retrieved = self.storage.get(object_id=stored['id'],
+                                     **self.storage_kw)
+        self.assertGreater(timestamp, stored[self.modified_field])
+        self.assertEqual(timestamp, retrieved[self.modified_field])
+        self.assertEqual(timestamp,
+                         self.storage.collection_timestamp(**self.storage_kw))
+
+    def test_patch_succeeds_if_timestamp_matches(self):
+        stored = self.create_record()
+        self.storage.patch(object_id=stored['id'],
+                           changes=[(('foo',), 'baz')],
+                           if_match=stored[self.modified_field],
+                           **self.storage_kw)
+        retrieved = self.storage.get(object_id=stored['id'],
+                                     **self.storage_kw)
+        self.assertEqual(retrieved['foo'], 'baz')
+
+    def test_patch_raises_if_record_was_modified_meanwhile(self):
+        stored = self.create_record()
+        self.storage.update(object_id=stored['id'], record={'foo': 'qux'},
+                            **self.storage_kw)
+        with self.assertRaises(exceptions.ModifiedMeanwhileError) as cm:
+            self.storage.patch(object_id=stored['id'],
+                               changes=[(('foo',), 'baz')],
+                               if_match=stored[self.modified_field],
+                               **self.storage_kw)
+        self.assertEqual(cm.exception.existing['foo'], 'qux')
+        retrieved = self.storage.get(object_id=stored['id'],
+                                     **self.storage_kw)
+        self.assertEqual(retrieved['foo'], 'qux')
+
+    def test_patch_raises_if_record_does_not_exist(self):
+        self.assertRaises(exceptions.RecordNotFoundError,
+                          self.storage.patch,
+                          object_id=RECORD_ID,
+                          changes=[(('foo',), 'baz')],
+                          **self.storage_kw)
+
     def test_delete_works_properly(self):
         stored = self.create_record()
         self.storage.delete(object_id=stored['id'], **self.storage_kw)
@@ -311,6 +425,27 @@ class BaseTestStorage(object):
         self.assertEquals(len(records), 10)
         self.assertEquals(len(records), total_records)
 
+    def test_get_all_can_restrict_fields(self):
+        self.create_record({'title': 'foo', 'author': {'name': 'bar'},
+                            'body': 'baz', 'empty': None})
+        records, _ = self.storage.get_all(fields=['title', 'author.name',
+                                                  'empty', 'unknown'],
+                                          **self.storage_kw)
+        record = records[0]
+        self.assertEqual(sorted(record.keys()),
+                         ['author', 'empty', 'id', 'last_modified', 'title'])
+        self.assertEqual(record['author'], {'name': 'bar'})
+        self.assertIsNone(record['empty'])
+
+    def test_get_all_restricted_fields_do_not_alter_sorting(self):
+        for x in range(3):
+            self.create_record({'number': x, 'title': 'foo'})
+        sorting = [Sort('number', -1)]
+        records, _ = self.storage.get_all(sorting=sorting, fields=['title'],
+                                          **self.storage_kw)
+        self.assertNotIn('number', records[0])
+        self.assertEqual(len(records), 3)
+
     def test_get_all_handle_limit(self):
         for x in range(10):
             record = dict(self.record)
@@ -485,6 +620,18 @@ class BaseTestStorage(object):
         self.assertEqual(total_records, 10)
         self.assertEqual(len(records), 4)
 
+    def test_get_all_returns_empty_page_if_pagination_rules_match_nothing(self):
+        for x in range(3):
+            self.create_record({'number': x})
+
+        pagination_rules = [[Filter('number', 2, utils.COMPARISON.GT)]]
+        records, _ = self.storage.get_all(pagination_rules=pagination_rules,
+                                          **self.storage_kw)
+        self.assertEqual(records, [])
+        deleted = self.storage.delete_all(pagination_rules=pagination_rules,
+                                          **self.storage_kw)
+        self.assertEqual(deleted, [])
+
 
 class TimestampsTest(object):
     def test_timestamp_are_incremented_on_create(self):
@@ -753,6 +900,14 @@ class DeletedRecordsTest(object):
         self.assertEqual(now, record['last_modified'])
         self.assertTrue(before < record['last_modified'])
 
+    def test_restricted_fields_of_deleted_items_include_deleted_flag(self):
+        self.create_and_delete_record()
+        records, _ = self.storage.get_all(include_deleted=True,
+                                          fields=['title'],
+                                          **self.storage_kw)
+        self.assertEqual(sorted(records[0].keys()),
+                         ['deleted', 'id', 'last_modified'])
+
     def test_get_all_does_not_include_deleted_items_by_default(self):
         self.create_and_delete_record()
         records, _ = self.storage.get_all(**self.storage_kw)
@@ -910,6 +1065,50 @@ class DeletedRecordsTest(object):
                                           **self.storage_kw)
         self.assertEqual(len(deleted), 2)
 
+    def test_delete_all_with_old_returns_records_before_deletion(self):
+        for i in range(5):
+            self.create_record({'foo': i})
+        sorting = [Sort('foo', -1)]
+        filters = [Filter('foo', 0, utils.COMPARISON.GT)]
+        deleted, old, count = self.storage.delete_all_with_old(
+            filters=filters, sorting=sorting, limit=3, **self.storage_kw)
+        self.assertEqual(count, 4)
+        self.assertEqual([r['foo'] for r in old], [4, 3, 2])
+        self.assertEqual([r['id'] for r in deleted], [r['id'] for r in old])
+        self.assertTrue(all([r['deleted'] for r in deleted]))
+        for tombstone, record in zip(deleted, old):
+            self.assertGreater(tombstone['last_modified'],
+                               record['last_modified'])
+        records, count = self.storage.get_all(include_deleted=True,
+                                              **self.storage_kw)
+        self.assertEqual(count, 2)
+        self.assertEqual(len(records), 5)
+
+    def test_delete_all_with_old_returns_count_if_nothing_deleted(self):
+        self.create_record({'foo': 1})
+        pagination_rules = [[Filter('foo', 1, utils.COMPARISON.GT)]]
+        deleted, old, count = self.storage.delete_all_with_old(
+            pagination_rules=pagination_rules, **self.storage_kw)
+        self.assertEqual(deleted, [])
+        self.assertEqual(old, [])
+        self.assertEqual(count, 1)
+
+    def test_delete_all_with_old_only_deletes_in_collection(self):
+        record = self.create_record(collection_id='a', parent_id='1234')
+        self.create_record(record={'id': record['id']},
+                           collection_id='b', parent_id='1234')
+        self.storage.delete_all_with_old(collection_id='a', parent_id='1234')
+        _, count = self.storage.get_all(collection_id='b', parent_id='1234')
+        self.assertEqual(count, 1)
+
+    def test_delete_all_with_old_can_delete_without_deleted_items(self):
+        self.create_record()
+        self.storage.delete_all_with_old(with_deleted=False,
+                                         **self.storage_kw)
+        records, count = self.storage.get_all(include_deleted=True,
+                                              **self.storage_kw)
+        self.assertEqual(len(records), 0)
+
     def test_purge_deleted_remove_all_tombstones(self):
         self.create_record()
         self.create_record()
@@ -953,6 +1152,25 @@ class DeletedRecordsTest(object):
         self.assertEqual(count, 0)
         self.assertEqual(len(records), 1)
 
+    def test_purge_deleted_remove_at_most_limit_tombstones(self):
+        for i in range(3):
+            self.create_record()
+        self.storage.delete_all(**self.storage_kw)
+        num_removed = self.storage.purge_deleted(limit=2, **self.storage_kw)
+        self.assertEqual(num_removed, 2)
+        records, count = self.storage.get_all(include_deleted=True,
+                                              **self.storage_kw)
+        self.assertEqual(len(records), 1)
+
+    def test_purge_deleted_with_limit_and_before(self):
+        older = self.create_record()
+        newer = self.create_record()
+        self.storage.delete(object_id=older['id'], **self.storage_kw)
+        tombstone = self.storage.delete(object_id=newer['id'], **self.storage_kw)
+        num_removed = self.storage.purge_deleted(
+            before=tombstone['last_modified'], limit=10, **self.storage_kw)
+        self.assertEqual(num_removed, 1)
+
     #
     # Sorting
     #
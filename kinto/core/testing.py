@@ -40,6 +40,7 @@ class DummyRequest(mock.MagicMock):
         self.upath_info = '/v0/'
         self.registry = mock.MagicMock(settings=DEFAULT_SETTINGS.copy())
         self.registry.id_generators = defaultdict(generators.UUID4)
+        self.registry.tombstones_retention = None
         self.GET = {}
         self.headers = {}
         self.errors = cornice_errors.Errors()
@@ -0,0 +1,119 @@
+import os
+import threading
+
+import transaction
+
+from kinto.core.logs import logger
+from kinto.core.storage import exceptions as storage_exceptions
+from kinto.core.utils import msec_time
+
+
+class TombstonesRetention(object):
+    """Purge the tombstones older than a retention period, and keep track of
+    the watermark before which tombstones may have been purged.
+
+    The watermark is stored in the storage backend, so that every process
+    can tell which ``_since`` values require a full resynchronization. It is
+    cached in process, and read again after ``refresh`` seconds: purges wait
+    for that long after raising the watermark, before deleting tombstones.
+
+    When ``retention`` is set, a thread purges the tombstones older than
+    ``retention`` seconds every ``interval`` seconds in each process.
+    """
+    collection_id = 'tombstones_retention'
+    object_id = 'watermark'
+
+    def __init__(self, storage, retention=None, chunk_size=1000,
+                 interval=3600, refresh=60):
+        self.storage = storage
+        self.retention = retention
+        self.chunk_size = chunk_size
+        self.interval = interval
+        self.refresh = refresh
+
+        # (time of reading, watermark)
+        self._cached = None
+
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def watermark(self):
+        """Return the timestamp before which tombstones may have been purged,
+        or ``None`` if they never were.
+        """
+        now = msec_time()
+        cached = self._cached
+        if cached is not None and now - cached[0] < self.refresh * 1000:
+            return cached[1]
+
+        watermark = self._read_watermark()
+        self._cached = (now, watermark)
+        return watermark
+
+    def _read_watermark(self):
+        try:
+            record = self.storage.get(collection_id=self.collection_id,
+                                      parent_id='', object_id=self.object_id)
+        except storage_exceptions.RecordNotFoundError:
+            return None
+        return record['before']
+
+    def purge(self, older_than):
+        """Purge the tombstones older than ``older_than`` seconds, by chunks
+        of ``chunk_size`` tombstones, each committed in its own transaction.
+        Return the number of purged tombstones.
+        """
+        before = msec_time() - int(older_than * 1000)
+
+        # Clients are told to resynchronize before tombstones are gone.
+        with transaction.manager:
+            watermark = self._read_watermark()
+            raised = watermark is None or watermark < before
+            if raised:
+                self.storage.update(collection_id=self.collection_id,
+                                    parent_id='', object_id=self.object_id,
+                                    record={'before': before})
+        if raised:
+            self._cached = (msec_time(), before)
+            # Other processes read it again within this delay.
+            if self._stopped.wait(self.refresh):
+                return 0
+
+        total = 0
+        while True:
+            with transaction.manager:
+                purged = self.storage.purge_deleted(collection_id=None,
+                                                    parent_id='*',
+                                                    before=before,
+                                                    limit=self.chunk_size)
+            total += purged
+            if purged < self.chunk_size:
+                return total
+
+    def ensure_worker(self):
+        if self.retention is None:
+            return
+        # Threads do not survive forks: start one per process.
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            self._pid = pid
+            thread = threading.Thread(target=self._work,
+                                      name='kinto-tombstones-purge')
+            thread.daemon = True
+            thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _work(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                purged = self.purge(self.retention)
+                logger.info('%d tombstone(s) were purged.' % purged)
+            except Exception as e:
+                logger.error('Tombstones purge failed: %s' % e)
@@ -220,6 +220,43 @@ def dict_merge(a, b):
     return result
 
 
+def _json_equal(a, b):
+    """Compare JSON values strictly (e.g. ``1`` and ``True`` are different)."""
+    if type(a) is not type(b):
+        return False
+    if isinstance(a, dict):
+        return set(a) == set(b) and all(_json_equal(a[k], b[k]) for k in a)
+    if isinstance(a, list):
+        return len(a) == len(b) and all(_json_equal(x, y) for x, y in zip(a, b))
+    return a == b
+
+
+def dict_diff(old, new):
+    """Return the changes to apply on `old` in order to obtain `new`.
+
+    Nested dicts are compared recursively, so that only their modified keys
+    are part of the changes.
+
+    :returns: the list of ``(path, value)`` changes, and the list of removed
+        paths. Paths are tuples of keys.
+    :rtype: tuple
+    """
+    changes = []
+    removals = []
+    for key, value in new.items():
+        if key not in old:
+            changes.append(((key,), value))
+        elif not _json_equal(old[key], value):
+            if isinstance(old[key], dict) and isinstance(value, dict):
+                sub_changes, sub_removals = dict_diff(old[key], value)
+                changes += [((key,) + path, v) for path, v in sub_changes]
+                removals += [(key,) + path for path in sub_removals]
+            else:
+                changes.append(((key,), value))
+    removals += [(key,) for key in old if key not in new]
+    return changes, removals
+
+
 class COMPARISON(Enum):
     LT = '<'
     MIN = '>='
@@ -1,17 +1,23 @@
 import random
 import string
+import threading
+from collections import OrderedDict
 
-from kinto.core.storage import generators, exceptions
+from kinto.core import resource, utils
+from kinto.core.storage import generators, exceptions, Filter
+from pyramid.decorator import reify
 from pyramid.httpexceptions import HTTPNotFound
 from kinto.core.errors import http_error, ERRORS
 
 
 class NameGenerator(generators.Generator):
+    _random = random.SystemRandom()
+
     def __call__(self):
         alpha_num = string.ascii_letters + string.digits
         alphabet = alpha_num + '-_'
-        letters = [random.SystemRandom().choice(alpha_num)]
-        letters += [random.SystemRandom().choice(alphabet) for x in range(7)]
+        letters = [self._random.choice(alpha_num)]
+        letters += [self._random.choice(alphabet) for x in range(7)]
 
         return ''.join(letters)
 
@@ -22,6 +28,15 @@ class RelaxedUUID(generators.UUID4):
     regexp = generators.Generator.regexp
 
 
+def object_not_found(collection_id, object_id):
+    # XXX: We gave up putting details about parent id here (See #53).
+    details = {
+        "id": object_id,
+        "resource_name": collection_id
+    }
+    return http_error(HTTPNotFound(), errno=ERRORS.MISSING_RESOURCE, details=details)
+
+
 def object_exists_or_404(request, collection_id, object_id, parent_id=''):
     storage = request.registry.storage
     try:
@@ -29,10 +44,180 @@ def object_exists_or_404(request, collection_id, object_id, parent_id=''):
                            parent_id=parent_id,
                            object_id=object_id)
     except exceptions.RecordNotFoundError:
-        # XXX: We gave up putting details about parent id here (See #53).
-        details = {
-            "id": object_id,
-            "resource_name": collection_id
-        }
-        response = http_error(HTTPNotFound(), errno=ERRORS.MISSING_RESOURCE, details=details)
-        raise response
+        raise object_not_found(collection_id, object_id)
+
+
+def bucket_exists_or_404(request, bucket_id):
+    """Hide the children of deleted buckets, when they are deleted in
+    background (see :class:`kinto.cascade.CascadeDeletion`).
+    """
+    if not request.registry.cascade_deletion.background:
+        return
+    # Check if already fetched (or created) before (in batch).
+    buckets = request.bound_data.setdefault('buckets', {})
+    if bucket_id not in buckets:
+        bucket_uri = utils.instance_uri(request, 'bucket', id=bucket_id)
+        parents_cache = request.registry.parents_cache
+        buckets[bucket_id] = parents_cache.object_exists_or_404(
+            request,
+            uri=bucket_uri,
+            collection_id='bucket',
+            object_id=bucket_id)
+
+
+class KintoModel(resource.ShareableModel):
+    """Model of the Kinto resources, which send only the changes of ``PATCH``
+    requests and delete pages of records with single storage calls.
+    """
+    storage_shortcuts = True
+
+
+class ChildrenModel(KintoModel):
+    """Model of the children of buckets and collections, which hides the
+    children left over by the pending deletion of their parent, once it was
+    created again (see :class:`kinto.cascade.CascadeDeletion`).
+    """
+    def __init__(self, *args, **kwargs):
+        super(ChildrenModel, self).__init__(*args, **kwargs)
+        # Set by the resource.
+        self.cascade_deletion = None
+
+    @reify
+    def hidden_before(self):
+        """Timestamp up to which records are left over, if any."""
+        return self.cascade_deletion.hidden_before(self.parent_id,
+                                                   self.collection_id)
+
+    def _hide_left_over(self, filters):
+        if self.hidden_before is None:
+            return filters
+        return (filters or []) + [Filter(self.modified_field,
+                                         self.hidden_before,
+                                         utils.COMPARISON.GT)]
+
+    def _is_left_over(self, record):
+        return (self.hidden_before is not None and
+                record[self.modified_field] <= self.hidden_before)
+
+    def get_records(self, filters=None, *args, **kwargs):
+        filters = self._hide_left_over(filters)
+        return super(ChildrenModel, self).get_records(filters, *args, **kwargs)
+
+    def delete_records(self, filters=None, *args, **kwargs):
+        filters = self._hide_left_over(filters)
+        return super(ChildrenModel, self).delete_records(filters, *args,
+                                                         **kwargs)
+
+    def delete_records_with_old(self, filters=None, *args, **kwargs):
+        filters = self._hide_left_over(filters)
+        return super(ChildrenModel, self).delete_records_with_old(filters,
+                                                                  *args,
+                                                                  **kwargs)
+
+    def get_record(self, record_id, parent_id=None):
+        record = super(ChildrenModel, self).get_record(record_id, parent_id)
+        if self._is_left_over(record):
+            raise exceptions.RecordNotFoundError(record_id)
+        return record
+
+    def create_record(self, record, parent_id=None, if_none_match=False):
+        """Delete the left over record with the same id, if any, before
+        creating the new one.
+        """
+        if self.hidden_before is not None and self.id_field in record:
+            self._delete_left_over(record[self.id_field], parent_id)
+        return super(ChildrenModel, self).create_record(record, parent_id,
+                                                        if_none_match)
+
+    def _delete_left_over(self, record_id, parent_id=None):
+        parent_id = parent_id or self.parent_id
+        try:
+            existing = self.storage.get(collection_id=self.collection_id,
+                                        parent_id=parent_id,
+                                        object_id=record_id)
+        except exceptions.RecordNotFoundError:
+            return
+        if not self._is_left_over(existing):
+            return
+        perm_object_id = self.get_permission_object_id(record_id)
+        # Its own children remain hidden until they are deleted.
+        self.cascade_deletion.enqueue(self.collection_id, perm_object_id)
+        self.storage.delete(collection_id=self.collection_id,
+                            parent_id=parent_id,
+                            object_id=record_id,
+                            with_deleted=False)
+        self.permission.delete_object_permissions_by_ids([perm_object_id])
+
+
+class ParentsCache(object):
+    """Cache of parent objects (e.g. buckets and collections), shared across
+    requests.
+
+    Entries are validated against the timestamps of the buckets and of the
+    object collection, so that changes made from other processes are seen.
+    Since buckets deletions do not leave tombstones for their children,
+    the buckets timestamp is always part of the validation.
+
+    Validating an entry reads two timestamps: it is only cheaper than
+    reading the object when timestamps are cached in memory
+    (``kinto.storage_timestamps_cache``). Otherwise, objects are always read
+    from storage.
+
+    Entries are also evicted from ``ResourceChanged`` events subscribers.
+    """
+    def __init__(self, enabled=True, max_size=1000):
+        self.enabled = enabled
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _validation_token(self, storage, collection_id, parent_id):
+        token = (storage.collection_timestamp(collection_id='bucket',
+                                              parent_id=''),)
+        if parent_id:
+            token += (storage.collection_timestamp(collection_id=collection_id,
+                                                   parent_id=parent_id),)
+        return token
+
+    def object_exists_or_404(self, request, uri, collection_id, object_id,
+                             parent_id=''):
+        """Same as :func:`kinto.views.object_exists_or_404`, served from cache
+        when the parent collections were not modified.
+
+        :param str uri: the object URI, used as cache key.
+        """
+        if not self.enabled:
+            return object_exists_or_404(request,
+                                        collection_id=collection_id,
+                                        parent_id=parent_id,
+                                        object_id=object_id)
+
+        storage = request.registry.storage
+        # Read before the object, so that changes made in between invalidate
+        # the entry.
+        token = self._validation_token(storage, collection_id, parent_id)
+
+        with self._lock:
+            cached = self._entries.pop(uri, None)
+            if cached is not None and cached[0] == token:
+                # Most recently used entries are kept at the end.
+                self._entries[uri] = cached
+                return cached[1]
+
+        obj = object_exists_or_404(request,
+                                   collection_id=collection_id,
+                                   parent_id=parent_id,
+                                   object_id=object_id)
+
+        with self._lock:
+            self._entries[uri] = (token, obj)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return obj
+
+    def invalidate(self, uri):
+        """Evict the specified object, and every object below it."""
+        with self._lock:
+            for key in list(self._entries.keys()):
+                if key == uri or key.startswith(uri + '/'):
+                    del self._entries[key]
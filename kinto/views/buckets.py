@@ -1,6 +1,7 @@
 from kinto.core import resource
 from kinto.core.utils import instance_uri
 from kinto.core.events import ResourceChanged, ACTIONS
+from kinto.views import KintoModel
 from pyramid.events import subscriber
 
 
@@ -10,6 +11,8 @@ from pyramid.events import subscriber
 class Bucket(resource.ShareableResource):
     permissions = ('read', 'write', 'collection:create', 'group:create')
 
+    default_model = KintoModel
+
     def get_parent_id(self, request):
         # Buckets are not isolated by user, unlike Kinto-Core resources.
         return ''
@@ -23,10 +26,14 @@ def on_buckets_deleted(event):
     """
     storage = event.request.registry.storage
     permission = event.request.registry.permission
+    cascade_deletion = event.request.registry.cascade_deletion
 
     for change in event.impacted_records:
         bucket = change['old']
         bucket_uri = instance_uri(event.request, 'bucket', id=bucket['id'])
+        if cascade_deletion.background:
+            cascade_deletion.enqueue('bucket', bucket_uri)
+            continue
         # Delete everything whose parent_id starts with bucket_uri.
         parent_pattern = bucket_uri + '*'
         storage.delete_all(parent_id=parent_pattern,
@@ -37,3 +44,39 @@ def on_buckets_deleted(event):
                               collection_id=None)
         # Remove related permissions
         permission.delete_object_permissions(parent_pattern)
+
+
+@subscriber(ResourceChanged,
+            for_resources=('bucket',),
+            for_actions=(ACTIONS.CREATE, ACTIONS.UPDATE))
+def on_buckets_created(event):
+    """Some buckets were created, advance the deletion of the children of
+    previous buckets with the same ids. The ones left over remain hidden.
+    """
+    cascade_deletion = event.request.registry.cascade_deletion
+    if not cascade_deletion.background:
+        return
+
+    for change in event.impacted_records:
+        # Creations over tombstones are notified as updates.
+        old = change.get('old')
+        if old and not old.get('deleted'):
+            continue
+        bucket = change['new']
+        bucket_uri = instance_uri(event.request, 'bucket', id=bucket['id'])
+        cascade_deletion.advance(bucket_uri)
+
+
+@subscriber(ResourceChanged,
+            for_resources=('bucket',),
+            for_actions=(ACTIONS.UPDATE, ACTIONS.DELETE))
+def on_buckets_changed(event):
+    """Some buckets were modified or deleted, evict them (and their children)
+    from cache.
+    """
+    parents_cache = event.request.registry.parents_cache
+
+    for change in event.impacted_records:
+        bucket = change['old']
+        bucket_uri = instance_uri(event.request, 'bucket', id=bucket['id'])
+        parents_cache.invalidate(bucket_uri)
@@ -2,6 +2,7 @@ import colander
 import jsonschema
 from kinto.core import resource, utils
 from kinto.core.events import ResourceChanged, ACTIONS
+from kinto.views import ChildrenModel, bucket_exists_or_404
 from jsonschema import exceptions as jsonschema_exceptions
 from pyramid.events import subscriber
 
@@ -34,9 +35,15 @@ class CollectionSchema(resource.ResourceSchema):
                    collection_path='/buckets/{{bucket_id}}/collections',
                    record_path='/buckets/{{bucket_id}}/collections/{{id}}')
 class Collection(resource.ShareableResource):
+    default_model = ChildrenModel
     schema = CollectionSchema
     permissions = ('read', 'write', 'record:create')
 
+    def __init__(self, request, context=None):
+        bucket_exists_or_404(request, request.matchdict['bucket_id'])
+        super(Collection, self).__init__(request, context)
+        self.model.cascade_deletion = request.registry.cascade_deletion
+
     def get_parent_id(self, request):
         bucket_id = request.matchdict['bucket_id']
         parent_id = utils.instance_uri(request, 'bucket', id=bucket_id)
@@ -51,6 +58,7 @@ def on_collections_deleted(event):
     """
     storage = event.request.registry.storage
     permission = event.request.registry.permission
+    cascade_deletion = event.request.registry.cascade_deletion
 
     for change in event.impacted_records:
         collection = change['old']
@@ -58,9 +66,53 @@ def on_collections_deleted(event):
         parent_id = utils.instance_uri(event.request, 'collection',
                                        bucket_id=bucket_id,
                                        id=collection['id'])
+        if cascade_deletion.background:
+            cascade_deletion.enqueue('collection', parent_id)
+            continue
         storage.delete_all(collection_id='record',
                            parent_id=parent_id,
                            with_deleted=False)
         storage.purge_deleted(collection_id='record',
                               parent_id=parent_id)
         permission.delete_object_permissions(parent_id + '*')
+
+
+@subscriber(ResourceChanged,
+            for_resources=('collection',),
+            for_actions=(ACTIONS.CREATE, ACTIONS.UPDATE))
+def on_collections_created(event):
+    """Some collections were created, advance the deletion of the records
+    of previous collections with the same ids. The ones left over remain hidden.
+    """
+    cascade_deletion = event.request.registry.cascade_deletion
+    if not cascade_deletion.background:
+        return
+
+    for change in event.impacted_records:
+        # Creations over tombstones are notified as updates.
+        old = change.get('old')
+        if old and not old.get('deleted'):
+            continue
+        collection = change['new']
+        bucket_id = event.payload['bucket_id']
+        collection_uri = utils.instance_uri(event.request, 'collection',
+                                            bucket_id=bucket_id,
+                                            id=collection['id'])
+        cascade_deletion.advance(collection_uri)
+
+
+@subscriber(ResourceChanged,
+            for_resources=('collection',),
+            for_actions=(ACTIONS.UPDATE, ACTIONS.DELETE))
+def on_collections_changed(event):
+    """Some collections were modified or deleted, evict them from cache.
+    """
+    parents_cache = event.request.registry.parents_cache
+
+    for change in event.impacted_records:
+        collection = change['old']
+        bucket_id = event.payload['bucket_id']
+        collection_uri = utils.instance_uri(event.request, 'collection',
+                                            bucket_id=bucket_id,
+                                            id=collection['id'])
+        parents_cache.invalidate(collection_uri)
@@ -2,6 +2,7 @@ import colander
 
 from kinto.core import resource, utils
 from kinto.core.events import ResourceChanged, ACTIONS
+from kinto.views import ChildrenModel, bucket_exists_or_404
 from pyramid.events import subscriber
 
 
@@ -20,8 +21,14 @@ class GroupSchema(resource.ResourceSchema):
                    collection_path='/buckets/{{bucket_id}}/groups',
                    record_path='/buckets/{{bucket_id}}/groups/{{id}}')
 class Group(resource.ShareableResource):
+    default_model = ChildrenModel
     schema = GroupSchema
 
+    def __init__(self, request, context=None):
+        bucket_exists_or_404(request, request.matchdict['bucket_id'])
+        super(Group, self).__init__(request, context)
+        self.model.cascade_deletion = request.registry.cascade_deletion
+
     def get_parent_id(self, request):
         bucket_id = request.matchdict['bucket_id']
         parent_id = utils.instance_uri(request, 'bucket', id=bucket_id)
@@ -54,8 +54,16 @@ class PermissionsModel(object):
     def __init__(self, request):
         self.request = request
 
+    def timestamp(self, parent_id=None):
+        # Permissions entries are not stored with timestamp: use the one of
+        # the (always empty) ``permissions`` collection.
+        storage = self.request.registry.storage
+        return storage.collection_timestamp(collection_id='permissions',
+                                            parent_id='')
+
     def get_records(self, filters=None, sorting=None, pagination_rules=None,
-                    limit=None, include_deleted=False, parent_id=None):
+                    limit=None, include_deleted=False, parent_id=None,
+                    fields=None):
         # Invert the permissions inheritance tree.
         perms_descending_tree = {}
         for on_resource, tree in PERMISSIONS_INHERITANCE_TREE.items():
@@ -1,23 +1,58 @@
-import copy
+import threading
+from collections import OrderedDict
 
 import jsonschema
 from kinto.core import resource, utils
 from kinto.core.errors import raise_invalid
+from kinto.views import ChildrenModel, bucket_exists_or_404, object_not_found
 from jsonschema import exceptions as jsonschema_exceptions
 from pyramid.security import Authenticated
 from pyramid.settings import asbool
 
-from kinto.views import object_exists_or_404
-
 
 _parent_path = '/buckets/{{bucket_id}}/collections/{{collection_id}}'
 
 
+class ValidatorsCache(object):
+    """Cache of compiled JSON schema validators, shared across requests.
+
+    Entries are keyed by collection URI and timestamp, so that a validator
+    is never used once the collection (and thus its schema) was modified.
+    """
+    def __init__(self, max_size=100):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, uri, timestamp, schema):
+        """Return the validator of the specified collection schema, compiling
+        it if necessary.
+        """
+        key = (uri, timestamp)
+        with self._lock:
+            validator = self._entries.pop(key, None)
+            if validator is not None:
+                # Most recently used entries are kept at the end.
+                self._entries[key] = validator
+                return validator
+
+        cls = jsonschema.validators.validator_for(schema)
+        cls.check_schema(schema)
+        validator = cls(schema)
+
+        with self._lock:
+            self._entries[key] = validator
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return validator
+
+
 @resource.register(name='record',
                    collection_path=_parent_path + '/records',
                    record_path=_parent_path + '/records/{{id}}')
 class Record(resource.ShareableResource):
 
+    default_model = ChildrenModel
     schema_field = 'schema'
 
     def __init__(self, request, **kwargs):
@@ -25,17 +60,27 @@ class Record(resource.ShareableResource):
         # Check if already fetched before (in batch).
         collections = request.bound_data.setdefault('collections', {})
         collection_uri = self.get_parent_id(request)
+        bucket_exists_or_404(request, self.bucket_id)
         if collection_uri not in collections:
-            # Unknown yet, fetch from storage.
+            # Unknown yet, fetch from cache or storage.
             collection_parent_id = utils.instance_uri(request, 'bucket',
                                                       id=self.bucket_id)
-            collection = object_exists_or_404(request,
-                                              collection_id='collection',
-                                              parent_id=collection_parent_id,
-                                              object_id=self.collection_id)
+            parents_cache = request.registry.parents_cache
+            collection = parents_cache.object_exists_or_404(
+                request,
+                uri=collection_uri,
+                collection_id='collection',
+                parent_id=collection_parent_id,
+                object_id=self.collection_id)
+            cascade_deletion = request.registry.cascade_deletion
+            if cascade_deletion.is_left_over(collection,
+                                             parent_uri=collection_parent_id,
+                                             resource_name='collection'):
+                raise object_not_found('collection', self.collection_id)
             collections[collection_uri] = collection
 
         super(Record, self).__init__(request, **kwargs)
+        self.model.cascade_deletion = request.registry.cascade_deletion
         self._collection = collections[collection_uri]
 
     def get_parent_id(self, request):
@@ -57,17 +102,27 @@ class Record(resource.ShareableResource):
 
         collection_timestamp = self._collection[self.model.modified_field]
 
+        validator = self.request.registry.validators_cache.get(
+            uri=self.get_parent_id(self.request),
+            timestamp=collection_timestamp,
+            schema=schema)
+
+        # Validation does not alter the record: no need for a deep copy.
+        internal_fields = (self.model.id_field,
+                           self.model.modified_field,
+                           self.model.permissions_field,
+                           self.schema_field)
+        stripped = {k: v for k, v in new.items() if k not in internal_fields}
+
         try:
-            stripped = copy.deepcopy(new)
-            stripped.pop(self.model.id_field, None)
-            stripped.pop(self.model.modified_field, None)
-            stripped.pop(self.model.permissions_field, None)
-            stripped.pop(self.schema_field, None)
-            jsonschema.validate(stripped, schema)
+            validator.validate(stripped)
         except jsonschema_exceptions.ValidationError as e:
-            try:
-                field = e.path.pop() if e.path else e.validator_value.pop()
-            except AttributeError:
+            # The validator (and its schema) are shared: do not alter them.
+            if e.path:
+                field = e.path[-1]
+            elif isinstance(e.validator_value, list) and e.validator_value:
+                field = e.validator_value[-1]
+            else:
                 field = None
             raise_invalid(self.request, name=field, description=e.message)
 
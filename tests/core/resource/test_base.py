@@ -20,8 +20,9 @@ class ResourceTest(BaseTest):
         with mock.patch.object(request.registry.storage,
                                'collection_timestamp',
                                side_effect=storage_exceptions.BackendError):
+            resource = self.resource_class(request)
             with self.assertRaises(storage_exceptions.BackendError):
-                self.resource_class(request)
+                resource.timestamp
 
     def test_raise_unavailable_if_fail_to_obtain_timestamp_with_readonly(self):
         request = self.get_request()
@@ -32,10 +33,37 @@ class ResourceTest(BaseTest):
         with mock.patch.object(request.registry.storage,
                                'collection_timestamp',
                                side_effect=storage_exceptions.BackendError):
+            resource = self.resource_class(request)
             with self.assertRaises(excepted_exc) as cm:
-                self.resource_class(request)
+                resource.timestamp
                 self.assertIn('writable', cm.exception.message)
 
+    def test_timestamp_is_not_obtained_on_instantiation(self):
+        request = self.get_request()
+        with mock.patch.object(request.registry.storage,
+                               'collection_timestamp') as mocked:
+            self.resource_class(request)
+        self.assertFalse(mocked.called)
+
+    def test_reuses_model_of_resource_instantiated_by_context(self):
+        request = self.get_request()
+        context = self.get_context()
+        context.current_resource = self.resource_class(request, context)
+        context.current_resource.timestamp
+        with mock.patch.object(request.registry.storage,
+                               'collection_timestamp') as mocked:
+            resource = self.resource_class(request, context)
+            resource.timestamp
+        self.assertIs(resource.model, context.current_resource.model)
+        self.assertFalse(mocked.called)
+
+    def test_does_not_reuse_resource_of_another_request(self):
+        context = self.get_context()
+        context.current_resource = self.resource_class(self.get_request(),
+                                                       context)
+        resource = self.resource_class(self.get_request(), context)
+        self.assertIsNot(resource.model, context.current_resource.model)
+
 
 class ShareableResourceTest(BaseTest):
     resource_class = ShareableResource
@@ -1,3 +1,4 @@
+import mock
 from pyramid import httpexceptions
 
 from kinto.core.errors import ERRORS
@@ -195,6 +196,39 @@ class FilteringTest(BaseTest):
                           self.resource.collection_get)
 
 
+class ParsedQueryCacheTest(BaseTest):
+    def test_querystring_is_parsed_once_across_requests(self):
+        self.resource.request.GET = {'status': '1', '_sort': '-status'}
+        self.patch_known_field.start()
+        self.resource.collection_get()
+        with mock.patch.object(self.resource, '_parse_filters') as mocked:
+            self.resource.collection_get()
+        self.assertFalse(mocked.called)
+
+    def test_fields_of_cached_filters_are_still_validated(self):
+        self.resource.request.GET = {'unknown': '1'}
+        self.patch_known_field.start()
+        self.resource.collection_get()
+        self.patch_known_field.stop()
+        self.assertRaises(httpexceptions.HTTPBadRequest,
+                          self.resource.collection_get)
+
+    def test_fields_of_cached_sorting_are_still_validated(self):
+        self.resource.request.GET = {'_sort': 'unknown'}
+        self.patch_known_field.start()
+        self.resource.collection_get()
+        self.patch_known_field.stop()
+        self.assertRaises(httpexceptions.HTTPBadRequest,
+                          self.resource.collection_get)
+
+    def test_known_fields_are_computed_once(self):
+        other = self.resource_class(request=self.get_request(),
+                                    context=self.get_context())
+        other.schema = self.resource.schema
+        self.assertIs(self.resource._get_known_fields(),
+                      other._get_known_fields())
+
+
 class SubobjectFilteringTest(BaseTest):
     def setUp(self):
         super(SubobjectFilteringTest, self).setUp()
@@ -1,3 +1,4 @@
+import mock
 from pyramid import httpexceptions
 
 from . import BaseTest
@@ -15,6 +16,25 @@ class ModelTest(BaseTest):
         self.assertDictEqual(records[0], self.record)
 
 
+class PatchModelTest(BaseTest):
+    def setUp(self):
+        super(PatchModelTest, self).setUp()
+        self.model.storage_shortcuts = True
+        self.record = self.model.create_record({'field': 'value'})
+
+    def test_patch_sends_only_changes_to_storage(self):
+        with mock.patch.object(self.model.storage, 'patch',
+                               wraps=self.model.storage.patch) as patched:
+            self.model.patch_record(dict(self.record, field='new'), old=self.record)
+        self.assertTrue(patched.called)
+
+    def test_patch_goes_through_update_record_without_storage_shortcuts(self):
+        self.model.storage_shortcuts = False
+        with mock.patch.object(self.model, 'update_record') as updated:
+            self.model.patch_record(dict(self.record, field='new'), old=self.record)
+        self.assertTrue(updated.called)
+
+
 class CreateTest(BaseTest):
     def setUp(self):
         super(CreateTest, self).setUp()
@@ -39,6 +59,13 @@ class DeleteModelTest(BaseTest):
         self.model.create_record({'field': 'a'})
         self.model.create_record({'field': 'b'})
 
+    def test_delete_goes_through_delete_records_without_storage_shortcuts(self):
+        self.model.storage_shortcuts = False
+        with mock.patch.object(self.model, 'delete_records',
+                               wraps=self.model.delete_records) as deleted:
+            self.resource.collection_delete()
+        self.assertTrue(deleted.called)
+
     def test_delete_on_list_removes_all_records(self):
         self.resource.collection_delete()
         result = self.resource.collection_get()
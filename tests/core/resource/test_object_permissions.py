@@ -205,6 +205,46 @@ class DeletedRecordPermissionTest(PermissionTest):
         self.assertEqual(len(principals), 0)
 
 
+class DeletedRecordsPagePermissionTest(PermissionTest):
+    def setUp(self):
+        super(DeletedRecordsPagePermissionTest, self).setUp()
+        self.resource.model.storage_shortcuts = True
+        self.resource.context.on_collection = True
+        self.resource.model.get_permission_object_id = (
+            lambda object_id: '/articles/%s' % object_id)
+        self.uris = []
+        for i in range(2):
+            record = self.resource.model.create_record({})
+            uri = '/articles/%s' % record['id']
+            self.permission.add_principal_to_ace(uri, 'read', 'fxa:user')
+            self.uris.append(uri)
+
+    def test_permissions_of_remaining_records_are_kept_on_paginated_delete(self):
+        self.resource.request.GET = {'_limit': '1'}
+        result = self.resource.collection_delete()
+        deleted_uri = '/articles/%s' % result['data'][0]['id']
+        for uri in self.uris:
+            principals = self.permission.get_object_permission_principals(
+                uri, 'read')
+            self.assertEqual(len(principals), 0 if uri == deleted_uri else 1)
+
+    def test_permissions_of_remaining_records_are_kept_without_storage_shortcuts(self):
+        self.resource.model.storage_shortcuts = False
+        self.test_permissions_of_remaining_records_are_kept_on_paginated_delete()
+
+    def test_permissions_are_deleted_by_ids_if_every_record_is_deleted(self):
+        # e.g. a record created after the deleted ones were selected.
+        self.permission.add_principal_to_ace('/articles/new', 'read', 'fxa:user')
+        self.resource.collection_delete()
+        for uri in self.uris:
+            principals = self.permission.get_object_permission_principals(
+                uri, 'read')
+            self.assertEqual(len(principals), 0)
+        principals = self.permission.get_object_permission_principals(
+            '/articles/new', 'read')
+        self.assertEqual(len(principals), 1)
+
+
 class GuestCollectionListTest(PermissionTest):
     def setUp(self):
         super(GuestCollectionListTest, self).setUp()
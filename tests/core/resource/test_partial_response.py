@@ -1,3 +1,4 @@
+import mock
 from pyramid import httpexceptions
 
 from kinto.core.resource import ShareableResource
@@ -41,6 +42,33 @@ class PartialFieldsTest(PartialResponseBase):
         self.assertIn('field', record)
         self.assertNotIn('other', record)
 
+    def test_fields_parameter_is_passed_to_storage_on_get_all(self):
+        self.resource.request.GET['_fields'] = 'field'
+        with mock.patch.object(self.model.storage, 'get_all',
+                               wraps=self.model.storage.get_all) as mocked:
+            self.resource.collection_get()
+        fields = mocked.call_args[1]['fields']
+        self.assertIn('field', fields)
+        self.assertNotIn('other', fields)
+        self.assertNotIn('orig', fields)
+
+    def test_fields_are_not_passed_to_storage_if_not_requested(self):
+        with mock.patch.object(self.model.storage, 'get_all',
+                               wraps=self.model.storage.get_all) as mocked:
+            self.resource.collection_get()
+        self.assertNotIn('fields', mocked.call_args[1])
+
+    def test_fields_parameter_do_not_break_pagination_on_other_fields(self):
+        for i in range(3):
+            self.model.create_record({'field': 'value', 'other': 'o%s' % i})
+        self.resource.request.GET = {'_fields': 'field',
+                                     '_sort': 'other',
+                                     '_limit': '2'}
+        result = self.resource.collection_get()
+        self.assertNotIn('other', result['data'][0])
+        next_page = self.last_response.headers['Next-Page']
+        self.assertIn('_token=', next_page)
+
     def test_fail_if_fields_parameter_is_invalid(self):
         self.resource.request.GET['_fields'] = 'invalid_field'
         self.assertRaises(httpexceptions.HTTPBadRequest, self.resource.get)
@@ -1,3 +1,4 @@
+import mock
 from pyramid import httpexceptions
 
 from kinto.core.errors import ERRORS
@@ -195,6 +196,42 @@ class ModifiedMeanwhileTest(BaseTest):
         self.resource.record_id = self.stored['id']
         self.resource.put()  # not raising.
 
+    def test_put_returns_412_if_changed_between_check_and_write(self):
+        current = self.stored[self.model.modified_field]
+        self.resource.request.headers['If-Match'] = '"%s"' % current
+        self.resource.request.validated = {'body': {'data': {'field': 'new'}}}
+        self.resource.record_id = self.stored['id']
+        process_record = self.resource.process_record
+
+        def concurrent_update(new, old=None):
+            self.model.update_record({'id': self.stored['id'],
+                                      'field': 'concurrent'})
+            return process_record(new, old)
+
+        with mock.patch.object(self.resource, 'process_record',
+                               side_effect=concurrent_update):
+            with self.assertRaises(httpexceptions.HTTPPreconditionFailed) as cm:
+                self.resource.put()
+        existing = cm.exception.json['details']['existing']
+        self.assertEqual(existing['field'], 'concurrent')
+
+    def test_put_if_none_match_star_fails_if_created_before_write(self):
+        self.resource.request.headers.pop('If-Match')
+        self.resource.request.headers['If-None-Match'] = '*'
+        self.resource.request.validated = {'body': {'data': {'field': 'new'}}}
+        record_id = self.resource.model.id_generator()
+        self.resource.record_id = record_id
+        process_record = self.resource.process_record
+
+        def concurrent_create(new, old=None):
+            self.model.create_record({'id': record_id, 'field': 'concurrent'})
+            return process_record(new, old)
+
+        with mock.patch.object(self.resource, 'process_record',
+                               side_effect=concurrent_create):
+            self.assertRaises(httpexceptions.HTTPPreconditionFailed,
+                              self.resource.put)
+
     def test_post_if_none_match_star_fails_if_record_exists(self):
         self.resource.request.headers.pop('If-Match')
         self.resource.request.headers['If-None-Match'] = '*'
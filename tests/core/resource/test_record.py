@@ -5,6 +5,7 @@ from pyramid import httpexceptions
 
 from kinto.core.resource import ResourceSchema
 from kinto.core.errors import ERRORS
+from kinto.core.storage.exceptions import ModifiedMeanwhileError, RecordNotFoundError
 
 from . import BaseTest
 
@@ -207,6 +208,7 @@ class DeleteTest(BaseTest):
 class PatchTest(BaseTest):
     def setUp(self):
         super(PatchTest, self).setUp()
+        self.model.storage_shortcuts = True
         self.stored = self.model.create_record({})
         self.resource.record_id = self.stored['id']
         self.resource.request.json = {'data': {'position': 10}}
@@ -270,10 +272,67 @@ class PatchTest(BaseTest):
             self.assertEquals(self.result['last_modified'],
                               result['last_modified'])
 
+    def test_only_changes_are_sent_to_storage(self):
+        self.resource.request.json = {'data': {'unread': True}}
+        with mock.patch.object(self.model.storage, 'patch',
+                               wraps=self.model.storage.patch) as mocked:
+            self.resource.patch()
+        self.assertEqual(mocked.call_args[1]['changes'],
+                         [(('unread',), True)])
+        self.assertEqual(mocked.call_args[1]['if_match'],
+                         self.result['last_modified'])
+
+    def test_returns_412_if_record_was_modified_meanwhile(self):
+        self.resource.request.json = {'data': {'unread': True}}
+        self.resource.request.headers['If-Match'] = '"%s"' % self.result['last_modified']
+        with mock.patch.object(self.model.storage, 'patch',
+                               side_effect=ModifiedMeanwhileError(self.result)):
+            with self.assertRaises(httpexceptions.HTTPPreconditionFailed) as cm:
+                self.resource.patch()
+        self.assertEqual(cm.exception.json['errno'],
+                         ERRORS.MODIFIED_MEANWHILE.value)
+
+    def test_changes_are_applied_again_if_modified_meanwhile_without_precondition(self):
+        self.resource.request.json = {'data': {'unread': True}}
+        patch = self.model.storage.patch
+        attempts = []
+
+        def modified_meanwhile(*args, **kwargs):
+            attempts.append(kwargs['if_match'])
+            if len(attempts) == 1:
+                self.model.update_record(dict(self.result, position=42))
+            return patch(*args, **kwargs)
+
+        with mock.patch.object(self.model.storage, 'patch',
+                               side_effect=modified_meanwhile):
+            result = self.resource.patch()['data']
+        self.assertEqual(len(attempts), 2)
+        self.assertTrue(result['unread'])
+        self.assertEqual(result['position'], 42)
+
+    def test_returns_412_if_record_keeps_being_modified_meanwhile(self):
+        self.resource.request.json = {'data': {'unread': True}}
+        with mock.patch.object(self.model.storage, 'patch',
+                               side_effect=ModifiedMeanwhileError(self.result)) as mocked:
+            with self.assertRaises(httpexceptions.HTTPPreconditionFailed) as cm:
+                self.resource.patch()
+        self.assertEqual(cm.exception.json['errno'],
+                         ERRORS.MODIFIED_MEANWHILE.value)
+        self.assertEqual(mocked.call_count, self.resource.patch_retries + 1)
+
+    def test_returns_404_if_record_was_deleted_meanwhile(self):
+        self.resource.request.json = {'data': {'unread': True}}
+        with mock.patch.object(self.model.storage, 'patch',
+                               side_effect=RecordNotFoundError):
+            with self.assertRaises(httpexceptions.HTTPNotFound) as cm:
+                self.resource.patch()
+        self.assertEqual(cm.exception.json['errno'],
+                         ERRORS.INVALID_RESOURCE_ID.value)
+
     def test_returns_changed_fields_among_provided_if_behaviour_is_diff(self):
         self.resource.request.json = {'data': {'unread': True, 'position': 15}}
         self.resource.request.headers['Response-Behavior'] = 'diff'
-        with mock.patch.object(self.resource.model, 'update_record',
+        with mock.patch.object(self.resource.model, 'patch_record',
                                return_value={'unread': True, 'position': 0}):
             result = self.resource.patch()['data']
         self.assertDictEqual(result, {'position': 0})
@@ -281,7 +340,7 @@ class PatchTest(BaseTest):
     def test_returns_changed_fields_if_behaviour_is_light(self):
         self.resource.request.json = {'data': {'unread': True, 'position': 15}}
         self.resource.request.headers['Response-Behavior'] = 'light'
-        with mock.patch.object(self.resource.model, 'update_record',
+        with mock.patch.object(self.resource.model, 'patch_record',
                                return_value={'unread': True, 'position': 0}):
             result = self.resource.patch()['data']
         self.assertDictEqual(result, {'unread': True, 'position': 0})
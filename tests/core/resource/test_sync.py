@@ -5,6 +5,7 @@ import time
 import six
 from pyramid import httpexceptions
 
+from kinto.core.tombstones import TombstonesRetention
 from kinto.core.utils import decode_header
 from kinto.core.testing import ThreadMixin
 
@@ -17,6 +18,8 @@ class SinceModifiedTest(ThreadMixin, BaseTest):
         super(SinceModifiedTest, self).setUp()
 
         self.resource.request.validated = {'body': {'data': {}}}
+        # Obtain collection timestamp before it gets mocked.
+        self.resource.timestamp
 
         with mock.patch.object(self.model.storage,
                                '_bump_timestamp') as msec_mocked:
@@ -197,3 +200,42 @@ class SinceModifiedTest(ThreadMixin, BaseTest):
 
         # Make sure fetch timestamp is below (for next fetch)
         self.assertGreater(timestamps['post'], timestamps['fetch'])
+
+
+class ResyncRequiredTest(BaseTest):
+
+    def setUp(self):
+        super(ResyncRequiredTest, self).setUp()
+        retention = TombstonesRetention(self.storage)
+        self.resource.request.registry.tombstones_retention = retention
+        self.storage.update(collection_id='tombstones_retention', parent_id='',
+                            object_id='watermark', record={'before': 10})
+
+    def test_header_is_provided_if_since_predates_the_watermark(self):
+        self.resource.request.GET = {'_since': '5'}
+        self.resource.collection_get()
+        headers = self.last_response.headers
+        self.assertEqual(headers['Resync-Required'], '10')
+
+    def test_header_is_provided_with_min_last_modified(self):
+        self.resource.request.GET = {'min_last_modified': '5'}
+        self.resource.collection_get()
+        self.assertIn('Resync-Required', self.last_response.headers)
+
+    def test_header_is_not_provided_if_since_follows_the_watermark(self):
+        self.resource.request.GET = {'_since': '10'}
+        self.resource.collection_get()
+        self.assertNotIn('Resync-Required', self.last_response.headers)
+
+    def test_watermark_is_not_read_on_every_poll(self):
+        self.resource.request.GET = {'_since': '5'}
+        self.resource.collection_get()
+        with mock.patch.object(self.storage, 'get') as mocked:
+            self.resource.collection_get()
+        self.assertFalse(mocked.called)
+        self.assertEqual(self.last_response.headers['Resync-Required'], '10')
+
+    def test_header_is_not_provided_without_since(self):
+        self.resource.request.GET = {'_before': '5'}
+        self.resource.collection_get()
+        self.assertNotIn('Resync-Required', self.last_response.headers)
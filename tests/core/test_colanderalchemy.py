@@ -2,6 +2,7 @@
 Test how well CA (a.k.a. ColanderAlchemy) plays as a ResourceSchema
 """
 
+import mock
 import unittest
 
 from colanderalchemy import SQLAlchemySchemaNode
@@ -163,3 +164,30 @@ class ColanderAlchemyTest(unittest.TestCase):
         appstruct = Dummy.deserialize(dict(name='Name', price=float(100)))
         self.assertEqual(appstruct.price, float(121.0))
         self.assertEqual(appstruct.name, 'NAME-121.0')
+
+    def test_objects_are_converted_to_records_without_schema(self):
+        """
+        Records are read from the schema columns, without colander
+        """
+
+        class Dummy(Base):
+            __tablename__ = "dummy"
+            name = Column(String)
+
+        schema_setup(None, Dummy)
+        obj = Dummy(id=4, name='Name', parent_id='abc', last_modified=42, deleted=False)
+        with mock.patch.object(Dummy.__schema__, 'serialize') as serialize:
+            record = obj.to_record()
+        self.assertFalse(serialize.called)
+        self.assertEqual(record, dict(id=4, name='Name', last_modified=42))
+
+    def test_rows_of_schema_columns_are_converted_to_records(self):
+        class Dummy(Base):
+            __tablename__ = "dummy"
+            name = Column(String)
+
+        schema_setup(None, Dummy)
+        converter = Dummy.__converter__
+        self.assertEqual([c.name for c in converter.columns], ['id', 'last_modified', 'name'])
+        self.assertEqual(converter.from_row((4, 42, 'Name')),
+                         dict(id=4, last_modified=42, name='Name'))
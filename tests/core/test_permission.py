@@ -3,7 +3,9 @@ import unittest
 
 from kinto.core.utils import sqlalchemy
 from kinto.core.permission import (PermissionBase, memory as memory_backend,
-                                   postgresql as postgresql_backend)
+                                   postgresql as postgresql_backend,
+                                   sharded as sharded_backend)
+from kinto.core.storage.sharded import ShardRouter
 from kinto.core.permission.testing import PermissionTest
 from kinto.core.testing import skip_if_no_postgresql, load_default_settings
 
@@ -32,6 +34,12 @@ class PermissionBaseTest(unittest.TestCase):
         for call in calls:
             self.assertRaises(NotImplementedError, *call)
 
+    def test_delete_object_permissions_by_ids_uses_delete_object_permissions(self):
+        with mock.patch.object(self.permission,
+                               'delete_object_permissions') as mocked:
+            self.permission.delete_object_permissions_by_ids(['/a', '/b'])
+        mocked.assert_called_with('/a', '/b')
+
 
 class MemoryPermissionTest(PermissionTest, unittest.TestCase):
     backend = memory_backend
@@ -46,6 +54,35 @@ class MemoryPermissionTest(PermissionTest, unittest.TestCase):
         pass
 
 
+class ShardedPermissionTest(MemoryPermissionTest):
+    def setUp(self):
+        super(ShardedPermissionTest, self).setUp()
+        self.permission = sharded_backend.Permission(
+            shards={'a': memory_backend.Permission(),
+                    'b': memory_backend.Permission()},
+            router=ShardRouter(['a', 'b']))
+
+    def test_permissions_are_stored_in_the_shard_of_their_bucket(self):
+        self.permission.add_principal_to_ace('/buckets/1234/groups/g',
+                                             'read', 'alice')
+        self.permission.add_principal_to_ace('/buckets/1234', 'read', 'bob')
+        shard_a, shard_b = self.permission.shards['a'], self.permission.shards['b']
+        self.assertEqual(shard_b.get_object_permissions('/buckets/1234/groups/g'),
+                         {'read': {'alice'}})
+        self.assertEqual(shard_a.get_object_permissions('/buckets/1234'),
+                         {'read': {'bob'}})
+
+    def test_accessible_objects_are_merged_from_every_shard(self):
+        self.permission.add_principal_to_ace('/buckets/1234/groups/g',
+                                             'read', 'alice')
+        self.permission.add_principal_to_ace('/buckets/5678/groups/g',
+                                             'read', 'alice')
+        objects = self.permission.get_accessible_objects(
+            ['alice'], [('/buckets/*/groups/*', 'read')])
+        self.assertEqual(sorted(objects.keys()), ['/buckets/1234/groups/g',
+                                                  '/buckets/5678/groups/g'])
+
+
 @skip_if_no_postgresql
 class PostgreSQLPermissionTest(PermissionTest, unittest.TestCase):
     backend = postgresql_backend
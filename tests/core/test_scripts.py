@@ -65,10 +65,13 @@ class DeleteCollectionTest(unittest.TestCase):
             parent_id='/buckets/test_bucket',
             object_id='test_collection',
             with_deleted=False)
-        self.registry.permission.delete_object_permissions.assert_called_with(
-            '/buckets/test_bucket/collections/test_collection',
+        permission = self.registry.permission
+        permission.delete_object_permissions_by_ids.assert_called_with(
+            ['/buckets/test_bucket/collections/test_collection'])
+        chunked = permission.delete_object_permissions_by_ids_chunked
+        self.assertEqual(list(chunked.call_args[0][0]), [
             '/buckets/test_bucket/collections/test_collection/records/1234',
-            '/buckets/test_bucket/collections/test_collection/records/5678')
+            '/buckets/test_bucket/collections/test_collection/records/5678'])
 
         mocked.info.assert_any_call('2 record(s) were deleted.')
         mocked.info.assert_any_call(
@@ -111,3 +114,25 @@ class DeleteCollectionTest(unittest.TestCase):
         mocked.error.assert_called_with(
             "Collection '/buckets/test_bucket/collections/test_collection' "
             "does not exist.")
+
+
+class PurgeTombstonesTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = mock.MagicMock()
+
+    def test_purge_tombstones_in_read_only_display_an_error(self):
+        with mock.patch('kinto.core.scripts.logger') as mocked:
+            self.registry.settings = {'readonly': 'true'}
+            code = scripts.purge_tombstones({'registry': self.registry}, 3600)
+            assert code == 31
+            mocked.error.assert_any_call('Cannot purge the tombstones while '
+                                         'in readonly mode.')
+
+    def test_purge_tombstones_purges_older_tombstones(self):
+        retention = self.registry.tombstones_retention
+        retention.purge.return_value = 12
+        with mock.patch('kinto.core.scripts.logger') as mocked:
+            code = scripts.purge_tombstones({'registry': self.registry}, 3600)
+        assert code == 0
+        retention.purge.assert_called_with(3600)
+        mocked.info.assert_any_call('12 tombstone(s) were purged.')
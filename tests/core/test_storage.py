@@ -1,11 +1,22 @@
 # -*- coding: utf-8 -*-
 
 import mock
+import threading
+import time
+from pyramid import testing
+from pyramid.exceptions import ConfigurationError
 
+from kinto.core import utils
 from kinto.core.utils import sqlalchemy
-from kinto.core.storage import generators, memory, postgresql, exceptions, StorageBase
+from kinto.core.storage import (generators, memory, postgresql, sharded, exceptions, Filter, Sort,
+                                StorageBase)
+from kinto.core.permission import (memory as memory_permission,
+                                   postgresql as postgresql_permission,
+                                   sharded as sharded_permission)
 from kinto.core.testing import (unittest, skip_if_no_postgresql, load_default_settings)
-from kinto.core.storage.testing import StorageTest
+from kinto.core.storage.postgresql.timestamps import TimestampsCache
+from kinto.core.storage.sqlalchemy.generators import IntegerId
+from kinto.core.storage.testing import StorageTest, RECORD_ID
 
 
 class GeneratorTest(unittest.TestCase):
@@ -45,6 +56,61 @@ class GeneratorTest(unittest.TestCase):
         self.assertTrue(generator.match(invalid_uuid4))
 
 
+class UUID7GeneratorTest(unittest.TestCase):
+    def setUp(self):
+        self.generator = generators.UUID7()
+
+    def test_ids_are_version_7_uuids(self):
+        record_id = self.generator()
+        self.assertTrue(self.generator.match(record_id))
+        self.assertEqual(record_id[14], '7')
+        self.assertIn(record_id[19], '89ab')
+
+    def test_ids_start_with_the_current_timestamp(self):
+        before = int(time.time() * 1000)
+        record_id = self.generator()
+        timestamp = int(record_id[:8] + record_id[9:13], 16)
+        self.assertGreaterEqual(timestamp, before)
+        self.assertLessEqual(timestamp, int(time.time() * 1000))
+
+    def test_ids_are_sorted_within_the_same_millisecond(self):
+        with mock.patch('kinto.core.storage.generators.time.time',
+                        return_value=1500000000.0):
+            ids = [self.generator() for _ in range(5000)]
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual(len(set(ids)), len(ids))
+
+    def test_ids_are_sorted_if_clock_goes_backwards(self):
+        with mock.patch('kinto.core.storage.generators.time.time',
+                        return_value=1500000000.0):
+            first = self.generator()
+        with mock.patch('kinto.core.storage.generators.time.time',
+                        return_value=1400000000.0):
+            second = self.generator()
+        self.assertLess(first, second)
+
+
+class IntegerIdGeneratorTest(unittest.TestCase):
+    def setUp(self):
+        self.generator = IntegerId()
+        patch = mock.patch.object(self.generator, 'reserve',
+                                  side_effect=[(1, 3), (301, 3)])
+        self.reserve = patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_ids_are_integers(self):
+        self.assertTrue(self.generator.match(self.generator()))
+        self.assertFalse(self.generator.match('abc'))
+
+    def test_ids_are_reserved_by_blocks(self):
+        ids = [self.generator() for _ in range(4)]
+        self.assertEqual(ids, ['1', '2', '3', '301'])
+        self.assertEqual(self.reserve.call_count, 2)
+
+    def test_instances_share_the_objects_sequence(self):
+        self.assertIs(self.generator.sequence, IntegerId().sequence)
+
+
 class StorageBaseTest(unittest.TestCase):
     def setUp(self):
         self.storage = StorageBase()
@@ -99,6 +165,164 @@ class MemoryStorageTest(StorageTest, unittest.TestCase):
     def test_ping_logs_error_if_unavailable(self):
         pass
 
+    def test_records_are_listed_by_timestamp_pages_with_tombstones(self):
+        for i in range(6):
+            record = self.create_record({'number': i})
+            if i % 2:
+                self.storage.delete(object_id=record['id'], **self.storage_kw)
+        sorting = [Sort('last_modified', -1)]
+        records, count = self.storage.get_all(sorting=sorting, limit=2,
+                                              include_deleted=True, **self.storage_kw)
+        self.assertEqual(count, 3)
+        # Tombstones are newer than the records created before their deletion.
+        self.assertEqual([r.get('number') for r in records], [None, 4])
+        before = records[-1]['last_modified']
+        pagination = [[Filter('last_modified', before, utils.COMPARISON.LT)]]
+        records, _ = self.storage.get_all(sorting=sorting, limit=2,
+                                          pagination_rules=pagination,
+                                          include_deleted=True, **self.storage_kw)
+        self.assertEqual([r.get('number') for r in records], [None, 2])
+
+    def test_timestamp_filters_are_combined_with_other_filters(self):
+        created = [self.create_record({'number': i % 2}) for i in range(5)]
+        filters = [Filter('last_modified', created[1]['last_modified'], utils.COMPARISON.GT),
+                   Filter('number', 0, utils.COMPARISON.EQ)]
+        records, count = self.storage.get_all(filters=filters,
+                                              sorting=[Sort('last_modified', 1)],
+                                              **self.storage_kw)
+        self.assertEqual(count, 2)
+        self.assertEqual([r['id'] for r in records], [created[2]['id'], created[4]['id']])
+
+    def test_records_of_wildcard_parents_are_listed(self):
+        self.create_record(parent_id='/accounts/a/c')
+        self.create_record(parent_id='/accounts/ab/c')
+        self.create_record(parent_id='/accounts/b/c')
+        _, count = self.storage.get_all(collection_id='test', parent_id='/accounts/a*/*')
+        self.assertEqual(count, 2)
+
+    def test_oldest_tombstones_are_purged_first(self):
+        created = [self.create_record() for i in range(3)]
+        for record in reversed(created):
+            self.storage.delete(object_id=record['id'], **self.storage_kw)
+        self.storage.purge_deleted(limit=1, **self.storage_kw)
+        records, _ = self.storage.get_all(include_deleted=True, **self.storage_kw)
+        self.assertEqual(sorted([r['id'] for r in records]),
+                         sorted([r['id'] for r in created[:2]]))
+
+
+class ShardRouterTest(unittest.TestCase):
+    def setUp(self):
+        self.router = sharded.ShardRouter(['a', 'b'])
+
+    def test_requires_at_least_one_shard(self):
+        self.assertRaises(ConfigurationError, sharded.ShardRouter, [])
+
+    def test_shard_map_must_refer_to_known_shards(self):
+        self.assertRaises(ConfigurationError, sharded.ShardRouter,
+                          ['a', 'b'], {'bid': 'c'})
+
+    def test_children_of_a_bucket_are_routed_to_its_shard(self):
+        self.assertEqual(self.router.route_parent('/buckets/1234'), 'b')
+        self.assertEqual(self.router.route_parent('/buckets/1234/groups/g'), 'b')
+        self.assertEqual(self.router.route_parent('/buckets/1234/collections/c'), 'b')
+        self.assertEqual(self.router.route_parent('/buckets/5678'), 'a')
+
+    def test_parents_outside_buckets_are_routed_to_first_shard(self):
+        self.assertEqual(self.router.route_parent(''), 'a')
+        self.assertEqual(self.router.route_parent('other'), 'a')
+        self.assertEqual(self.router.route_parent('abc*'), 'a')
+
+    def test_patterns_within_a_bucket_are_routed_to_its_shard(self):
+        self.assertEqual(self.router.route_parent('/buckets/1234/collections/*'), 'b')
+        self.assertEqual(self.router.route_parent('/buckets/1234*'), 'b')
+
+    def test_patterns_across_buckets_are_not_routed(self):
+        self.assertIsNone(self.router.route_parent('*'))
+        self.assertIsNone(self.router.route_parent('/buckets/*'))
+        self.assertIsNone(self.router.route_parent('/bu*'))
+
+    def test_buckets_can_be_pinned_to_a_shard(self):
+        router = sharded.ShardRouter(['a', 'b'], {'1234': 'a'})
+        self.assertEqual(router.route_parent('/buckets/1234/collections/c'), 'a')
+
+    def test_buckets_are_routed_to_first_shard(self):
+        self.assertEqual(self.router.route_object('/buckets/1234'), 'a')
+        self.assertEqual(self.router.route_object('/buckets/1234/groups/g'), 'b')
+        self.assertEqual(self.router.route_object('/articles/1234'), 'a')
+
+    def test_objects_are_grouped_by_shard(self):
+        groups = self.router.group_objects(['/buckets/1234/collections/c',
+                                            '/buckets/5678/collections/c',
+                                            '/buckets/*/collections/c'])
+        self.assertEqual(groups, {'a': ['/buckets/5678/collections/c',
+                                        '/buckets/*/collections/c'],
+                                  'b': ['/buckets/1234/collections/c',
+                                        '/buckets/*/collections/c']})
+
+    def test_shards_are_read_from_settings(self):
+        settings = {'storage_shards': 'a=postgres://db1/kinto\nb=postgres://db2/kinto',
+                    'storage_shard_map': 'bid=b'}
+        router, urls = sharded.load_router(settings)
+        self.assertEqual(router.names, ['a', 'b'])
+        self.assertEqual(router.shard_map, {'bid': 'b'})
+        self.assertEqual(urls['b'], 'postgres://db2/kinto')
+
+
+class ShardedStorageTest(MemoryStorageTest):
+    def setUp(self):
+        super(ShardedStorageTest, self).setUp()
+        self.storage = sharded.Storage(shards={'a': memory.Storage(),
+                                               'b': memory.Storage()},
+                                       router=sharded.ShardRouter(['a', 'b']))
+        self.storage_kw['parent_id'] = '/buckets/1234'
+        self.other_parent_id = '/buckets/5678'
+        # The heartbeat records are stored in the first shard.
+        self.client_error_patcher = mock.patch.object(
+            self.storage.shards['a'],
+            '_bump_timestamp',
+            side_effect=exceptions.BackendError("Segmentation fault."))
+
+    def test_records_are_stored_in_the_shard_of_their_bucket(self):
+        self.create_record()
+        self.create_record(parent_id=self.other_parent_id)
+        _, count = self.storage.shards['b'].get_all(**self.storage_kw)
+        self.assertEqual(count, 1)
+        _, count = self.storage.shards['a'].get_all(**self.storage_kw)
+        self.assertEqual(count, 0)
+
+    def test_operations_across_buckets_are_refused(self):
+        self.assertRaises(ValueError, self.storage.get_all,
+                          collection_id='test', parent_id='/buckets/*')
+
+    def test_purge_deleted_across_buckets_is_run_on_every_shard(self):
+        self.create_record()
+        self.create_record(parent_id=self.other_parent_id)
+        self.storage.delete_all(**self.storage_kw)
+        self.storage.delete_all(collection_id='test',
+                                parent_id=self.other_parent_id)
+        num_removed = self.storage.purge_deleted(collection_id='test',
+                                                 parent_id='*')
+        self.assertEqual(num_removed, 2)
+
+    def test_purge_deleted_across_buckets_shares_the_limit(self):
+        for parent_id in (self.storage_kw['parent_id'], self.other_parent_id):
+            for i in range(2):
+                self.create_record(parent_id=parent_id)
+            self.storage.delete_all(collection_id='test', parent_id=parent_id)
+        num_removed = self.storage.purge_deleted(collection_id='test',
+                                                 parent_id='*', limit=3)
+        self.assertEqual(num_removed, 3)
+
+    def test_purge_deleted_stops_once_the_limit_is_reached(self):
+        with mock.patch.object(self.storage.shards['a'],
+                               'purge_deleted', return_value=1) as first, \
+                mock.patch.object(self.storage.shards['b'],
+                                  'purge_deleted') as second:
+            self.storage.purge_deleted(collection_id='test', parent_id='*',
+                                       limit=1)
+        self.assertEqual(first.call_args[1]['limit'], 1)
+        self.assertFalse(second.called)
+
 
 @skip_if_no_postgresql
 class PostgreSQLStorageTest(StorageTest, unittest.TestCase):
@@ -127,6 +351,36 @@ class PostgreSQLStorageTest(StorageTest, unittest.TestCase):
         results, count = limited.get_all(**self.storage_kw)
         self.assertEqual(len(results), 2)
 
+    def test_concurrent_conditional_creations_raise_modified_meanwhile(self):
+        # Insert the same record from another connection, not committed yet.
+        engine = sqlalchemy.create_engine(self.settings['storage_url'])
+        self.addCleanup(engine.dispose)
+        session = engine.connect()
+        other = session.begin()
+        session.execute(sqlalchemy.text("""
+        INSERT INTO records (id, parent_id, collection_id, data, last_modified)
+        VALUES (:object_id, :parent_id, :collection_id, '{}', from_epoch(NULL));
+        """), dict(object_id=RECORD_ID, **self.storage_kw))
+        errors = []
+
+        def create():
+            try:
+                self.create_record({'id': RECORD_ID}, if_none_match=True)
+            except Exception as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=create)
+        thread.start()
+        # The conditional creation waits for the other transaction.
+        time.sleep(0.2)
+        other.commit()
+        session.close()
+        thread.join()
+        self.assertIsInstance(errors[0], exceptions.ModifiedMeanwhileError)
+        # The transaction can go on.
+        self.assertEqual(self.storage.get(object_id=RECORD_ID, **self.storage_kw)['id'],
+                         RECORD_ID)
+
     def test_connection_is_rolledback_if_error_occurs(self):
         with self.storage.client.connect() as conn:
             query = "DELETE FROM metadata WHERE name = 'roll';"
@@ -167,3 +421,239 @@ class PostgreSQLStorageTest(StorageTest, unittest.TestCase):
                         'warnings.warn') as mocked:
             self.backend.load_from_config(self._get_config(settings=settings))
             mocked.assert_any_call(msg)
+
+    def test_collection_timestamp_is_read_without_write_once_initialized(self):
+        first = self.storage.collection_timestamp(**self.storage_kw)
+        with mock.patch.object(self.storage.client, 'connect',
+                               wraps=self.storage.client.connect) as mocked:
+            second = self.storage.collection_timestamp(**self.storage_kw)
+        self.assertEqual(first, second)
+        mocked.assert_called_once_with(readonly=True)
+
+
+@skip_if_no_postgresql
+class PostgreSQLTimestampsCacheTest(unittest.TestCase):
+    settings = load_default_settings('storage')
+
+    def setUp(self):
+        config = testing.setUp()
+        config.add_settings(self.settings)
+        storage = postgresql.load_from_config(config)
+        storage.initialize_schema()
+        self.cache = TimestampsCache(storage.client, poll_timeout=0.05)
+        self.storage = postgresql.Storage(client=storage.client,
+                                          max_fetch_size=10000,
+                                          timestamps_cache=self.cache)
+        self.storage_kw = dict(collection_id='test', parent_id='1234')
+        # Initialize the collection timestamp (never cached when written).
+        self.storage.collection_timestamp(**self.storage_kw)
+
+    def tearDown(self):
+        self.cache.stop()
+        self.storage.flush()
+
+    def wait_for_invalidation(self, previous):
+        for i in range(40):
+            if self.cache.get(**self.storage_kw) != previous:
+                return
+            time.sleep(0.05)
+
+    def test_timestamp_is_read_from_cache(self):
+        first = self.storage.collection_timestamp(**self.storage_kw)
+        with mock.patch.object(self.storage.client, 'connect') as mocked:
+            second = self.storage.collection_timestamp(**self.storage_kw)
+        self.assertEqual(first, second)
+        self.assertFalse(mocked.called)
+
+    def test_timestamp_is_invalidated_on_write(self):
+        before = self.storage.collection_timestamp(**self.storage_kw)
+        record = self.storage.create(record={'a': 1}, **self.storage_kw)
+        after = self.storage.collection_timestamp(**self.storage_kw)
+        self.assertNotEqual(before, after)
+        self.assertEqual(after, record['last_modified'])
+
+    def test_timestamp_is_invalidated_on_write_from_other_process(self):
+        before = self.storage.collection_timestamp(**self.storage_kw)
+        self.assertEqual(self.cache.get(**self.storage_kw), before)
+        query = """
+        INSERT INTO records (id, parent_id, collection_id, data)
+        VALUES ('abc', :parent_id, :collection_id, '{}');
+        """
+        with self.storage.client.connect() as conn:
+            conn.execute(query, self.storage_kw)
+        self.wait_for_invalidation(before)
+        after = self.storage.collection_timestamp(**self.storage_kw)
+        self.assertGreater(after, before)
+
+    def test_cache_is_bypassed_if_notifications_are_unavailable(self):
+        self.storage.collection_timestamp(**self.storage_kw)
+        self.cache._listening.clear()
+        self.assertIsNone(self.cache.get(**self.storage_kw))
+
+    def test_values_read_before_an_invalidation_are_not_stored(self):
+        generation = self.cache.generation()
+        self.cache.invalidate(**self.storage_kw)
+        self.cache.set(timestamp=42, generation=generation, **self.storage_kw)
+        self.assertIsNone(self.cache.get(**self.storage_kw))
+
+
+class StorageWithPermissionsTest(object):
+    backend = None
+    settings = {}
+    permission_backend = None
+    permission_settings = {}
+
+    def setUp(self):
+        super(StorageWithPermissionsTest, self).setUp()
+        self.storage = self.backend.load_from_config(
+            self._get_config(self.settings))
+        self.storage.initialize_schema()
+        self.permission = self.permission_backend.load_from_config(
+            self._get_config(self.permission_settings))
+        self.permission.initialize_schema()
+        self.storage_kw = dict(collection_id='test', parent_id='1234')
+        self.perm_kw = dict(permission_backend=self.permission,
+                            permission_object_id='/articles/%s' % RECORD_ID)
+
+    def _get_config(self, settings):
+        config = testing.setUp()
+        config.add_settings(settings)
+        return config
+
+    def tearDown(self):
+        super(StorageWithPermissionsTest, self).tearDown()
+        self.storage.flush()
+        self.permission.flush()
+
+    def create_record(self, record):
+        return self.storage.create(record=record, **self.storage_kw)
+
+    def test_get_with_permissions_returns_record_and_permissions(self):
+        self.create_record({'id': RECORD_ID, 'foo': 'bar'})
+        self.permission.add_principal_to_ace('/articles/%s' % RECORD_ID,
+                                             'read', 'alice')
+        record, permissions = self.storage.get_with_permissions(
+            object_id=RECORD_ID, **dict(self.perm_kw, **self.storage_kw))
+        self.assertEqual(record['foo'], 'bar')
+        self.assertEqual(permissions, {'read': {'alice'}})
+
+    def test_get_with_permissions_raises_if_record_is_missing(self):
+        self.assertRaises(exceptions.RecordNotFoundError,
+                          self.storage.get_with_permissions,
+                          object_id=RECORD_ID,
+                          **dict(self.perm_kw, **self.storage_kw))
+
+    def test_create_with_permissions_adds_owner_to_writers(self):
+        record, permissions = self.storage.create_with_permissions(
+            record={'foo': 'bar'},
+            permission_backend=self.permission,
+            get_permission_object_id=lambda _id: '/articles/%s' % _id,
+            permissions={'read': ['alice'], 'write': ['bob']},
+            owner='mat',
+            **self.storage_kw)
+        self.assertIn('id', record)
+        self.assertIn('last_modified', record)
+        self.assertEqual(permissions, {'read': {'alice'},
+                                       'write': {'bob', 'mat'}})
+        stored = self.permission.get_object_permissions(
+            '/articles/%s' % record['id'])
+        self.assertEqual(stored, permissions)
+
+    def test_update_with_permissions_only_replaces_specified_permissions(self):
+        self.create_record({'id': RECORD_ID, 'foo': 'bar'})
+        perm_object_id = '/articles/%s' % RECORD_ID
+        self.permission.add_principal_to_ace(perm_object_id, 'read', 'alice')
+        self.permission.add_principal_to_ace(perm_object_id, 'write', 'bob')
+        record, permissions = self.storage.update_with_permissions(
+            object_id=RECORD_ID,
+            record={'foo': 'baz'},
+            permissions={'write': []},
+            owner='mat',
+            **dict(self.perm_kw, **self.storage_kw))
+        self.assertEqual(record['foo'], 'baz')
+        self.assertEqual(permissions, {'read': {'alice'}, 'write': {'mat'}})
+        stored = self.storage.get(object_id=RECORD_ID, **self.storage_kw)
+        self.assertEqual(stored['last_modified'], record['last_modified'])
+
+    def test_update_with_permissions_creates_record_if_missing(self):
+        record, permissions = self.storage.update_with_permissions(
+            object_id=RECORD_ID,
+            record={'foo': 'baz'},
+            permissions={},
+            owner='mat',
+            **dict(self.perm_kw, **self.storage_kw))
+        stored = self.storage.get(object_id=RECORD_ID, **self.storage_kw)
+        self.assertEqual(stored, record)
+        self.assertEqual(permissions, {'write': {'mat'}})
+
+    def test_update_with_permissions_leaves_permissions_if_not_matching(self):
+        stored = self.create_record({'id': RECORD_ID, 'foo': 'bar'})
+        perm_object_id = '/articles/%s' % RECORD_ID
+        self.permission.add_principal_to_ace(perm_object_id, 'write', 'bob')
+        self.assertRaises(exceptions.ModifiedMeanwhileError,
+                          self.storage.update_with_permissions,
+                          object_id=RECORD_ID,
+                          record={'foo': 'baz'},
+                          permissions={'write': []},
+                          owner='mat',
+                          if_match=stored['last_modified'] - 1,
+                          **dict(self.perm_kw, **self.storage_kw))
+        permissions = self.permission.get_object_permissions(perm_object_id)
+        self.assertEqual(permissions, {'write': {'bob'}})
+
+
+class MemoryStorageWithPermissionsTest(StorageWithPermissionsTest,
+                                       unittest.TestCase):
+    backend = memory
+    permission_backend = memory_permission
+
+
+@skip_if_no_postgresql
+class PostgreSQLStorageWithPermissionsTest(StorageWithPermissionsTest,
+                                           unittest.TestCase):
+    backend = postgresql
+    settings = load_default_settings('storage')
+    permission_backend = postgresql_permission
+    permission_settings = load_default_settings('permission')
+
+    def test_storage_and_permission_backends_share_client(self):
+        self.assertIs(self.storage.client, self.permission.client)
+
+    def test_permission_backend_is_not_queried_if_client_is_shared(self):
+        self.create_record({'id': RECORD_ID})
+        with mock.patch.object(self.permission,
+                               'get_object_permissions') as mocked:
+            self.storage.get_with_permissions(
+                object_id=RECORD_ID, **dict(self.perm_kw, **self.storage_kw))
+            self.storage.update_with_permissions(
+                object_id=RECORD_ID, record={}, permissions={}, owner='mat',
+                **dict(self.perm_kw, **self.storage_kw))
+        self.assertFalse(mocked.called)
+
+
+@skip_if_no_postgresql
+class ShardedStorageWithPermissionsTest(StorageWithPermissionsTest,
+                                        unittest.TestCase):
+    backend = sharded
+    permission_backend = sharded_permission
+
+    def setUp(self):
+        # Both shards are in the same database, to run the tests.
+        settings = load_default_settings('storage')
+        url = settings['storage_url']
+        shards = {'storage_shards': 'a=%s b=%s' % (url, url)}
+        self.settings = dict(settings, **shards)
+        self.permission_settings = dict(load_default_settings('permission'),
+                                        **shards)
+        super(ShardedStorageWithPermissionsTest, self).setUp()
+
+    def test_shards_are_given_their_colocated_permission_backend(self):
+        storage_shard = self.storage.shards['a']
+        permission_shard = self.permission.shards['a']
+        self.assertIs(storage_shard.client, permission_shard.client)
+        with mock.patch.object(permission_shard,
+                               'get_object_permissions') as mocked:
+            self.create_record({'id': RECORD_ID})
+            self.storage.get_with_permissions(
+                object_id=RECORD_ID, **dict(self.perm_kw, **self.storage_kw))
+        self.assertFalse(mocked.called)
@@ -157,40 +157,54 @@ class PostgresqlStorageMigrationTest(unittest.TestCase):
         version = self.storage._get_installed_version()
         self.assertEqual(version, self.version)
 
-    def test_migration_12_clean_tombstones(self):
-        self._delete_everything()
-        postgresql_storage.Storage.schema_version = 11
-        self.storage.initialize_schema()
-        # Set the schema version back to 11 in the base as well
+    def _set_installed_version(self, version):
         with self.storage.client.connect() as conn:
             query = """
-            UPDATE metadata SET value = '11'
+            UPDATE metadata SET value = :version
             WHERE name = 'storage_schema_version';
             """
-            conn.execute(query)
-        r = self.storage.create('test', 'jean-louis', {'drink': 'mate'})
-        self.storage.delete('test', 'jean-louis', r['id'])
+            conn.execute(query, dict(version=str(version)))
 
-        # Insert back the record without removing the tombstone.
+    def _create_deleted_table(self, tombstones):
+        # Tombstones were stored in a separate table until version 17.
         with self.storage.client.connect() as conn:
             query = """
-            INSERT INTO records (id, parent_id, collection_id,
-                                 data, last_modified)
+            CREATE TABLE deleted (
+                id TEXT NOT NULL,
+                parent_id TEXT NOT NULL,
+                collection_id TEXT NOT NULL,
+                last_modified TIMESTAMP NOT NULL,
+
+                PRIMARY KEY (id, parent_id, collection_id)
+            );
+            """
+            conn.execute(query)
+            query = """
+            INSERT INTO deleted (id, parent_id, collection_id, last_modified)
             VALUES (:id, :parent_id, :collection_id,
-                    (:data)::JSONB, from_epoch(:last_modified));
+                    from_epoch(:last_modified));
+            """
+            for tombstone in tombstones:
+                conn.execute(query, tombstone)
+            query = """
+            CREATE TRIGGER tgr_deleted_last_modified
+            BEFORE INSERT ON deleted
+            FOR EACH ROW EXECUTE PROCEDURE bump_timestamp();
             """
-            placeholders = dict(id=r['id'],
-                                collection_id='test',
-                                parent_id='jean-louis',
-                                data=json.dumps({'drink': 'mate'}),
-                                last_modified=1468400666777)
-            conn.execute(query, placeholders)
+            conn.execute(query)
 
-        records, count = self.storage.get_all('test', 'jean-louis',
-                                              include_deleted=True)
-        # Check that we have the tombstone
-        assert len(records) == 2
-        assert count == 1
+    def test_migration_12_clean_tombstones(self):
+        self._delete_everything()
+        postgresql_storage.Storage.schema_version = 11
+        self.storage.initialize_schema()
+        # Set the schema version back to 11 in the base as well
+        self._set_installed_version(11)
+        r = self.storage.create('test', 'jean-louis', {'drink': 'mate'})
+        # Keep a rotten tombstone of the record.
+        self._create_deleted_table([dict(id=r['id'],
+                                         collection_id='test',
+                                         parent_id='jean-louis',
+                                         last_modified=1468400666777)])
 
         # Execute the 011 to 012 migration
         postgresql_storage.Storage.schema_version = 12
@@ -203,6 +217,153 @@ class PostgresqlStorageMigrationTest(unittest.TestCase):
         assert len(records) == 1
         assert count == 1
 
+    def test_migration_17_moves_tombstones_to_records_table(self):
+        self._delete_everything()
+        postgresql_storage.Storage.schema_version = 16
+        self.storage.initialize_schema()
+        self._set_installed_version(16)
+        r = self.storage.create('test', 'jean-louis', {'drink': 'mate'})
+        timestamp = self.storage.collection_timestamp('test', 'jean-louis')
+        self._create_deleted_table([
+            dict(id='abc', collection_id='test', parent_id='jean-louis',
+                 last_modified=1468400666777),
+            # Same timestamp as the record.
+            dict(id='def', collection_id='test', parent_id='jean-louis',
+                 last_modified=r['last_modified']),
+            # Tombstone of an existing record.
+            dict(id=r['id'], collection_id='test', parent_id='jean-louis',
+                 last_modified=1468400666778)])
+
+        postgresql_storage.Storage.schema_version = 17
+        self.storage.initialize_schema()
+
+        records, count = self.storage.get_all('test', 'jean-louis',
+                                              include_deleted=True)
+        assert count == 1
+        by_id = dict([(record['id'], record) for record in records])
+        assert sorted(by_id.keys()) == sorted(['abc', 'def', r['id']])
+        assert by_id[r['id']] == r
+        assert by_id['abc'] == {'id': 'abc', 'deleted': True,
+                                'last_modified': 1468400666777}
+        # The colliding tombstone got a new timestamp.
+        assert by_id['def']['last_modified'] > r['last_modified']
+        # The collection timestamp is only bumped by the latter.
+        new_timestamp = self.storage.collection_timestamp('test',
+                                                          'jean-louis')
+        assert new_timestamp == by_id['def']['last_modified']
+        assert new_timestamp > timestamp
+
+        # The deleted table is kept, for processes not restarted yet.
+        with self.storage.client.connect() as conn:
+            query = "SELECT tablename FROM pg_tables WHERE tablename = 'deleted';"
+            result = conn.execute(query)
+            assert result.rowcount == 1
+
+    def test_migration_17_copies_tombstones_written_by_previous_versions(self):
+        self._delete_everything()
+        postgresql_storage.Storage.schema_version = 16
+        self.storage.initialize_schema()
+        self._set_installed_version(16)
+        self._create_deleted_table([])
+        postgresql_storage.Storage.schema_version = 17
+        self.storage.initialize_schema()
+
+        # Deletion by a previous version.
+        r = self.storage.create('test', 'jean-louis', {'drink': 'mate'})
+        with self.storage.client.connect() as conn:
+            query = """
+            WITH deleted_record AS (
+                DELETE FROM records
+                 WHERE id = :id
+                   AND parent_id = 'jean-louis'
+                   AND collection_id = 'test'
+                RETURNING id
+            )
+            INSERT INTO deleted (id, parent_id, collection_id)
+            SELECT id, 'jean-louis', 'test'
+              FROM deleted_record;
+            """
+            conn.execute(query, dict(id=r['id']))
+
+        records, _ = self.storage.get_all('test', 'jean-louis',
+                                          include_deleted=True)
+        assert len(records) == 1
+        assert records[0]['deleted']
+        assert records[0]['last_modified'] > r['last_modified']
+        timestamp = self.storage.collection_timestamp('test', 'jean-louis')
+        assert timestamp == records[0]['last_modified']
+
+    def test_migration_17_builds_the_live_records_index(self):
+        self._delete_everything()
+        postgresql_storage.Storage.schema_version = 16
+        self.storage.initialize_schema()
+        self._set_installed_version(16)
+        name = 'idx_records_live_parent_id_collection_id_last_modified'
+        with self.storage.client.connect() as conn:
+            conn.execute('DROP INDEX %s;' % name)
+
+        postgresql_storage.Storage.schema_version = 17
+        self.storage.initialize_schema()
+
+        with self.storage.client.connect() as conn:
+            query = """
+            SELECT i.indisvalid
+              FROM pg_index AS i
+              JOIN pg_class AS c ON c.oid = i.indexrelid
+             WHERE c.relname = :name;
+            """
+            result = conn.execute(query, dict(name=name))
+            assert result.fetchone()[0]
+
+    def _count_partitions(self):
+        with self.storage.client.connect() as conn:
+            query = """
+            SELECT COUNT(*)
+              FROM pg_inherits
+             WHERE inhparent = 'records'::REGCLASS;
+            """
+            result = conn.execute(query)
+            return result.fetchone()[0]
+
+    def test_records_table_can_be_partitioned(self):
+        # Leave an unpartitioned schema to other tests.
+        self.addCleanup(self.storage.initialize_schema)
+        self.addCleanup(self._delete_everything)
+
+        r = self.storage.create('test', 'jean-louis', {'drink': 'mate'})
+        tombstone = self.storage.create('test', 'jean-louis', {})
+        tombstone = self.storage.delete('test', 'jean-louis', tombstone['id'])
+
+        config = testing.setUp()
+        config.add_settings(dict(self.settings, storage_partitions='4'))
+        partitioned = postgresql_storage.load_from_config(config)
+        partitioned.initialize_schema()
+        self.assertEqual(self._count_partitions(), 4)
+
+        # Rows were copied with their timestamps.
+        records, count = partitioned.get_all('test', 'jean-louis',
+                                             include_deleted=True)
+        self.assertEqual(count, 1)
+        self.assertEqual(sorted(records, key=lambda x: x['last_modified']),
+                         [r, tombstone])
+
+        # Timestamps are still bumped.
+        created = partitioned.create('test', 'jean-louis', {'drink': 'tea'})
+        self.assertGreater(created['last_modified'], tombstone['last_modified'])
+        deleted = partitioned.delete_all('test', 'jean-*')
+        self.assertEqual(len(deleted), 2)
+
+        # Running again is a no-op, changing the number repartitions.
+        partitioned.initialize_schema()
+        self.assertEqual(self._count_partitions(), 4)
+        partitioned._partitions = 2
+        partitioned.initialize_schema()
+        self.assertEqual(self._count_partitions(), 2)
+        records, count = partitioned.get_all('test', 'jean-louis',
+                                             include_deleted=True)
+        self.assertEqual(len(records), 3)
+        self.assertEqual(count, 0)
+
 
 @skip_if_no_postgresql
 class PostgresqlPermissionMigrationTest(unittest.TestCase):
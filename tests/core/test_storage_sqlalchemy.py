@@ -0,0 +1,427 @@
+import datetime
+import mock
+import transaction
+from pyramid_sqlalchemy import Session, init_sqlalchemy
+from sqlalchemy import Column, DateTime, String, Integer
+from sqlalchemy.orm import configure_mappers
+
+from kinto.core.utils import sqlalchemy, COMPARISON
+from kinto.core.storage import exceptions, Filter, Sort
+from kinto.core.testing import unittest, skip_if_no_postgresql, load_default_settings
+
+if sqlalchemy is not None:
+    from kinto.core.resource.sqlalchemy import Base
+    from kinto.core.storage.sqlalchemy import (Deleted, Storage, Timestamps, bump_timestamps,
+                                               _bind_filters)
+    from kinto.core.storage.sqlalchemy.generators import IntegerId, ID_BLOCK_SIZE
+
+    class Article(Base):
+        __tablename__ = 'article'
+        title = Column(String(), unique=True)
+        views = Column(Integer())
+        # The backend stores the dates of modification.
+        last_modified = Column(DateTime(), nullable=False, default=datetime.datetime.utcnow)
+
+
+@skip_if_no_postgresql
+class SQLAlchemyStorageTest(unittest.TestCase):
+    # The tables of the SQLAlchemy backend would clash with the ones of the
+    # PostgreSQL backend in the test database: keep them in their own schema.
+    schema = 'sqlalchemy_storage_tests'
+
+    @classmethod
+    def setUpClass(cls):
+        settings = load_default_settings('storage')
+        url = settings['storage_url']
+        with sqlalchemy.create_engine(url).begin() as connection:
+            connection.execute('CREATE SCHEMA IF NOT EXISTS {}'.format(cls.schema))
+        cls.engine = sqlalchemy.create_engine(
+            url, connect_args={'options': '-csearch_path={}'.format(cls.schema)})
+        init_sqlalchemy(cls.engine)
+        configure_mappers()
+        cls.storage = Storage()
+        cls.storage.collection = Article
+        cls.storage.initialize_schema()
+
+    @classmethod
+    def tearDownClass(cls):
+        Session.remove()
+        cls.engine.dispose()
+        url = load_default_settings('storage')['storage_url']
+        with sqlalchemy.create_engine(url).begin() as connection:
+            connection.execute('DROP SCHEMA {} CASCADE'.format(cls.schema))
+
+    def setUp(self):
+        transaction.begin()
+        self.addCleanup(transaction.abort)
+        self.storage_kw = dict(collection_id='article', parent_id='/blogs/a')
+
+    def create(self, **record):
+        return self.storage.create(record=record, **self.storage_kw)
+
+
+class IntegerIdTest(SQLAlchemyStorageTest):
+    def test_blocks_are_as_large_as_the_sequence_increment(self):
+        Session.execute('ALTER SEQUENCE objects_id_seq INCREMENT BY 2')
+        self.addCleanup(Session.execute,
+                        'ALTER SEQUENCE objects_id_seq INCREMENT BY {}'.format(ID_BLOCK_SIZE))
+        generator = IntegerId()
+        ids = [int(generator()) for _ in range(3)]
+        self.assertEqual(ids, [ids[0], ids[0] + 1, ids[0] + 2])
+        # Another process gets the block after the two reserved ones.
+        self.assertEqual(int(IntegerId()()), ids[2] + 2)
+
+    def test_created_objects_get_ids_from_reserved_blocks(self):
+        with mock.patch.object(Article, 'id_generator', IntegerId()):
+            first = self.create(title='first')
+            second = self.create(title='second')
+        self.assertEqual(second['id'], first['id'] + 1)
+
+    def test_duplicate_ids_raise_unicity_errors(self):
+        article = self.create(title='first')
+        with self.assertRaises(exceptions.UnicityError) as cm:
+            self.create(id=article['id'], title='second')
+        self.assertEqual(cm.exception.field, 'id')
+
+
+class BindFiltersTest(unittest.TestCase):
+    def test_values_are_bound_and_left_out_of_the_shape(self):
+        params = {}
+        filters = [Filter('title', 'a', COMPARISON.EQ), Filter('views', [1, 2], COMPARISON.IN)]
+        shape = _bind_filters('filter', filters, params)
+        self.assertEqual(params, {'filter_0': 'a', 'filter_1': [1, 2]})
+        self.assertEqual(shape, (('title', 'filter_0', COMPARISON.EQ),
+                                 ('views', 'filter_1', COMPARISON.IN)))
+
+    def test_same_filters_with_other_values_have_the_same_shape(self):
+        first = _bind_filters('filter', [Filter('title', 'a', COMPARISON.EQ)], {})
+        second = _bind_filters('filter', [Filter('title', 'b', COMPARISON.EQ)], {})
+        self.assertEqual(first, second)
+
+
+class GetTest(SQLAlchemyStorageTest):
+    def test_get_returns_the_object(self):
+        article = self.create(title='first', views=3)
+        retrieved = self.storage.get(object_id=article['id'], **self.storage_kw)
+        self.assertEqual(retrieved, article)
+
+    def test_get_raises_not_found_for_unknown_ids(self):
+        with self.assertRaises(exceptions.RecordNotFoundError):
+            self.storage.get(object_id=0, **self.storage_kw)
+
+    def test_get_raises_not_found_for_deleted_objects(self):
+        article = self.create(title='first')
+        self.storage.delete(object_id=article['id'], **self.storage_kw)
+        with self.assertRaises(exceptions.RecordNotFoundError):
+            self.storage.get(object_id=article['id'], **self.storage_kw)
+
+    def test_get_sees_objects_pending_in_the_session(self):
+        article = self.create(title='first')
+        self.assertEqual(Session.query(Article).filter_by(title='first').count(), 1)
+        retrieved = self.storage.get(object_id=article['id'], **self.storage_kw)
+        self.assertEqual(retrieved['title'], 'first')
+
+    def test_statements_are_built_once(self):
+        first = self.create(title='first')
+        second = self.create(title='second')
+        self.storage.get(object_id=first['id'], **self.storage_kw)
+        statements = len(self.storage._statements)
+        retrieved = self.storage.get(object_id=second['id'], **self.storage_kw)
+        self.assertEqual(retrieved['title'], 'second')
+        self.assertEqual(len(self.storage._statements), statements)
+
+
+class DeleteTest(SQLAlchemyStorageTest):
+    def tombstones(self):
+        return Session.query(Deleted).filter_by(parent_id='/blogs/a').all()
+
+    def test_delete_returns_a_tombstone(self):
+        article = self.create(title='first')
+        deleted = self.storage.delete(object_id=article['id'], **self.storage_kw)
+        self.assertEqual(deleted['id'], article['id'])
+        self.assertTrue(deleted['deleted'])
+        self.assertIn('last_modified', deleted)
+
+    def test_delete_stores_a_tombstone(self):
+        article = self.create(title='first')
+        self.storage.delete(object_id=article['id'], **self.storage_kw)
+        tombstones = self.tombstones()
+        self.assertEqual([t.id for t in tombstones], [article['id']])
+        self.assertEqual(tombstones[0].collection_id, 'article')
+
+    def test_delete_can_skip_the_tombstone(self):
+        article = self.create(title='first')
+        self.storage.delete(object_id=article['id'], with_deleted=False, **self.storage_kw)
+        self.assertEqual(self.tombstones(), [])
+        with self.assertRaises(exceptions.RecordNotFoundError):
+            self.storage.get(object_id=article['id'], **self.storage_kw)
+
+    def test_delete_raises_not_found_for_deleted_objects(self):
+        article = self.create(title='first')
+        self.storage.delete(object_id=article['id'], **self.storage_kw)
+        with self.assertRaises(exceptions.RecordNotFoundError):
+            self.storage.delete(object_id=article['id'], **self.storage_kw)
+
+    def test_delete_bumps_the_collection_timestamp(self):
+        article = self.create(title='first')
+        before = self.storage.collection_timestamp(**self.storage_kw)
+        self.storage.delete(object_id=article['id'], **self.storage_kw)
+        after = self.storage.collection_timestamp(**self.storage_kw)
+        self.assertGreater(after, before)
+
+    def test_delete_all_deletes_the_filtered_objects(self):
+        self.create(title='first', views=1)
+        kept = self.create(title='second', views=5)
+        deleted = self.storage.delete_all(filters=[Filter('views', 3, COMPARISON.LT)],
+                                          **self.storage_kw)
+        self.assertEqual(len(deleted), 1)
+        records, count = self.storage.get_all(**self.storage_kw)
+        self.assertEqual(records, [kept])
+        self.assertEqual(len(self.tombstones()), 1)
+
+    def test_delete_all_uses_the_values_of_cached_statements(self):
+        self.create(title='first')
+        self.create(title='second')
+        for title in ('first', 'second'):
+            self.storage.delete_all(filters=[Filter('title', title, COMPARISON.EQ)],
+                                    **self.storage_kw)
+        records, count = self.storage.get_all(**self.storage_kw)
+        self.assertEqual(records, [])
+
+
+class FiltersTest(SQLAlchemyStorageTest):
+    def setUp(self):
+        super(FiltersTest, self).setUp()
+        self.first = self.create(title='first', views=1)
+        self.second = self.create(title='second', views=5)
+        self.third = self.create(title='third', views=10)
+
+    def titles(self, *filters):
+        records, _ = self.storage.get_all(filters=list(filters),
+                                          sorting=[Sort('views', 1)], **self.storage_kw)
+        return [r['title'] for r in records]
+
+    def test_filters_by_equality(self):
+        self.assertEqual(self.titles(Filter('title', 'second', COMPARISON.EQ)), ['second'])
+
+    def test_filters_by_comparison(self):
+        self.assertEqual(self.titles(Filter('views', 5, COMPARISON.MIN)), ['second', 'third'])
+        self.assertEqual(self.titles(Filter('views', 5, COMPARISON.LT)), ['first'])
+
+    def test_filters_by_inclusion_and_exclusion(self):
+        self.assertEqual(self.titles(Filter('views', [1, 10], COMPARISON.IN)), ['first', 'third'])
+        self.assertEqual(self.titles(Filter('views', [1, 10], COMPARISON.EXCLUDE)), ['second'])
+
+    def test_filters_are_combined(self):
+        filters = (Filter('views', 1, COMPARISON.GT), Filter('views', 10, COMPARISON.LT))
+        self.assertEqual(self.titles(*filters), ['second'])
+
+    def test_cached_statements_are_given_the_new_values(self):
+        self.assertEqual(self.titles(Filter('title', 'first', COMPARISON.EQ)), ['first'])
+        self.assertEqual(self.titles(Filter('title', 'third', COMPARISON.EQ)), ['third'])
+        self.assertEqual(self.titles(Filter('views', [5], COMPARISON.IN)), ['second'])
+        self.assertEqual(self.titles(Filter('views', [1, 5], COMPARISON.IN)), ['first', 'second'])
+
+    def test_sorting_is_applied(self):
+        records, _ = self.storage.get_all(sorting=[Sort('views', -1)], **self.storage_kw)
+        self.assertEqual([r['title'] for r in records], ['third', 'second', 'first'])
+
+    def test_fields_are_projected(self):
+        records, _ = self.storage.get_all(fields=['title'], sorting=[Sort('views', 1)],
+                                          **self.storage_kw)
+        self.assertEqual(records[0], {'id': self.first['id'],
+                                      'last_modified': self.first['last_modified'],
+                                      'title': 'first'})
+
+    def test_only_the_columns_of_the_fields_are_selected(self):
+        with mock.patch.object(self.storage, '_execute', wraps=self.storage._execute) as execute:
+            self.storage.get_all(fields=['title'], **self.storage_kw)
+        query = execute.call_args_list[0][0][0]
+        self.assertNotIn('views', query.c.keys())
+        self.assertIn('title', query.c.keys())
+
+
+class GetAllTest(SQLAlchemyStorageTest):
+    def setUp(self):
+        super(GetAllTest, self).setUp()
+        self.first = self.create(title='first', views=1)
+        self.second = self.create(title='second', views=5)
+        self.third = self.create(title='third', views=10)
+
+    def get_all(self, **kwargs):
+        kwargs.setdefault('sorting', [Sort('views', 1)])
+        records, count = self.storage.get_all(**dict(self.storage_kw, **kwargs))
+        return [r.get('title', r['id']) for r in records], count
+
+    def test_objects_are_scoped_by_parent(self):
+        other = self.storage.create(collection_id='article', parent_id='/blogs/b',
+                                    record={'title': 'other'})
+        self.assertEqual(self.get_all(), (['first', 'second', 'third'], 3))
+        self.assertEqual(self.get_all(parent_id='/blogs/b'), (['other'], 1))
+        self.assertEqual(self.get_all(parent_id='/blogs/c'), ([], 0))
+        self.storage.delete(object_id=other['id'], collection_id='article', parent_id='/blogs/b')
+        self.assertEqual(self.get_all(), (['first', 'second', 'third'], 3))
+
+    def test_pagination_rules_are_combined_with_or(self):
+        rules = [[Filter('views', 1, COMPARISON.EQ)], [Filter('views', 10, COMPARISON.EQ)]]
+        titles, _ = self.get_all(pagination_rules=rules)
+        self.assertEqual(titles, ['first', 'third'])
+
+    def test_filters_of_a_pagination_rule_are_combined_with_and(self):
+        rules = [[Filter('views', 1, COMPARISON.GT), Filter('views', 10, COMPARISON.LT)],
+                 [Filter('title', 'first', COMPARISON.EQ)]]
+        titles, _ = self.get_all(pagination_rules=rules)
+        self.assertEqual(titles, ['first', 'second'])
+
+    def test_pagination_rules_apply_on_top_of_filters(self):
+        rules = [[Filter('views', 1, COMPARISON.EQ)], [Filter('views', 10, COMPARISON.EQ)]]
+        titles, _ = self.get_all(filters=[Filter('views', 5, COMPARISON.MIN)],
+                                 pagination_rules=rules)
+        self.assertEqual(titles, ['third'])
+
+    def test_count_ignores_pagination_rules_and_limit(self):
+        rules = [[Filter('views', 5, COMPARISON.GT)]]
+        self.assertEqual(self.get_all(pagination_rules=rules), (['third'], 3))
+        self.assertEqual(self.get_all(limit=1), (['first'], 3))
+
+    def test_count_takes_filters_into_account(self):
+        filters = [Filter('views', 5, COMPARISON.MIN)]
+        self.assertEqual(self.get_all(filters=filters, limit=1), (['second'], 2))
+        self.assertEqual(self.get_all(filters=filters), (['second', 'third'], 2))
+
+    def test_deleted_objects_are_excluded_by_default(self):
+        self.storage.delete(object_id=self.second['id'], **self.storage_kw)
+        self.assertEqual(self.get_all(), (['first', 'third'], 2))
+
+    def test_deleted_objects_are_included_as_tombstones(self):
+        deleted = self.storage.delete(object_id=self.second['id'], **self.storage_kw)
+        records, count = self.storage.get_all(include_deleted=True, sorting=[Sort('views', 1)],
+                                              **self.storage_kw)
+        self.assertEqual(count, 2)
+        self.assertEqual(len(records), 3)
+        self.assertEqual(records[1], {'id': self.second['id'],
+                                      'last_modified': deleted['last_modified'],
+                                      'deleted': True})
+
+    def test_count_excludes_tombstones_of_pages(self):
+        self.storage.delete(object_id=self.second['id'], **self.storage_kw)
+        rules = [[Filter('views', 1, COMPARISON.GT)]]
+        records, count = self.storage.get_all(include_deleted=True, pagination_rules=rules,
+                                              limit=1, sorting=[Sort('views', 1)],
+                                              **self.storage_kw)
+        self.assertEqual(records[0]['id'], self.second['id'])
+        self.assertEqual(count, 2)
+
+
+class BumpTimestampsTest(SQLAlchemyStorageTest):
+    def timestamp(self, parent_id='/blogs/a', collection_id='article'):
+        timestamp = Session.query(Timestamps).get((parent_id, collection_id))
+        return timestamp and timestamp.last_modified
+
+    def test_timestamps_are_created_for_unknown_collections(self):
+        bump_timestamps(Session, [('/blogs/a', 'article'), ('/blogs/b', 'article')])
+        self.assertIsNotNone(self.timestamp())
+        self.assertIsNotNone(self.timestamp(parent_id='/blogs/b'))
+
+    def test_nothing_is_executed_without_keys(self):
+        with mock.patch.object(Session, 'execute') as execute:
+            bump_timestamps(Session, [])
+        self.assertFalse(execute.called)
+
+    def test_timestamps_increase_within_the_same_transaction(self):
+        bump_timestamps(Session, [('/blogs/a', 'article')])
+        before = self.timestamp()
+        Session.expire_all()
+        bump_timestamps(Session, [('/blogs/a', 'article'), ('/blogs/b', 'article')])
+        after = self.timestamp()
+        self.assertGreaterEqual(after - before, datetime.timedelta(milliseconds=1))
+
+    def test_only_the_specified_collections_are_bumped(self):
+        bump_timestamps(Session, [('/blogs/a', 'article'), ('/blogs/b', 'article')])
+        before = self.timestamp(parent_id='/blogs/b')
+        Session.expire_all()
+        bump_timestamps(Session, [('/blogs/a', 'article')])
+        self.assertEqual(self.timestamp(parent_id='/blogs/b'), before)
+
+    def test_flushes_bump_the_collections_of_the_changed_objects(self):
+        self.create(title='first')
+        self.storage.create(collection_id='article', parent_id='/blogs/b',
+                            record={'title': 'other'})
+        Session.flush()
+        self.assertIsNotNone(self.timestamp())
+        self.assertIsNotNone(self.timestamp(parent_id='/blogs/b'))
+        self.assertIsNone(self.timestamp(parent_id='/blogs/c'))
+
+    def test_collection_timestamp_increases_with_every_change(self):
+        article = self.create(title='first')
+        first = self.storage.collection_timestamp(**self.storage_kw)
+        self.storage.update(object_id=article['id'], object={'title': 'renamed'},
+                            **self.storage_kw)
+        Session.flush()
+        second = self.storage.collection_timestamp(**self.storage_kw)
+        self.assertGreater(second, first)
+
+
+class PurgeDeletedTest(SQLAlchemyStorageTest):
+    def setUp(self):
+        super(PurgeDeletedTest, self).setUp()
+        self.epoch = datetime.datetime(2017, 1, 1)
+        for i in range(5):
+            self.add_tombstone(i, last_modified=self.epoch + datetime.timedelta(seconds=i))
+        self.add_tombstone(0, parent_id='/blogs/b')
+        self.add_tombstone(0, collection_id='comment')
+        Session.flush()
+
+    def add_tombstone(self, object_id, parent_id='/blogs/a', collection_id='article',
+                      last_modified=None):
+        Session.add(Deleted(id=object_id, parent_id=parent_id, collection_id=collection_id,
+                            last_modified=last_modified or self.epoch))
+
+    def tombstones(self, **filters):
+        return Session.query(Deleted).filter_by(**filters).count()
+
+    def purge(self, **kwargs):
+        return self.storage.purge_deleted(**dict(self.storage_kw, **kwargs))
+
+    def test_tombstones_of_the_collection_are_purged(self):
+        self.assertEqual(self.purge(), 5)
+        self.assertEqual(self.tombstones(parent_id='/blogs/a', collection_id='article'), 0)
+        self.assertEqual(self.tombstones(), 2)
+
+    def test_tombstones_are_purged_by_chunks(self):
+        with mock.patch.object(self.storage, 'purge_chunk_size', 2):
+            with mock.patch.object(Session, 'execute', wraps=Session.execute) as execute:
+                self.assertEqual(self.purge(), 5)
+        self.assertEqual(execute.call_count, 3)
+        self.assertEqual(self.tombstones(parent_id='/blogs/a', collection_id='article'), 0)
+
+    def test_a_full_last_chunk_is_followed_by_an_empty_one(self):
+        with mock.patch.object(self.storage, 'purge_chunk_size', 5):
+            with mock.patch.object(Session, 'execute', wraps=Session.execute) as execute:
+                self.assertEqual(self.purge(), 5)
+        self.assertEqual(execute.call_count, 2)
+
+    def test_limit_stops_the_purge_within_a_chunk(self):
+        with mock.patch.object(self.storage, 'purge_chunk_size', 2):
+            self.assertEqual(self.purge(limit=3), 3)
+        self.assertEqual(self.tombstones(parent_id='/blogs/a', collection_id='article'), 2)
+
+    def test_limit_can_be_a_multiple_of_the_chunk_size(self):
+        with mock.patch.object(self.storage, 'purge_chunk_size', 2):
+            with mock.patch.object(Session, 'execute', wraps=Session.execute) as execute:
+                self.assertEqual(self.purge(limit=4), 4)
+        self.assertEqual(execute.call_count, 2)
+
+    def test_only_tombstones_older_than_before_are_purged(self):
+        before = (self.epoch + datetime.timedelta(seconds=2)).replace(
+            tzinfo=datetime.timezone.utc).timestamp() * 1000
+        self.assertEqual(self.purge(before=before), 2)
+        self.assertEqual(self.tombstones(parent_id='/blogs/a', collection_id='article'), 3)
+
+    def test_parents_can_be_matched_with_wildcards(self):
+        self.assertEqual(self.purge(parent_id='/blogs/*'), 6)
+        self.assertEqual(self.tombstones(collection_id='article'), 0)
+
+    def test_every_collection_is_purged_without_collection_id(self):
+        self.assertEqual(self.purge(collection_id=None), 6)
+        self.assertEqual(self.tombstones(), 1)
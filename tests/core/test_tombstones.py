@@ -0,0 +1,92 @@
+import mock
+
+from kinto.core.storage import memory
+from kinto.core.testing import unittest
+from kinto.core.tombstones import TombstonesRetention
+from kinto.core.utils import msec_time
+
+
+class TombstonesRetentionTest(unittest.TestCase):
+    def setUp(self):
+        self.storage = memory.Storage()
+        self.retention = TombstonesRetention(self.storage, chunk_size=2,
+                                             refresh=0)
+        self.storage_kw = dict(collection_id='test', parent_id='abc')
+        for i in range(5):
+            record = self.storage.create(record={}, **self.storage_kw)
+            self.storage.delete(object_id=record['id'], **self.storage_kw)
+
+    def test_watermark_is_none_if_never_purged(self):
+        self.assertIsNone(self.retention.watermark())
+
+    def test_purge_removes_tombstones_older_than_retention(self):
+        purged = self.retention.purge(older_than=-1)
+        self.assertEqual(purged, 5)
+        records, _ = self.storage.get_all(include_deleted=True,
+                                          **self.storage_kw)
+        self.assertEqual(len(records), 0)
+
+    def test_purge_keeps_recent_tombstones(self):
+        purged = self.retention.purge(older_than=3600)
+        self.assertEqual(purged, 0)
+
+    def test_purge_removes_tombstones_by_chunks(self):
+        with mock.patch.object(self.storage, 'purge_deleted',
+                               wraps=self.storage.purge_deleted) as mocked:
+            self.retention.purge(older_than=-1)
+        self.assertEqual(mocked.call_count, 3)
+        self.assertEqual(mocked.call_args[1]['limit'], 2)
+
+    def test_purge_sets_the_watermark(self):
+        with mock.patch('kinto.core.tombstones.msec_time', return_value=42000):
+            self.retention.purge(older_than=2)
+        self.assertEqual(self.retention.watermark(), 40000)
+
+    def test_watermark_never_goes_backward(self):
+        with mock.patch('kinto.core.tombstones.msec_time', return_value=42000):
+            self.retention.purge(older_than=2)
+            self.retention.purge(older_than=10)
+        self.assertEqual(self.retention.watermark(), 40000)
+
+    def test_watermark_is_cached_until_refreshed(self):
+        self.retention.refresh = 60
+        self.retention.watermark()
+        with mock.patch.object(self.storage, 'get') as mocked:
+            self.retention.watermark()
+            self.assertFalse(mocked.called)
+            later = msec_time() + 60000
+            with mock.patch('kinto.core.tombstones.msec_time',
+                            return_value=later):
+                self.retention.watermark()
+        self.assertTrue(mocked.called)
+
+    def test_purge_waits_for_processes_to_refresh_the_watermark(self):
+        with mock.patch('kinto.core.tombstones.threading.Event') as mocked:
+            retention = TombstonesRetention(self.storage, refresh=30)
+            mocked.return_value.wait.return_value = False
+            self.assertEqual(retention.purge(older_than=-1), 5)
+        mocked.return_value.wait.assert_called_with(30)
+
+    def test_purge_does_not_wait_if_the_watermark_is_unchanged(self):
+        with mock.patch('kinto.core.tombstones.msec_time', return_value=42000):
+            self.retention.purge(older_than=2)
+            with mock.patch('kinto.core.tombstones.threading.Event') as mocked:
+                retention = TombstonesRetention(self.storage, refresh=30)
+                retention.purge(older_than=10)
+        self.assertFalse(mocked.return_value.wait.called)
+
+    def test_purge_is_aborted_if_stopped_while_waiting(self):
+        self.retention.stop()
+        self.assertEqual(self.retention.purge(older_than=-1), 0)
+        records, _ = self.storage.get_all(include_deleted=True,
+                                          **self.storage_kw)
+        self.assertEqual(len(records), 5)
+
+    def test_worker_is_only_started_with_retention(self):
+        with mock.patch('kinto.core.tombstones.threading.Thread') as mocked:
+            self.retention.ensure_worker()
+            self.assertFalse(mocked.called)
+            self.retention.retention = 3600
+            self.retention.ensure_worker()
+            self.retention.ensure_worker()
+        self.assertEqual(mocked.return_value.start.call_count, 1)
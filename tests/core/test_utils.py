@@ -16,7 +16,7 @@ from pyramid import testing
 from kinto.core.utils import (
     native_value, strip_whitespace, random_bytes_hex, read_env, hmac_digest,
     current_service, encode_header, decode_header, follow_subrequest,
-    build_request, dict_subset, dict_merge, parse_resource
+    build_request, dict_subset, dict_merge, dict_diff, parse_resource
 )
 from kinto.core.testing import DummyRequest
 
@@ -260,6 +260,28 @@ class DictMergeTest(unittest.TestCase):
         self.assertEqual(obtained, expected)
 
 
+class DictDiffTest(unittest.TestCase):
+
+    def test_diff_of_equal_dicts_is_empty(self):
+        self.assertEqual(dict_diff(dict(a=1, b=dict(c=2)),
+                                   dict(a=1, b=dict(c=2))), ([], []))
+
+    def test_diff_contains_added_and_removed_keys(self):
+        changes, removals = dict_diff(dict(a=1, b=2), dict(a=1, c=3))
+        self.assertEqual(changes, [(('c',), 3)])
+        self.assertEqual(removals, [('b',)])
+
+    def test_nested_dicts_are_compared_recursively(self):
+        changes, removals = dict_diff(dict(a=dict(b=1, c=2, d=[1])),
+                                      dict(a=dict(b=1, c=3, d=[1, 2])))
+        self.assertEqual(sorted(changes), [(('a', 'c'), 3), (('a', 'd'), [1, 2])])
+        self.assertEqual(removals, [])
+
+    def test_values_of_different_types_are_different(self):
+        changes, _ = dict_diff(dict(a=1, b=[1]), dict(a=True, b=[True]))
+        self.assertEqual(sorted(changes), [(('a',), True), (('b',), [True])])
+
+
 class ParseResourceTest(unittest.TestCase):
 
     expected = {
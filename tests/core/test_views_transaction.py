@@ -60,6 +60,18 @@ class PostgreSQLTest(BaseWebTest):
             side_effect=BackendError('boom'))
         self.addCleanup(patch.stop)
         patch.start()
+        # When both backends share the same database, the record and its
+        # ACEs are written together: fail once they were sent.
+        create_with_permissions = self.storage.create_with_permissions
+
+        def write_and_fail(*args, **kwargs):
+            create_with_permissions(*args, **kwargs)
+            raise BackendError('boom')
+
+        patch = mock.patch.object(self.storage, 'create_with_permissions',
+                                  side_effect=write_and_fail)
+        self.addCleanup(patch.stop)
+        patch.start()
         self.app.post_json('/psilos',
                            {'data': {'name': 'Amanite'}},
                            headers=self.headers,
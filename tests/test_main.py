@@ -134,6 +134,17 @@ class TestMain(unittest.TestCase):
             assert res == mock.sentinel.del_col_code
             assert del_col.call_count == 1
 
+    def test_cli_purge_tombstones_run_purge_tombstones_script(self):
+        with mock.patch('kinto.__main__.scripts.purge_tombstones') as purge:
+            purge.return_value = mock.sentinel.purge_code
+            res = main(['--ini', TEMP_KINTO_INI, 'init',
+                        '--backend', 'memory'])
+            assert res == 0
+            res = main(['--ini', TEMP_KINTO_INI, 'purge-tombstones',
+                        '--older-than', '3600'])
+            assert res == mock.sentinel.purge_code
+            purge.assert_called_with(mock.ANY, 3600)
+
     def test_cli_start_runs_pserve(self):
         with mock.patch('kinto.__main__.pserve.main') as mocked_pserve:
             res = main(['--ini', TEMP_KINTO_INI, 'init',
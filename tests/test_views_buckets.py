@@ -1,8 +1,14 @@
+import mock
 import unittest
 
+import transaction
 from pyramid.security import Authenticated
 
+from kinto.cascade import CascadeDeletion
+from kinto.core.permission import memory as memory_permission
+from kinto.core.storage import memory as memory_storage
 from kinto.core.testing import get_user_headers
+from kinto.core.utils import msec_time
 
 from .support import (BaseWebTest,
                       MINIMALIST_BUCKET, MINIMALIST_GROUP,
@@ -265,3 +271,190 @@ class BucketDeletionTest(BaseWebTest, unittest.TestCase):
         headers['If-None-Match'] = '*'
         self.app.put_json(self.bucket_url, MINIMALIST_BUCKET,
                           headers=headers, status=201)
+
+
+class BackgroundBucketDeletionTest(BucketDeletionTest):
+
+    def get_app_settings(self, extras=None):
+        settings = super(BackgroundBucketDeletionTest, self).get_app_settings(extras)
+        settings['cascade_deletion_background'] = 'true'
+        settings['cascade_deletion_chunk_size'] = '2'
+        return settings
+
+    def setUp(self):
+        patch = mock.patch('kinto.cascade.CascadeDeletion.ensure_worker')
+        patch.start()
+        self.addCleanup(patch.stop)
+        super(BackgroundBucketDeletionTest, self).setUp()
+        self.cascade_deletion = self.app.app.registry.cascade_deletion
+
+    def test_children_are_hidden_until_deleted(self):
+        records, _ = self.storage.get_all(collection_id='record',
+                                          parent_id=self.collection_url)
+        self.assertEqual(len(records), 1)
+        self.app.get(self.collection_url, headers=self.headers, status=404)
+        self.app.get(self.group_url, headers=self.headers, status=404)
+        self.app.get(self.record_url, headers=self.headers, status=404)
+
+    def test_children_are_deleted_by_chunks(self):
+        self.app.put_json('/buckets/other', MINIMALIST_BUCKET,
+                          headers=self.headers)
+        self.app.put_json('/buckets/other/collections/barley',
+                          MINIMALIST_COLLECTION, headers=self.headers)
+        for _ in range(3):
+            self.app.post_json('/buckets/other/collections/barley/records',
+                               MINIMALIST_RECORD, headers=self.headers)
+        with mock.patch.object(self.storage, 'delete_all',
+                               wraps=self.storage.delete_all) as mocked:
+            self.app.delete('/buckets/other', headers=self.headers)
+            deleted = self.cascade_deletion.run_pending()
+        # 4 records, 2 collections and 1 group.
+        self.assertEqual(deleted, 7)
+        self.assertTrue(mocked.called)
+        for call in mocked.call_args_list:
+            self.assertEqual(call[1]['limit'], 2)
+
+        records, _ = self.storage.get_all(collection_id='record',
+                                          parent_id='/buckets/*')
+        self.assertEqual(len(records), 0)
+        collections, _ = self.storage.get_all(collection_id='collection',
+                                              parent_id='/buckets/*')
+        self.assertEqual(len(collections), 0)
+        perms = self.permission.get_objects_permissions([self.record_url])
+        self.assertEqual(perms, [{}])
+
+    def test_jobs_are_removed_once_completed(self):
+        self.cascade_deletion.run_pending()
+        self.assertEqual(self.cascade_deletion.run_pending(), 0)
+        jobs, _ = self.storage.get_all(collection_id='cascade_deletion',
+                                       parent_id='')
+        self.assertEqual(len(jobs), 0)
+
+    def test_children_left_over_remain_hidden_once_created_again(self):
+        other_url = '/buckets/other'
+        barley_url = other_url + '/collections/barley'
+        self.app.put_json(other_url, MINIMALIST_BUCKET, headers=self.headers)
+        self.app.put_json(barley_url, MINIMALIST_COLLECTION,
+                          headers=self.headers)
+        for _ in range(3):
+            self.app.post_json(barley_url + '/records', MINIMALIST_RECORD,
+                               headers=self.headers)
+        self.app.delete(other_url, headers=self.headers)
+        # Only a chunk of records is deleted along the creation.
+        self.app.put_json(other_url, MINIMALIST_BUCKET, headers=self.headers)
+        collections, _ = self.storage.get_all(collection_id='collection',
+                                              parent_id=other_url)
+        self.assertEqual(len(collections), 1)
+
+        resp = self.app.get(other_url + '/collections', headers=self.headers)
+        self.assertEqual(resp.json['data'], [])
+        self.app.get(barley_url, headers=self.headers, status=404)
+        self.app.get(barley_url + '/records', headers=self.headers,
+                     status=404)
+
+        self.app.put_json(barley_url, MINIMALIST_COLLECTION,
+                          headers=self.headers, status=201)
+        resp = self.app.get(barley_url + '/records', headers=self.headers)
+        self.assertEqual(resp.json['data'], [])
+        self.app.post_json(barley_url + '/records', MINIMALIST_RECORD,
+                           headers=self.headers)
+
+        self.cascade_deletion.run_pending()
+        records, _ = self.storage.get_all(collection_id='record',
+                                          parent_id=barley_url)
+        self.assertEqual(len(records), 1)
+        self.app.get(barley_url, headers=self.headers)
+
+    def test_jobs_claimed_by_other_processes_are_skipped(self):
+        job = self.storage.get(collection_id='cascade_deletion',
+                               parent_id='', object_id=self.bucket_url)
+        job['claimed_until'] = msec_time() + 60000
+        with transaction.manager:
+            self.storage.update(collection_id='cascade_deletion', parent_id='',
+                                object_id=self.bucket_url, record=job)
+        self.assertEqual(self.cascade_deletion.run_pending(), 0)
+        records, _ = self.storage.get_all(collection_id='record',
+                                          parent_id=self.collection_url)
+        self.assertEqual(len(records), 1)
+
+    def test_jobs_are_taken_over_once_their_claim_expired(self):
+        job = self.storage.get(collection_id='cascade_deletion',
+                               parent_id='', object_id=self.bucket_url)
+        job['claimed_until'] = msec_time() - 1
+        with transaction.manager:
+            self.storage.update(collection_id='cascade_deletion', parent_id='',
+                                object_id=self.bucket_url, record=job)
+        self.assertEqual(self.cascade_deletion.run_pending(), 3)
+
+    def test_progress_is_sent_to_statsd(self):
+        self.cascade_deletion.statsd = mock.MagicMock()
+        self.cascade_deletion.run_pending()
+        self.cascade_deletion.statsd.count.assert_any_call(
+            'cascade_deletion.deleted', count=1)
+        self.cascade_deletion.statsd.count.assert_any_call(
+            'cascade_deletion.completed')
+
+
+class CascadeDeletionWorkerTest(unittest.TestCase):
+
+    def test_worker_is_started_once_per_process(self):
+        cascade_deletion = CascadeDeletion(mock.sentinel.storage,
+                                           mock.sentinel.permission,
+                                           background=True)
+        with mock.patch('kinto.cascade.threading.Thread') as mocked:
+            cascade_deletion.ensure_worker()
+            cascade_deletion.ensure_worker()
+        self.assertEqual(mocked.return_value.start.call_count, 1)
+
+
+class CascadeDeletionJobsCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.storage = memory_storage.Storage()
+        self.cascade_deletion = CascadeDeletion(
+            self.storage, memory_permission.Permission(), background=True,
+            cache_jobs=True)
+        self.uri = '/buckets/beers'
+        self.cascade_deletion.enqueue('bucket', self.uri)
+
+    def hidden_before(self, resource_name='collection'):
+        return self.cascade_deletion.hidden_before(self.uri, resource_name)
+
+    def test_jobs_are_read_once_while_not_modified(self):
+        with mock.patch.object(self.storage, 'get',
+                               wraps=self.storage.get) as mocked:
+            self.hidden_before('collection')
+            self.hidden_before('group')
+        self.assertEqual(mocked.call_count, 1)
+
+    def test_missing_jobs_are_cached_too(self):
+        self.uri = '/buckets/wines'
+        with mock.patch.object(self.storage, 'get',
+                               wraps=self.storage.get) as mocked:
+            self.assertIsNone(self.hidden_before())
+            self.assertIsNone(self.hidden_before())
+        self.assertEqual(mocked.call_count, 1)
+
+    def test_new_jobs_invalidate_the_cache(self):
+        self.uri = '/buckets/wines'
+        self.assertIsNone(self.hidden_before())
+        self.cascade_deletion.enqueue('bucket', self.uri)
+        self.assertIsNotNone(self.hidden_before())
+
+    def test_completed_jobs_invalidate_the_cache(self):
+        self.assertIsNotNone(self.hidden_before())
+        # Nothing to delete: the job is completed.
+        self.cascade_deletion.advance(self.uri)
+        self.assertIsNone(self.hidden_before())
+        # Its tombstone was purged.
+        jobs, _ = self.storage.get_all(collection_id='cascade_deletion',
+                                       parent_id='', include_deleted=True)
+        self.assertEqual(jobs, [])
+
+    def test_jobs_are_always_read_if_disabled(self):
+        self.cascade_deletion.cache_jobs = False
+        with mock.patch.object(self.storage, 'get',
+                               wraps=self.storage.get) as mocked:
+            self.hidden_before()
+            self.hidden_before()
+        self.assertEqual(mocked.call_count, 2)
@@ -1,3 +1,4 @@
+import mock
 import unittest
 
 from kinto.core.testing import get_user_headers
@@ -155,6 +156,66 @@ class CollectionDeletionTest(BaseWebTest, unittest.TestCase):
                           headers=headers, status=201)
 
 
+class BackgroundCollectionDeletionTest(CollectionDeletionTest):
+
+    def get_app_settings(self, extras=None):
+        settings = super(BackgroundCollectionDeletionTest, self).get_app_settings(extras)
+        settings['cascade_deletion_background'] = 'true'
+        settings['cascade_deletion_chunk_size'] = '1'
+        return settings
+
+    def setUp(self):
+        patch = mock.patch('kinto.cascade.CascadeDeletion.ensure_worker')
+        patch.start()
+        self.addCleanup(patch.stop)
+        super(BackgroundCollectionDeletionTest, self).setUp()
+
+    def test_records_are_hidden_until_deleted(self):
+        records, _ = self.storage.get_all(collection_id='record',
+                                          parent_id=self.collection_url)
+        self.assertEqual(len(records), 1)
+        self.app.get(self.record_url, headers=self.headers, status=404)
+
+    def test_records_are_deleted_by_the_worker(self):
+        cascade_deletion = self.app.app.registry.cascade_deletion
+        self.assertEqual(cascade_deletion.run_pending(), 1)
+        records, _ = self.storage.get_all(collection_id='record',
+                                          parent_id=self.collection_url)
+        self.assertEqual(len(records), 0)
+        perms = self.permission.get_object_permissions(self.record_url)
+        self.assertEqual(perms, {})
+
+    def test_records_left_over_remain_hidden_once_created_again(self):
+        records_url = self.collection_url + '/records'
+        self.app.put_json(self.collection_url, MINIMALIST_COLLECTION,
+                          headers=self.headers)
+        self.app.post_json(records_url, MINIMALIST_RECORD,
+                           headers=self.headers)
+        self.app.put_json(self.record_url, MINIMALIST_RECORD,
+                          headers=self.headers)
+        self.app.delete(self.collection_url, headers=self.headers)
+        # Only one record is deleted along the creation.
+        self.app.put_json(self.collection_url, MINIMALIST_COLLECTION,
+                          headers=self.headers)
+        records, _ = self.storage.get_all(collection_id='record',
+                                          parent_id=self.collection_url)
+        self.assertEqual(len(records), 1)
+
+        resp = self.app.get(records_url, headers=self.headers)
+        self.assertEqual(resp.json['data'], [])
+        resp = self.app.get(records_url + '?_since=0', headers=self.headers)
+        self.assertEqual(resp.json['data'], [])
+        left_over_url = '%s/%s' % (records_url, records[0]['id'])
+        self.app.get(left_over_url, headers=self.headers, status=404)
+        self.app.put_json(left_over_url, MINIMALIST_RECORD,
+                          headers=self.headers, status=201)
+
+        cascade_deletion = self.app.app.registry.cascade_deletion
+        cascade_deletion.run_pending()
+        resp = self.app.get(records_url, headers=self.headers)
+        self.assertEqual(len(resp.json['data']), 1)
+
+
 class CollectionCreationTest(BaseWebTest, unittest.TestCase):
 
     collections_url = '/buckets/beers/collections'
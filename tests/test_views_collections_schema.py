@@ -1,3 +1,6 @@
+import jsonschema
+import mock
+
 from kinto.core.testing import unittest
 
 from .support import BaseWebTest
@@ -117,6 +120,14 @@ class RecordsValidationTest(BaseWebTestWithSchema, unittest.TestCase):
                            headers=self.headers,
                            status=400)
 
+    def test_records_are_still_invalid_on_second_attempt(self):
+        for _ in range(2):
+            resp = self.app.post_json(RECORDS_URL,
+                                      {'data': {'body': '<h1>Without title</h1>'}},
+                                      headers=self.headers,
+                                      status=400)
+            self.assertEqual(resp.json['details'][0]['name'], 'title')
+
     def test_records_are_validated_on_patch(self):
         resp = self.app.post_json(RECORDS_URL,
                                   {'data': VALID_RECORD},
@@ -179,6 +190,29 @@ class RecordsValidationTest(BaseWebTestWithSchema, unittest.TestCase):
                             headers=self.headers)
         self.assertEqual(len(resp.json['data']), 1)
 
+    def test_schema_is_compiled_once_across_requests(self):
+        with mock.patch('jsonschema.validators.validator_for',
+                        wraps=jsonschema.validators.validator_for) as mocked:
+            for i in range(3):
+                self.app.post_json(RECORDS_URL,
+                                   {'data': VALID_RECORD},
+                                   headers=self.headers)
+        self.assertEqual(mocked.call_count, 1)
+
+    def test_new_schema_is_used_once_collection_is_modified(self):
+        self.app.post_json(RECORDS_URL,
+                           {'data': {'title': 42}},
+                           headers=self.headers,
+                           status=400)
+        newschema = dict(SCHEMA, properties={'title': {'type': 'integer'}})
+        self.app.put_json(COLLECTION_URL,
+                          {'data': {'schema': newschema}},
+                          headers=self.headers)
+        self.app.post_json(RECORDS_URL,
+                           {'data': {'title': 42}},
+                           headers=self.headers,
+                           status=201)
+
 
 class ExtraPropertiesValidationTest(BaseWebTestWithSchema, unittest.TestCase):
     def setUp(self):
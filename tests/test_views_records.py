@@ -66,11 +66,19 @@ class RecordsViewTest(BaseWebTest, unittest.TestCase):
                        'body': MINIMALIST_RECORD}
             batch['requests'].append(request)
 
-        with mock.patch.object(self.storage, 'get',
-                               wraps=self.storage.get) as patched:
+        parents_cache = self.app.app.registry.parents_cache
+        with mock.patch.object(parents_cache, 'object_exists_or_404',
+                               wraps=parents_cache.object_exists_or_404) as patched:
             self.app.post_json('/batch', batch, headers=self.headers)
             self.assertEqual(patched.call_count, 1)
 
+    def test_parent_collection_is_fetched_again_if_timestamps_are_not_cached(self):
+        self.app.get(self.collection_url, headers=self.headers)
+        with mock.patch.object(self.storage, 'get',
+                               wraps=self.storage.get) as patched:
+            self.app.get(self.collection_url, headers=self.headers)
+            self.assertTrue(patched.called)
+
     def test_individual_collections_can_be_deleted(self):
         resp = self.app.get(self.collection_url, headers=self.headers)
         self.assertEqual(len(resp.json['data']), 1)
@@ -78,6 +86,13 @@ class RecordsViewTest(BaseWebTest, unittest.TestCase):
         resp = self.app.get(self.collection_url, headers=self.headers)
         self.assertEqual(len(resp.json['data']), 0)
 
+    def test_records_are_deleted_and_read_with_one_storage_call(self):
+        storage = self.app.app.registry.storage
+        with mock.patch.object(storage, 'delete_all_with_old',
+                               wraps=storage.delete_all_with_old) as deleted:
+            self.app.delete(self.collection_url, headers=self.headers)
+        self.assertTrue(deleted.called)
+
     def test_records_can_be_added_to_collections(self):
         response = self.app.get(self.record_url, headers=self.headers)
         record = response.json['data']
@@ -301,6 +316,63 @@ class RecordsViewTest(BaseWebTest, unittest.TestCase):
                           headers=headers, status=201)
 
 
+class RecordsViewParentsCacheTest(BaseWebTest, unittest.TestCase):
+
+    collection_url = '/buckets/beers/collections/barley/records'
+
+    def setUp(self):
+        super(RecordsViewParentsCacheTest, self).setUp()
+        self.app.put_json('/buckets/beers', MINIMALIST_BUCKET,
+                          headers=self.headers)
+        self.app.put_json('/buckets/beers/collections/barley',
+                          MINIMALIST_COLLECTION,
+                          headers=self.headers)
+
+    def get_app_settings(self, extras=None):
+        settings = super(RecordsViewParentsCacheTest, self).get_app_settings(extras)
+        settings['storage_timestamps_cache'] = True
+        return settings
+
+    def test_parent_collection_is_not_fetched_again_across_requests(self):
+        self.app.get(self.collection_url, headers=self.headers)
+        with mock.patch.object(self.storage, 'get',
+                               wraps=self.storage.get) as patched:
+            self.app.get(self.collection_url, headers=self.headers)
+            self.assertFalse(patched.called)
+
+    def test_parent_collection_is_fetched_again_once_modified(self):
+        self.app.get(self.collection_url, headers=self.headers)
+        self.app.patch_json('/buckets/beers/collections/barley',
+                            {'data': {'cache_expires': 3600},
+                             'permissions': {'read': ['system.Everyone']}},
+                            headers=self.headers)
+        resp = self.app.get(self.collection_url)
+        self.assertIn('max-age=3600', resp.headers['Cache-Control'])
+
+    def test_parent_collection_is_not_served_once_bucket_is_deleted(self):
+        self.app.get(self.collection_url, headers=self.headers)
+        self.app.delete('/buckets/beers', headers=self.headers)
+        self.app.put_json('/buckets/beers', MINIMALIST_BUCKET,
+                          headers=self.headers)
+        self.app.get(self.collection_url, headers=self.headers, status=404)
+
+
+class BackgroundDeletionRecordsViewParentsCacheTest(RecordsViewParentsCacheTest):
+    """Pending deletion jobs are cached along with the parents."""
+
+    def get_app_settings(self, extras=None):
+        settings = super(BackgroundDeletionRecordsViewParentsCacheTest,
+                         self).get_app_settings(extras)
+        settings['cascade_deletion_background'] = True
+        return settings
+
+    def setUp(self):
+        patch = mock.patch('kinto.cascade.CascadeDeletion.ensure_worker')
+        patch.start()
+        self.addCleanup(patch.stop)
+        super(BackgroundDeletionRecordsViewParentsCacheTest, self).setUp()
+
+
 class RecordsViewMergeTest(BaseWebTest, unittest.TestCase):
 
     collection_url = '/buckets/beers/collections/barley/records'